@@ -21,13 +21,21 @@ from PIL import Image as pil
 import os
 import ctypes
 import sys
+import threading
+import weakref
 import camera
+import ToupcamBindings
+from ToupcamBindings import ToupcamError, HToupCam
 
 root = os.path.dirname(__file__)
-if sys.platform == 'darwin':
-    lib = ctypes.cdll.LoadLibrary(os.path.join(root, 'osx', 'libtoupcam.dylib'))
+if os.environ.get('TOUPCAM_SIMULATOR'):
+    import ToupcamSimulator
+    sdk = ToupcamSimulator.from_environment()
+elif sys.platform == 'darwin':
+    sdk = ToupcamBindings.load(os.path.join(root, 'osx', 'libtoupcam.dylib'))
 else:
-    lib = ctypes.windll.LoadLibrary(os.path.join(root, 'x64', 'toupcam.dll'))
+    sdk = ToupcamBindings.load(os.path.join(root, 'x64', 'toupcam.dll'))
+lib = sdk.lib
 
 TOUPCAM_EVENT_EXPOSURE = 1  # exposure time changed
 TOUPCAM_EVENT_TEMPTINT = 2  # white balance changed
@@ -38,32 +46,36 @@ TOUPCAM_EVENT_ERROR = 128  # something error happens
 TOUPCAM_EVENT_DISCONNECTED = 129  # camera disconnected
 TOUPCAM_EVENT_TIMEOUT = 130 # timeout
 
-class HToupCam(ctypes.Structure):
-    _fields_ = [('unused', ctypes.c_int)]
-
-def success(r):
-    """
-        return true if r==0
-    :param r:
-    :return:
-    """
-    return r == 0
-
+TOUPCAM_OPTION_TRIGGER = 0x0b  # 0 = video mode, 1 = software or simulated trigger mode
 
 class ToupCamCamera(object):
     _data = None
     _frame_fn = None
     _temptint_cb = None
     _save_path = None
+    _still = None
+    # Every ToupCamCamera not yet garbage collected, for memory accounting.
+    live = weakref.WeakSet()
 
-    def __init__(self, resolution=0, bits=32, camIndex=0):
+    def __init__(self, resolution=0, bits=32, camIndex=0, roi=None, buffers=None, trigger=False):
         if bits not in (32,):
             raise ValueError('Bits needs to be 8 or 32')
         # bits = 8
         self.timeout = False
+        self.disconnected = False
         self.resolution = resolution
+        self.roi = roi
+        # Frame buffers by (shape, dtype); pass a dict to keep them across opens.
+        self._buffers = {} if buffers is None else buffers
+        self._still_resolution = resolution
+        self._still_ready = threading.Event()
+        # In trigger mode the camera idles and sends one frame per trigger.
+        self.trigger_mode = trigger
+        self._image_ready = threading.Event()
+        self.camIndex = camIndex
         self.cam = self.get_camera(index=camIndex)
         self.bits = bits
+        ToupCamCamera.live.add(self)
 
     def __enter__(self):
         self.open()
@@ -75,7 +87,38 @@ class ToupCamCamera(object):
     # icamera interface
     def save(self, p):
         self._save_path = p
-        lib.Toupcam_Snap(self.cam, self.resolution)
+        self._still_resolution = self.resolution
+        sdk.Snap(self.cam, self.resolution)
+
+    def snap_still(self, resolution, timeout=5.0):
+        """
+        Snap a still at eSize ``resolution`` while the stream carries on at
+        its own, and return its buffer, or None if it did not arrive within
+        ``timeout``. The buffer is reused by the next still of that size.
+        """
+        self._still_resolution = resolution
+        self._still_ready.clear()
+        sdk.Snap(self.cam, resolution)
+        if not self._still_ready.wait(timeout):
+            return None
+        return self._still
+
+    def trigger(self):
+        """Ask a camera in trigger mode for one frame; wait_image returns it."""
+        self._image_ready.clear()
+        sdk.Trigger(self.cam, 1)
+
+    def wait_image(self, timeout=5.0):
+        """The frame a trigger asked for, or None if it did not arrive within ``timeout``."""
+        if not self._image_ready.wait(timeout):
+            return None
+        return self._data
+
+    def _buffer(self, shape, dtype):
+        key = (shape, dtype)
+        if key not in self._buffers:
+            self._buffers[key] = zeros(shape, dtype=dtype)
+        return self._buffers[key]
 
     def _do_save(self, im):
         image = self.get_pil_image(im)
@@ -97,8 +140,9 @@ class ToupCamCamera(object):
         b,g,r = image.split()
         return pil.merge('RGB', (r,g,b))
 
-    def get_np_image(self):
-        data = self.get_image_data()
+    def get_np_image(self, data=None):
+        if data is None:
+            data = self.get_image_data()
         raw = data.view(uint8).reshape(data.shape+(-1,))
         bgr = raw[...,:3]
         return bgr
@@ -107,13 +151,27 @@ class ToupCamCamera(object):
         d = self._data
         return d
 
+    def get_frame_count(self):
+        """Number of live frames pulled since the camera was opened."""
+        return self._cnt
+
     def close(self):
         if self.cam:
-            lib.Toupcam_Close(self.cam)
+            sdk.Close(self.cam)
+        # The callback closes over self; dropping it after Close, when the
+        # driver no longer calls it, lets this object be freed right away.
+        self._frame_fn = None
+        self._temptint_cb = None
 
     def open(self):
         self.set_esize(self.resolution)
-        args = self.get_size()
+        if self.roi:
+            try:
+                self.set_roi(*self.roi)
+            except ToupcamError as e:
+                print("ROI %s rejected, streaming the full frame: %s" % (self.roi, e))
+        # The final size is what PullImage delivers, after ROI cropping.
+        args = self.get_final_size()
         if not args:
             return
 
@@ -125,7 +183,7 @@ class ToupCamCamera(object):
         else:
             dtype = uint32
 
-        self._data = zeros(shape, dtype=dtype)
+        self._data = self._buffer(shape, dtype)
 
         self._cnt = 0
 
@@ -136,23 +194,26 @@ class ToupCamCamera(object):
             """
             if nEvent == TOUPCAM_EVENT_IMAGE:
                 w, h = ctypes.c_uint(), ctypes.c_uint()
-                bits = ctypes.c_int(self.bits)
-                lib.Toupcam_PullImage(self.cam, ctypes.c_void_p(self._data.ctypes.data), bits,
-                                      ctypes.byref(w),
-                                      ctypes.byref(h))
+                sdk.PullImage(self.cam, self._data.ctypes.data, self.bits,
+                              ctypes.byref(w), ctypes.byref(h))
+                self._cnt += 1
+                self._image_ready.set()
 
 
             elif nEvent == TOUPCAM_EVENT_STILLIMAGE:
-                w, h = self.get_size()
-                h, w = h.value, w.value
-
-                dtype = uint32
+                w, h = self.get_resolution(self._still_resolution)
                 shape = (h, w)
 
-                still = zeros(shape, dtype=dtype)
-                bits = ctypes.c_int(self.bits)
-                lib.Toupcam_PullStillImage(self.cam, ctypes.c_void_p(still.ctypes.data), bits, None, None)
-                self._do_save(still)
+                if self._save_path:
+                    still = self._buffer(shape, uint32)
+                    sdk.PullStillImage(self.cam, still.ctypes.data, self.bits, None, None)
+                    self._do_save(still)
+                    self._save_path = None
+                else:
+                    still = self._buffer(shape, uint32)
+                    sdk.PullStillImage(self.cam, still.ctypes.data, self.bits, None, None)
+                    self._still = still
+                    self._still_ready.set()
 
             elif nEvent == TOUPCAM_EVENT_TIMEOUT:
                 self.timeout = True
@@ -160,90 +221,96 @@ class ToupCamCamera(object):
             elif nEvent == TOUPCAM_EVENT_ERROR:
                 raise camera.CameraError()
             elif nEvent == TOUPCAM_EVENT_DISCONNECTED:
+                # Exceptions raised here are swallowed by ctypes, so leave a
+                # flag for AmscopeCamera.get_frame to pick up.
+                self.disconnected = True
                 raise camera.CameraDisconnectedError()
 
-        CB = ctypes.CFUNCTYPE(None, ctypes.c_uint, ctypes.c_void_p)
-
-        self._frame_fn = CB(get_frame)
-
-        result = lib.Toupcam_StartPullModeWithCallback(self.cam, self._frame_fn)
+        self._frame_fn = ToupcamBindings.EVENT_CALLBACK(get_frame)
 
-        return success(result)
+        try:
+            if self.trigger_mode:
+                sdk.put_Option(self.cam, TOUPCAM_OPTION_TRIGGER, 1)
+            sdk.StartPullModeWithCallback(self.cam, self._frame_fn, None)
+        except ToupcamError as e:
+            print(e)
+            return False
+        return True
 
     # ToupCam interface
-    def _lib_func(self, func, *args, **kw):
-        ff = getattr(lib, 'Toupcam_{}'.format(func))
-        result = ff(self.cam, *args, **kw)
-        return success(result)
-
-    def _lib_get_func(self, func):
-        v = ctypes.c_int()
-        if self._lib_func('get_{}'.format(func), ctypes.byref(v)):
-            return v.value
+    def _lib_get_func(self, func, ctype=ctypes.c_int):
+        v = ctype()
+        getattr(sdk, 'get_' + func)(self.cam, ctypes.byref(v))
+        return v.value
 
     def set_gamma(self, v):
-        self._lib_func('put_Gamma', ctypes.c_int(v))
+        sdk.put_Gamma(self.cam, v)
 
     def get_gamma(self):
         return self._lib_get_func('Gamma')
 
     def set_contrast(self, v):
-        self._lib_func('put_Contrast', ctypes.c_int(v))
+        sdk.put_Contrast(self.cam, v)
 
     def get_contrast(self):
         return self._lib_get_func('Contrast')
 
     def set_brightness(self, v):
-        self._lib_func('put_Brightness', ctypes.c_int(v))
+        sdk.put_Brightness(self.cam, v)
 
     def get_brightness(self):
         return self._lib_get_func('Brightness')
 
     def set_saturation(self, v):
-        self._lib_func('put_Saturation', ctypes.c_int(v))
+        sdk.put_Saturation(self.cam, v)
 
     def get_saturation(self):
         return self._lib_get_func('Saturation')
 
     def set_hue(self, v):
-        self._lib_func('put_Hue', ctypes.c_int(v))
+        sdk.put_Hue(self.cam, v)
 
     def get_hue(self):
         return self._lib_get_func('Hue')
 
-    """
-    # These functions cause a memory access violation error. Avoid!
-
-    def set_level_range(self, v):
-        self._lib_func('put_LevelRange', ctypes.c_int(v))
+    def set_level_range(self, low, high=None):
+        """
+        ``low`` and ``high`` are either one value for all channels or four
+        values (R, G, B, gray). With one argument only the upper level is set.
+        """
+        if high is None:
+            low, high = 0, low
+        sdk.put_LevelRange(self.cam, self._levels(low), self._levels(high))
 
     def get_level_range(self):
-        return self._lib_get_func('LevelRange')
-    """
+        low, high = ToupcamBindings.LEVEL_RANGE(), ToupcamBindings.LEVEL_RANGE()
+        sdk.get_LevelRange(self.cam, low, high)
+        return tuple(low), tuple(high)
+
+    def _levels(self, v):
+        if not hasattr(v, '__len__'):
+            v = (v,) * 4
+        return ToupcamBindings.LEVEL_RANGE(*v)
 
     def set_auto_exposure(self, v):
-        self._lib_func('put_AutoExpoTarget', ctypes.c_ushort(v))
+        sdk.put_AutoExpoTarget(self.cam, v)
 
     def get_auto_exposure(self):
-        return self._lib_get_func('AutoExpoTarget')
+        return self._lib_get_func('AutoExpoTarget', ctypes.c_ushort)
 
     def set_exposure_time(self, v):
-        self._lib_func('put_ExpoTime', ctypes.c_ulong(v))
+        """Exposure time in microseconds."""
+        sdk.put_ExpoTime(self.cam, v)
 
     def get_exposure_time(self):
-        return self._lib_get_func('get_ExpoTime')
+        return self._lib_get_func('ExpoTime', ctypes.c_uint)
 
     def set_exposure_gain(self, v):
-        self._lib_func('put_ExpoAGain', ctypes.c_ushort(v))
+        """Analog gain in percent, e.g. 300."""
+        sdk.put_ExpoAGain(self.cam, v)
 
     def get_exposure_gain(self):
-        self._lib_get_func('get_ExpoAGain')
-
-    # todo: write these functions
-    # toupcam_ports(HRESULT)  Toupcam_get_ExpoTime(HToupCam h, unsigned* Time); /* in microseconds */
-    # toupcam_ports(HRESULT)  Toupcam_put_ExpoTime(HToupCam h, unsigned Time); /* in microseconds */
-    # toupcam_ports(HRESULT)  Toupcam_get_ExpoAGain(HToupCam h, unsigned short* AGain); /* percent, such as 300 */
-    # toupcam_ports(HRESULT)  Toupcam_put_ExpoAGain(HToupCam h, unsigned short AGain); /* percent */
+        return self._lib_get_func('ExpoAGain', ctypes.c_ushort)
 
     def do_awb(self, callback=None):
         """
@@ -251,71 +318,87 @@ class ToupCamCamera(object):
         :return:
         """
 
-        def temptint_cb(temp, tint):
+        def temptint_cb(temp, tint, ctx):
             if callback:
                 callback((temp, tint))
 
-        CB = ctypes.CFUNCTYPE(None, ctypes.c_uint, ctypes.c_void_p)
-        self._temptint_cb = CB(temptint_cb)
+        self._temptint_cb = ToupcamBindings.TEMPTINT_CALLBACK(temptint_cb)
 
-        return self._lib_func('AwbOnePush', self._temptint_cb)
+        sdk.AwbOnePush(self.cam, self._temptint_cb, None)
+        return True
 
     def set_temperature_tint(self, temp, tint):
-        lib.Toupcam_put_TempTint(self.cam, temp, tint)
+        sdk.put_TempTint(self.cam, temp, tint)
 
     def get_temperature_tint(self):
         temp = ctypes.c_int()
         tint = ctypes.c_int()
-        if self._lib_func('get_TempTint', ctypes.byref(temp), ctypes.byref(tint)):
-            return temp.value, tint.value
+        sdk.get_TempTint(self.cam, ctypes.byref(temp), ctypes.byref(tint))
+        return temp.value, tint.value
 
     def get_auto_exposure_enabled(self):
-        expo_enabled = ctypes.c_bool()
-        result = lib.Toupcam_get_AutoExpoEnable(self.cam, ctypes.byref(expo_enabled))
-        if success(result):
-            return expo_enabled.value
+        return bool(self._lib_get_func('AutoExpoEnable'))
 
     def set_auto_exposure_enabled(self, expo_enabled):
-        lib.Toupcam_put_AutoExpoEnable(self.cam, expo_enabled)
+        sdk.put_AutoExpoEnable(self.cam, expo_enabled)
 
 
     def get_camera(self, index=None):
-        func = lib.Toupcam_OpenByIndex
-        func.restype = ctypes.POINTER(HToupCam)
-        cam = func(index)
-        return cam
+        return sdk.OpenByIndex(index)
 
     def get_serial(self):
         sn = ctypes.create_string_buffer(32)
-        result = lib.Toupcam_get_SerialNumber(self.cam, sn)
-        if success(result):
-            sn = sn.value
-            return sn
+        sdk.get_SerialNumber(self.cam, sn)
+        return sn.value
 
     def get_firmware_version(self):
         fw = ctypes.create_string_buffer(16)
-        result = lib.Toupcam_get_FwVersion(self.cam, fw)
-        if success(result):
-            return fw.value
+        sdk.get_FwVersion(self.cam, fw)
+        return fw.value
 
     def get_hardware_version(self):
         hw = ctypes.create_string_buffer(16)
-        result = lib.Toupcam_get_HwVersion(self.cam, hw)
-        if success(result):
-            return hw.value
+        sdk.get_HwVersion(self.cam, hw)
+        return hw.value
 
     def get_size(self):
-        w, h = ctypes.c_long(), ctypes.c_long()
+        w, h = ctypes.c_int(), ctypes.c_int()
+        try:
+            sdk.get_Size(self.cam, ctypes.byref(w), ctypes.byref(h))
+        except ToupcamError:
+            return None
+        return w, h
+
+    def get_final_size(self):
+        w, h = ctypes.c_int(), ctypes.c_int()
+        try:
+            sdk.get_FinalSize(self.cam, ctypes.byref(w), ctypes.byref(h))
+        except ToupcamError:
+            return None
+        return w, h
+
+    def set_roi(self, x, y, width, height):
+        """
+        Crop on the sensor, in pixels of the current eSize; width and height
+        of 0 restore the full frame. The SDK wants even values.
+        """
+        sdk.put_Roi(self.cam, x & ~1, y & ~1, width & ~1, height & ~1)
+
+    def get_roi(self):
+        x, y, width, height = ctypes.c_uint(), ctypes.c_uint(), ctypes.c_uint(), ctypes.c_uint()
+        sdk.get_Roi(self.cam, ctypes.byref(x), ctypes.byref(y), ctypes.byref(width), ctypes.byref(height))
+        return x.value, y.value, width.value, height.value
 
-        result = lib.Toupcam_get_Size(self.cam, ctypes.byref(w), ctypes.byref(h))
-        if success(result):
-            return w, h
+    def get_resolution(self, index):
+        """(width, height) of eSize ``index``."""
+        w, h = ctypes.c_int(), ctypes.c_int()
+        sdk.get_Resolution(self.cam, index, ctypes.byref(w), ctypes.byref(h))
+        return w.value, h.value
 
     def get_esize(self):
-        res = ctypes.c_long()
-        result = lib.Toupcam_get_eSize(self.cam, ctypes.byref(res))
-        if success(result):
-            return res
+        res = ctypes.c_uint()
+        sdk.get_eSize(self.cam, ctypes.byref(res))
+        return res
 
     def set_esize(self, nres):
-        lib.Toupcam_put_eSize(self.cam, ctypes.c_ulong(nres))
\ No newline at end of file
+        sdk.put_eSize(self.cam, nres)
@@ -5,15 +5,16 @@
     author: Jacob Kosberg
 """
 
-from SaveState import guisave, guirestore, guidebug
+from SaveState import guisave, guirestore, guivalues
 from PyQt4 import QtGui, QtCore, uic
 from camera import AmscopeCamera, WebCamera
 
 import time
 
 class AbstractCameraSettings(QtGui.QWidget):
-    def __init__(self, camera, device, change_signal):
+    def __init__(self, camera, device, change_signal, journal=None):
         self.change_detected = change_signal
+        self.journal = journal
         self.setWindowTitle("Camera Settings")
         self.camera = camera
         self.deviceId = device
@@ -72,10 +73,21 @@ class AbstractCameraSettings(QtGui.QWidget):
     def setRotation(self):
         self.camera.set_rotation(self.rotationSpinBox.value())
 
+    def getAverageFrames(self):
+        return self.averageSpinBox.value()
+
+    def getSigmaClip(self):
+        return self.sigmaClipSpinBox.value()
+
     def applySettings(self):
         for func in self.settingsFuncs:
             func()
-        guidebug(self)
+        self.journalSettings()
+
+    def journalSettings(self):
+        """Record changed settings in the journal; only diffs are written."""
+        if self.journal:
+            self.journal.record_settings(str(self.deviceNameStr), guivalues(self))
 
     def save(self):
         guisave(self)
@@ -91,9 +103,9 @@ class AbstractCameraSettings(QtGui.QWidget):
         event.accept()
 
 class WebCameraSettings(AbstractCameraSettings):
-    def __init__(self, camera, device, change_signal):
+    def __init__(self, camera, device, change_signal, journal=None):
         QtGui.QWidget.__init__(self)
-        AbstractCameraSettings.__init__(self, camera, device, change_signal)
+        AbstractCameraSettings.__init__(self, camera, device, change_signal, journal)
         ui_path = "ui/parameters"
         self.ui = uic.loadUi(ui_path + '.ui', self)
 
@@ -126,9 +138,9 @@ class WebCameraSettings(AbstractCameraSettings):
         pass
 
 class AmscopeCameraSettings(AbstractCameraSettings):
-    def __init__(self, camera, device, change_signal):
+    def __init__(self, camera, device, change_signal, journal=None):
         QtGui.QWidget.__init__(self)
-        AbstractCameraSettings.__init__(self, camera, device, change_signal)
+        AbstractCameraSettings.__init__(self, camera, device, change_signal, journal)
         ui_path = "ui/amscope_parameters"
         self.ui = uic.loadUi(ui_path + '.ui', self)
         self.serial = self.initDeviceSerial()
@@ -142,13 +154,18 @@ class AmscopeCameraSettings(AbstractCameraSettings):
         guirestore(self)
 
     def initDeviceSerial(self):
+        """The camera's serial, or None if it could not be opened."""
         self.camera.activate()
-        serial = str(self.camera.get_serial())
+        serial = self.camera.get_serial()
         self.camera.deactivate()
-        return serial
+        return str(serial) if serial else None
 
     def setDeviceSerial(self):
-        self.serialLabel.setText(self.serial)
+        # A camera that failed to open at startup gets its serial once it does.
+        if self.serial is None and not self.camera.disabled:
+            serial = self.camera.get_serial()
+            self.serial = str(serial) if serial else None
+        self.serialLabel.setText(self.serial or "")
 
     def setDeviceId(self):
         self.deviceIdLabel.setText(str(self.deviceId))
@@ -156,7 +173,17 @@ class AmscopeCameraSettings(AbstractCameraSettings):
     def wait(self, waitTime):
         time.sleep(waitTime)
 
+    def reset(self, waitTime):
+        # Changing the ROI reopens the camera, so it has to happen before the
+        # warm-up wait, not after it.
+        guirestore(self)
+        self.setRoi()
+        self.wait(waitTime)
+        self.applySettings()
+
     def wireSpecialUi(self):
+        # The ROI goes first: changing it reopens the camera.
+        self.settingsFuncs.insert(0, self.setRoi)
         self.settingsFuncs.extend([self.setTempTint, self.setHue,
                                 self.setGamma, self.setSaturation])
         self.connectObjs((self.gammaSlider, self.gammaSpinBox), self.setGamma)
@@ -164,10 +191,23 @@ class AmscopeCameraSettings(AbstractCameraSettings):
         self.connectObjs((self.tempSlider, self.tempSpinBox), self.setTempTint)
         self.connectObjs((self.tintSlider, self.tintSpinBox), self.setTempTint)
         self.connectObjs((self.hueSlider, self.hueSpinBox), self.setHue)
+        # Changing the ROI reopens the camera, so only apply finished edits.
+        for spinBox in (self.roiXSpinBox, self.roiYSpinBox, self.roiWidthSpinBox, self.roiHeightSpinBox):
+            spinBox.editingFinished.connect(self.setRoi)
 
     def setTempTint(self):
         self.camera.capture.set_temperature_tint(self.tempSpinBox.value(), self.tintSpinBox.value())
 
+    def getRoi(self):
+        """(x, y, width, height) on the sensor, or None for the full frame."""
+        width, height = self.roiWidthSpinBox.value(), self.roiHeightSpinBox.value()
+        if not width or not height:
+            return None
+        return (self.roiXSpinBox.value(), self.roiYSpinBox.value(), width, height)
+
+    def setRoi(self):
+        self.camera.set_roi(self.getRoi())
+
     def setHue(self):
         self.camera.set_parameter("hue", self.hueSpinBox.value())
 
@@ -7,23 +7,39 @@
 
 from SaveState import guisave, guirestore
 from PyQt4 import QtGui, QtCore, uic
+from recovery import CameraRecovery, CAMERA_FAILURES
 
+import burstCapture
 import camera
+import captureManifest
+import captureProcess
 import CameraSettings
+import changeDetector
+import encoders
+import frameAverager
+import frameHealth
+import frameServer
+import frameStore
+import journal
+import memoryMonitor
+import mosaic
+import storageTiers
+import thumbnails
+import timelapseVideo
 import cv2
 import time
 import os
 import argparse
 import sys
 
-# Used for profiling
-#from pympler import tracker
-
 # This is the time it takes to switch Amscope cameras. Used for interval
 # calculation. For webcams, we set equal to 0 since we don't deactivate
 # cameras. (Less risk of hitting USB bandwidth.)
 CAMERA_ACTIVATION_TIME_SECONDS = 5
 
+# How many times an unhealthy frame is re-grabbed before it is saved anyway.
+HEALTH_CHECK_RETRIES = 3
+
 HOME_FOLDER = "C:\Users\europaexpts\Documents\code\CameraWorkbench"
 
 class MainWindow(QtGui.QMainWindow):
@@ -38,8 +54,6 @@ class MainWindow(QtGui.QMainWindow):
         self.change_detected = change_signal
         self.worker = worker
         self.timelapse = TimeLapse(self.worker)
-        #self.tr = tracker.SummaryTracker()
-        #self.tr.print_diff()
         self.wireUiElements()
         self.populateDeviceList()
         self.setInitValues()
@@ -49,7 +63,7 @@ class MainWindow(QtGui.QMainWindow):
         self.deviceList.clear()
         for camera in self.worker.cameras:
             item = QtGui.QListWidgetItem(str(camera.deviceNameStr))
-            if camera.camera.disabled:
+            if camera.camera.disabled or self.worker.recovery.isDegraded(camera):
                 item.setForeground(QtGui.QColor(255, 0, 0))
             self.deviceList.addItem(item)
 
@@ -93,6 +107,9 @@ class MainWindow(QtGui.QMainWindow):
             lambda: self.worker.actionQueue.append(self.worker.captureAll))
         self.snapSelectedButton.clicked.connect(
             lambda: self.worker.actionQueue.append(self.worker.captureImage))
+        self.burstButton.clicked.connect(
+            lambda: self.worker.actionQueue.append(
+                lambda: self.worker.captureBurst(self.burstFramesSpinBox.value())))
 
         # Interval value and checkbox
         self.intervalSpinBox.valueChanged.connect(
@@ -114,7 +131,6 @@ class MainWindow(QtGui.QMainWindow):
     def switchCamera(self, item):
         i = int(self.deviceList.indexFromItem(item).row())
         self.worker.actionQueue.append(lambda: self.worker.switchCamera(i))
-        #self.tr.print_diff()
 
     def closeEvent(self, event):
         self.worker.running = False
@@ -152,15 +168,36 @@ class Worker(QtCore.QThread):
     self.cameras is actually a list of CameraSettings, which act as
     camera managers.
     """
-    def __init__(self, cameras):
+    def __init__(self, cameras, journal=None):
         QtCore.QThread.__init__(self)
         self.cameras = cameras
+        self.journal = journal
         self.camera = None
         self.running = True
         self.scale = 60
         self.previewEnabled = False
         self.reconstructEnabled = False
         self.actionQueue = []
+        self.recovery = CameraRecovery()
+        self.encoder = encoders.get_encoder(encoders.DEFAULT_PRESET)
+        self.frameStoreEnabled = False
+        self.frameStores = {}
+        self.changeDetector = None
+        self.frameHealth = None
+        self.healthAction = "alert"
+        self.syncWebcams = False
+        self.triggerMode = False
+        self.thumbnails = None
+        self.videoRecorder = None
+        self.burstRing = None
+        self.mosaic = None
+        self.frameServer = None
+        self.memoryMonitor = None
+        self.storage = None
+        self.manifestEnabled = False
+        self.manifest = None
+        self.fileNamer = burstCapture.FileNamer()
+        self.groupSkews = []
 
     def run(self):
         while self.running:
@@ -170,6 +207,16 @@ class Worker(QtCore.QThread):
     def idle(self):
         while self.actionQueue:
             self.actionQueue.pop(0)()
+        self.recovery.poll()
+        if self.journal:
+            self.journal.flush_if_due()
+        if self.manifest:
+            self.manifest.flush_if_due()
+        self.feedFrameServer()
+        if self.storage:
+            self.storage.poll()
+        if self.memoryMonitor:
+            self.memoryMonitor.poll([(cs.deviceNameStr, cs.camera) for cs in self.cameras])
         self.show_frame()
 
     def createPathIfNotExists(self, path):
@@ -181,53 +228,408 @@ class Worker(QtCore.QThread):
             raise ValueError("Path cannot be empty!")
 
     def show_frame(self):
+        if self.mosaic:
+            self.show_mosaic()
+            return
         title = "Preview"
         try:
-            if self.previewEnabled and self.camera.camera.capture:
+            if (self.previewEnabled and self.camera and self.camera.camera.capture
+                    and not self.recovery.isDegraded(self.camera)):
                 self.camera.camera.show_frame(title, scale=self.scale)
             else:
                 cv2.destroyWindow(title)
-        except AttributeError as e:
-            print(e)
+        except CAMERA_FAILURES as e:
             print "A camera was detached!"
-            self.kill()
+            self.recovery.markDegraded(self.camera, e)
+
+    def show_mosaic(self):
+        """
+        Preview every camera at once. Cameras with an open capture feed
+        their tile; the others keep their last frame and show its age.
+        """
+        title = "Mosaic"
+        if not self.previewEnabled:
+            cv2.destroyWindow(title)
+            return
+        if not self.mosaic.due():
+            return
+        for i, cameraSettings in enumerate(self.cameras):
+            cam = cameraSettings.camera
+            if not cam.capture or cam.disabled or self.recovery.isDegraded(cameraSettings):
+                continue
+            try:
+                frame = cam.get_frame()
+                if frame is not None:
+                    self.mosaic.update(i, frame)
+            except CAMERA_FAILURES as e:
+                print("A camera was detached!")
+                self.recovery.markDegraded(cameraSettings, e)
+        cv2.imshow(title, self.mosaic.render([cs.deviceNameStr for cs in self.cameras]))
+        cv2.waitKey(1)
+
+    def feedFrameServer(self):
+        """Publish live frames of active cameras while anyone is streaming them."""
+        if not self.frameServer or not self.frameServer.clients:
+            return
+        for i, cameraSettings in enumerate(self.cameras):
+            cam = cameraSettings.camera
+            if (not self.frameServer.due(i) or not cam.capture or cam.disabled
+                    or self.recovery.isDegraded(cameraSettings)):
+                continue
+            try:
+                frame = cam.get_frame()
+                if frame is not None:
+                    self.frameServer.publish(i, frame)
+            except CAMERA_FAILURES as e:
+                print("A camera was detached!")
+                self.recovery.markDegraded(cameraSettings, e)
 
     def captureAll(self):
-        images = []
-        for i in range(len(self.cameras)):
-            self.switchCamera(i)
-            images.append(self.captureImage())
+        """
+        Capture one image from every camera. Degraded cameras are skipped
+        and counted as lost captures so the rest stay on schedule.
+        """
+        if self.triggerMode:
+            images = self.captureTriggered()
+        elif self.syncWebcams:
+            images = self.captureGroup()
+        else:
+            images = self.captureSequential()
 
         if self.reconstructEnabled:
             import reconstructor
             outputDir = os.path.join(self.imagesPath, "reconstruction", self.getDateString())
             self.createPathIfNotExists(outputDir)
-            reconstructor.convertPngsToJpgs(images, outputDir)
+            reconstructor.convertPngsToJpgs([image for image in images if image], outputDir)
             reconstructor.runCMPMVS(outputDir)
-        self.camera.camera.deactivate()
+        if self.camera and not self.triggerMode:
+            self.camera.camera.deactivate()
+
+    def captureSequential(self):
+        """Activate and capture each camera in turn."""
+        images = []
+        for i in range(len(self.cameras)):
+            cameraSettings = self.cameras[i]
+            if self.recovery.isDegraded(cameraSettings):
+                self.recovery.recordLostCapture(cameraSettings)
+                continue
+            try:
+                self.switchCamera(i)
+                if self.recovery.isDegraded(cameraSettings):
+                    self.recovery.recordLostCapture(cameraSettings)
+                    continue
+                images.append(self.captureImage())
+            except CAMERA_FAILURES as e:
+                self.recovery.markDegraded(cameraSettings, e)
+                self.recovery.recordLostCapture(cameraSettings)
+        return images
+
+    def captureGroup(self):
+        """
+        Latch a frame on every webcam back to back, then decode and save
+        them, so frames of one round are close together in time.
+        """
+        group = [cs for cs in self.cameras if not self.recovery.isDegraded(cs)]
+        for cameraSettings in self.cameras:
+            if cameraSettings not in group:
+                self.recovery.recordLostCapture(cameraSettings)
+
+        frames, skew = camera.grab_synchronized([cs.camera for cs in group])
+        self.groupSkews.append(skew)
+        print("Group capture skew: %.1f ms" % (skew * 1000))
+
+        images = []
+        for cameraSettings, frame in zip(group, frames):
+            try:
+                if frame is None:
+                    raise camera.CameraDisconnectedError("Camera %s missed the group grab." %
+                        cameraSettings.deviceNameStr)
+                images.append(self.processFrame(cameraSettings, frame))
+            except CAMERA_FAILURES as e:
+                self.recovery.markDegraded(cameraSettings, e)
+                self.recovery.recordLostCapture(cameraSettings)
+        return images
+
+    def captureTriggered(self):
+        """
+        Amscopes in trigger mode stay open, idle, between rounds. Trigger
+        every camera back to back, then save the one frame each sends.
+        Cameras are only activated for their first round, or after they
+        recover.
+        """
+        group = []
+        for cameraSettings in self.cameras:
+            if not self.recovery.isDegraded(cameraSettings) and not cameraSettings.camera.capture:
+                self.activateCamera(cameraSettings)
+            if self.recovery.isDegraded(cameraSettings):
+                self.recovery.recordLostCapture(cameraSettings)
+                continue
+            group.append(cameraSettings)
+
+        fired = []
+        for cameraSettings in group:
+            # Averaged captures trigger each of their frames themselves.
+            if cameraSettings.getAverageFrames() > 1:
+                continue
+            try:
+                cameraSettings.camera.fire_trigger()
+                fired.append(cameraSettings)
+            except CAMERA_FAILURES as e:
+                self.recovery.markDegraded(cameraSettings, e)
+                self.recovery.recordLostCapture(cameraSettings)
+
+        images = []
+        for cameraSettings in group:
+            if self.recovery.isDegraded(cameraSettings):
+                continue
+            try:
+                if cameraSettings in fired:
+                    frame = cameraSettings.camera.get_triggered_frame()
+                else:
+                    frame = self.captureAveraged(cameraSettings)
+                if frame is None:
+                    raise camera.CameraTimeoutError("Camera %s gave no frame." % cameraSettings.deviceNameStr)
+                images.append(self.processFrame(cameraSettings, frame))
+            except CAMERA_FAILURES as e:
+                self.recovery.markDegraded(cameraSettings, e)
+                self.recovery.recordLostCapture(cameraSettings)
+        return images
 
     def captureImage(self):
         cameraSettings = self.camera
         print("1")
         #cameraSettings.reset(CAMERA_ACTIVATION_TIME_SECONDS)
         print("2")
-        frame = cameraSettings.camera.get_frame()
+        if self.canPassthrough(cameraSettings) and cameraSettings.getAverageFrames() <= 1:
+            wall, captured = time.time(), captureManifest.monotonic()
+            data = cameraSettings.camera.get_jpeg_data()
+            if data:
+                filename = self.getImageFilepath(self.imagesPath, cameraSettings.deviceNameStr, ".jpg")
+                with open(filename, "wb") as f:
+                    f.write(data)
+                self.archive(filename)
+                self.recordCapture(cameraSettings, filename, None, wall, captured, "passthrough")
+                if self.journal:
+                    cameraSettings.journalSettings()
+                    self.journal.record_capture(str(cameraSettings.deviceNameStr), filename)
+                return filename
+        if cameraSettings.getAverageFrames() > 1:
+            frame = self.captureAveraged(cameraSettings)
+        else:
+            frame = cameraSettings.camera.get_capture_frame()
+        if frame is None:
+            raise camera.CameraTimeoutError("Camera %s gave no frame." % cameraSettings.deviceNameStr)
+        return self.processFrame(cameraSettings, frame)
+
+    def captureBurst(self, count):
+        """
+        Grab ``count`` frames from the selected camera as fast as it
+        delivers them. Frames are staged in memory and written out in the
+        background with the selected encoder, skipping health checks, change
+        detection, thumbnails and video.
+        """
+        cameraSettings = self.camera
+        if not cameraSettings or self.recovery.isDegraded(cameraSettings):
+            print("Select an active camera to burst.")
+            return []
+        deviceName = cameraSettings.deviceNameStr
+        try:
+            frame = cameraSettings.camera.get_new_frame()
+            if frame is None:
+                raise camera.CameraTimeoutError("Camera %s gave no frame." % deviceName)
+            if self.burstRing is None or not self.burstRing.fits(frame):
+                if self.burstRing:
+                    self.burstRing.stop()
+                self.burstRing = burstCapture.BurstRing(frame.shape, frame.dtype)
+                self.burstRing.start()
+            if self.manifestEnabled:
+                # Opened here, in the worker thread, before the flush thread records to it.
+                self.getManifest()
+            def written(filename, shape, wall, captured):
+                self.archive(filename)
+                self.recordCapture(cameraSettings, filename, shape, wall, captured)
+            filenames = self.burstRing.capture(cameraSettings.camera, count,
+                self.getDevicePath(self.imagesPath, deviceName), self.fileNamer, str(deviceName),
+                self.encoder, firstFrame=frame, written=written)
+        except CAMERA_FAILURES as e:
+            self.recovery.markDegraded(cameraSettings, e)
+            return []
+        if self.journal:
+            cameraSettings.journalSettings()
+            for filename in filenames:
+                self.journal.record_capture(str(deviceName), filename, burst=True)
+        return filenames
+
+    def captureAveraged(self, cameraSettings):
+        """
+        Average the next N frames the camera delivers, with optional
+        sigma-clipping, as set in the camera's settings window.
+        """
+        count = cameraSettings.getAverageFrames()
+        averager = None
+        start = time.time()
+        for i in range(count):
+            frame = cameraSettings.camera.get_capture_frame(new=True)
+            if frame is None:
+                return None
+            if averager is None:
+                averager = frameAverager.FrameAverager(frame.shape, cameraSettings.getSigmaClip())
+            averager.add(frame)
+        print("Camera %s: averaged %d frames in %.1f s (%.1f ms per frame to accumulate)" %
+            (cameraSettings.deviceNameStr, count, time.time() - start, averager.cost_ms()))
+        return averager.result()
+
+    def canPassthrough(self, cameraSettings):
+        """
+        A webcam's JPEG bytes can go straight to disk when nothing needs the
+        decoded frame: no health checks, change detection, frame store,
+        thumbnails or video.
+        """
+        return getattr(cameraSettings.camera, "passthrough", False) and \
+            not (self.frameHealth or self.changeDetector or self.frameStoreEnabled
+                or self.thumbnails or self.videoRecorder)
+
+    def processFrame(self, cameraSettings, frame):
+        """Health check, change detection and saving of a captured frame."""
+        wall, captured = time.time(), captureManifest.monotonic()
+        frame = self.checkFrameHealth(cameraSettings, frame)
         print("3")
+        deviceName = cameraSettings.deviceNameStr
+        if self.changeDetector and not self.changeDetector.shouldSave(deviceName, frame):
+            print("No change on camera %s; frame not saved." % deviceName)
+            return None
+        start = time.time()
+        filename = self.saveFrame(cameraSettings, frame)
+        self.archive(filename)
+        self.recordCapture(cameraSettings, filename, frame.shape, wall, captured)
+        if self.journal:
+            # Settings changed in the window since activation are live
+            # already; record them before the capture that used them.
+            cameraSettings.journalSettings()
+            self.journal.record_capture(str(deviceName), filename)
+        if self.changeDetector:
+            nbytes = os.path.getsize(filename) if filename else frame.nbytes
+            self.changeDetector.recordSave(deviceName, time.time() - start, nbytes)
+        if self.thumbnails:
+            name = os.path.splitext(os.path.basename(filename))[0] if filename else self.fileNamer.name(str(deviceName))
+            self.thumbnails.submit(frame, self.getDevicePath(self.imagesPath, deviceName), name)
+        if self.videoRecorder:
+            self.videoRecorder.submit(frame, self.getDevicePath(self.imagesPath, deviceName))
+        if self.frameServer:
+            self.frameServer.publish(self.cameras.index(cameraSettings), frame)
+        print("5")
+        return filename
+
+    def checkFrameHealth(self, cameraSettings, frame):
+        """
+        Run the frame health checks and take the configured action on a
+        flagged frame. Returns the frame to save.
+        """
+        if not self.frameHealth:
+            return frame
+        deviceName = cameraSettings.deviceNameStr
+        for attempt in range(HEALTH_CHECK_RETRIES):
+            flags = self.frameHealth.check(deviceName, frame)
+            if not flags:
+                return frame
+            print("Camera %s: unhealthy frame (%s)" % (deviceName, ", ".join(flags)))
+            if self.healthAction == "alert":
+                return frame
+            if self.healthAction == "reactivate":
+                cameraSettings.camera.activate()
+                cameraSettings.reset(CAMERA_ACTIVATION_TIME_SECONDS)
+            else:
+                time.sleep(0.5)
+            frame = cameraSettings.camera.get_capture_frame()
+            if frame is None:
+                raise camera.CameraTimeoutError("Camera %s gave no frame." % deviceName)
+        print("Camera %s: still unhealthy after %d attempts; saving anyway." %
+            (deviceName, HEALTH_CHECK_RETRIES))
+        return frame
+
+    def saveFrame(self, cameraSettings, frame):
+        """
+        Write a captured frame to disk. Returns the image file name, or None
+        if the frame went into the camera's frame store instead.
+        """
+        if self.frameStoreEnabled:
+            self.getFrameStore(cameraSettings.deviceNameStr).append(frame)
+            return None
         filename = self.getImageFilepath(self.imagesPath, cameraSettings.deviceNameStr)
         print("4")
-        cv2.imwrite(filename, frame)
-        print("5")
+        self.encoder.write(filename, frame)
         return filename
 
-    def getImageFilepath(self, path, deviceName):
+    def getFrameStore(self, deviceName):
         """
-        Creates file path under 'deviceName' folder in parent images path.
-        Uses date and time as filename. Ex: '2017-08-08_10-29-57.png'
+        Frame store under 'deviceName' folder in parent images path. Unlike
+        other captures it is written to the capture path even when captures
+        are staged: its index and last chunk grow with every frame and are
+        appended to again by later runs, so there is never a finished file
+        to migrate, and pruning the staged copy would restart the store.
+        Appends are raw sequential writes, with no encoding to hold up.
+        """
+        if deviceName not in self.frameStores:
+            self.assertPathNotNull(self.imagesPath)
+            path = os.path.join(self.imagesPath, str(deviceName), "frames")
+            self.frameStores[deviceName] = frameStore.FrameStoreWriter(path)
+        return self.frameStores[deviceName]
+
+    def closeFrameStores(self):
+        for store in self.frameStores.values():
+            store.close()
+        self.frameStores = {}
+
+    def getManifest(self):
+        """Capture manifest of the images path."""
+        if self.manifest is None:
+            self.assertPathNotNull(self.imagesPath)
+            self.manifest = captureManifest.Manifest(self.imagesPath)
+        return self.manifest
+
+    def closeManifest(self):
+        if self.manifest:
+            self.manifest.close()
+            self.manifest = None
+
+    def recordCapture(self, cameraSettings, filename, shape, wall, captured, encoder=None):
+        """
+        Add a capture file to the manifest, under its path below the capture
+        path (the same below staging).
+        """
+        if not self.manifestEnabled or not filename:
+            return
+        root = self.storage.stagingPath if self.storage else self.imagesPath
+        serial = getattr(cameraSettings, "serial", None)
+        self.getManifest().record(os.path.relpath(filename, root), str(cameraSettings.deviceNameStr),
+            str(serial) if serial is not None else None, wall, captured, shape, encoder or self.encoder.name)
+
+    def archive(self, filename):
+        """Queue a capture written to staging for migration to the capture path."""
+        if self.storage and filename:
+            self.storage.submit(filename, self.imagesPath)
+
+    def getDevicePath(self, path, deviceName):
+        """
+        Creates 'deviceName' folder in parent images path, or in the
+        staging folder when captures are staged.
         """
         self.assertPathNotNull(path)
+        if self.storage:
+            path = self.storage.stagingPath
         newPath = os.path.join(path, str(deviceName))
         self.createPathIfNotExists(newPath)
-        return os.path.join(newPath, self.getDateString() + ".png")
+        return newPath
+
+    def getImageFilepath(self, path, deviceName, extension=None):
+        """
+        Creates file path under 'deviceName' folder in parent images path.
+        Uses date and time to the microsecond as filename, unique per camera.
+        Ex: '2017-08-08_10-29-57-123456.png'
+        The extension follows the selected encoder unless given.
+        """
+        newPath = self.getDevicePath(path, deviceName)
+        return os.path.join(newPath, self.fileNamer.name(str(deviceName)) + (extension or self.encoder.extension))
 
     def getDateString(self):
         return time.strftime("%Y-%m-%d_%H-%M-%S")
@@ -238,43 +640,206 @@ class Worker(QtCore.QThread):
     def setReconstructEnabled(self, enabled):
         self.reconstructEnabled = enabled
 
+    def setEncoder(self, spec):
+        self.encoder = encoders.get_encoder(spec)
+
+    def setChangeDetection(self, threshold, metric="diff", keyframeInterval=10):
+        """Only save frames that changed by ``threshold``; 0 saves every frame."""
+        if threshold > 0:
+            self.changeDetector = changeDetector.ChangeDetector(threshold, metric, keyframeInterval)
+        else:
+            self.changeDetector = None
+
+    def setThumbnailWidths(self, widths):
+        """Generate thumbnails of these widths for every capture; empty disables."""
+        if self.thumbnails:
+            self.thumbnails.stop()
+            self.thumbnails = None
+        if widths:
+            self.thumbnails = thumbnails.ThumbnailWriter(widths, onWritten=self.archive)
+            self.thumbnails.start()
+
+    def setVideoEnabled(self, enabled, framesPerPart=timelapseVideo.FRAMES_PER_PART):
+        """Also append every capture to a rolling per-camera timelapse video."""
+        if self.videoRecorder:
+            self.videoRecorder.stop()
+            self.videoRecorder = None
+        if enabled:
+            self.videoRecorder = timelapseVideo.VideoRecorder(framesPerPart=framesPerPart, onClosed=self.archive)
+            self.videoRecorder.start()
+
+    def setMosaicEnabled(self, enabled, maxFps=mosaic.MAX_FPS):
+        """Preview all cameras tiled in one window instead of the selected one."""
+        self.mosaic = mosaic.Mosaic(len(self.cameras), maxFps=maxFps) if enabled else None
+
+    def setFrameServer(self, port, host="127.0.0.1", maxFps=frameServer.MAX_FPS):
+        """Serve MJPEG streams and snapshots of every camera on ``port``; 0 disables."""
+        if self.frameServer:
+            self.frameServer.stop()
+            self.frameServer = None
+        if port:
+            self.frameServer = frameServer.FrameServer(
+                [cs.deviceNameStr for cs in self.cameras], port, host, maxFps)
+
+    def setMemoryMonitor(self, interval):
+        """Sample memory use every ``interval`` seconds and alert on growth; 0 disables."""
+        self.memoryMonitor = memoryMonitor.MemoryMonitor(interval) if interval else None
+
+    def setStaging(self, stagingPath, threads=storageTiers.MIGRATE_THREADS,
+            retentionHours=storageTiers.RETENTION_HOURS, minFreeGB=storageTiers.MIN_FREE_GB):
+        """
+        Write captures to ``stagingPath`` and migrate them to the capture
+        path in the background; None writes to the capture path directly.
+        """
+        if self.storage:
+            self.storage.stop()
+            self.storage = None
+        if stagingPath:
+            self.storage = storageTiers.StorageTiers(stagingPath, threads, retentionHours, minFreeGB)
+
+    def resumeStaging(self):
+        """Queue captures an earlier run left in staging, once the capture path is known."""
+        if self.storage:
+            resumed = self.storage.resume(self.imagesPath)
+            if resumed:
+                print("%d staged captures from an earlier run queued for the archive." % resumed)
+
+    def setManifestEnabled(self, enabled):
+        self.manifestEnabled = enabled
+
+    def setTriggerMode(self, enabled):
+        self.triggerMode = enabled
+
+    def setSyncWebcams(self, enabled):
+        self.syncWebcams = enabled
+
+    def setHealthAction(self, action):
+        """One of frameHealth.ACTIONS, or None to skip the health checks."""
+        if action:
+            self.frameHealth = frameHealth.FrameHealth()
+            self.healthAction = action
+        else:
+            self.frameHealth = None
+
+    def setFrameStoreEnabled(self, enabled):
+        self.frameStoreEnabled = enabled
+
     def setImagesPath(self, path):
+        # Stores are written from the worker thread, so close them there too.
+        self.actionQueue.append(self.closeFrameStores)
+        self.actionQueue.append(self.closeManifest)
         self.imagesPath = path
 
     def setScale(self, scale):
         self.scale = scale
 
     def switchCamera(self, index):
-        if self.camera:
+        # Cameras in trigger mode don't stream, so they all stay open.
+        if self.camera and not self.triggerMode:
             self.camera.camera.deactivate()
         self.camera = self.cameras[index]
-        self.camera.camera.activate()
-        self.camera.reset(CAMERA_ACTIVATION_TIME_SECONDS)
-        self.camera.setDeviceSerial()
-        self.camera.setDeviceId()
+        if not (self.triggerMode and self.camera.camera.capture):
+            self.activateCamera(self.camera)
+
+    def activateCamera(self, cameraSettings):
+        try:
+            cameraSettings.camera.activate()
+            if cameraSettings.camera.disabled:
+                raise IOError("Camera %s could not be activated." % cameraSettings.deviceNameStr)
+            cameraSettings.reset(CAMERA_ACTIVATION_TIME_SECONDS)
+            cameraSettings.setDeviceSerial()
+            cameraSettings.setDeviceId()
+        except CAMERA_FAILURES as e:
+            self.recovery.markDegraded(cameraSettings, e)
 
     def kill(self):
         self.running = False
+        for line in self.recovery.report():
+            print(line)
+        if self.changeDetector:
+            for line in self.changeDetector.report():
+                print(line)
+        if self.frameHealth:
+            for line in self.frameHealth.report():
+                print(line)
+        if self.thumbnails:
+            self.thumbnails.stop()
+            print(self.thumbnails.report())
+        if self.videoRecorder:
+            self.videoRecorder.stop()
+            print(self.videoRecorder.report())
+        if self.storage:
+            self.storage.stop()
+            for line in self.storage.report():
+                print(line)
+        if self.memoryMonitor:
+            for line in self.memoryMonitor.report():
+                print(line)
+        if self.frameServer:
+            self.frameServer.stop()
+            for line in self.frameServer.report():
+                print(line)
+        if self.burstRing:
+            self.burstRing.stop()
+            for line in self.burstRing.report():
+                print(line)
+        if self.groupSkews:
+            print("Group capture skew: mean %.1f ms, max %.1f ms over %d rounds" %
+                (1000 * sum(self.groupSkews) / len(self.groupSkews),
+                1000 * max(self.groupSkews), len(self.groupSkews)))
         for cam in self.cameras:
             cam.camera.close()
+        self.closeFrameStores()
+        self.closeManifest()
+        if self.journal:
+            self.journal.flush()
 
 class Application(QtGui.QApplication):
     change_detected = QtCore.pyqtSignal()
     def __init__(self, args):
         super(Application, self).__init__(["Camera Workbench"])
         
+        options = {}
         if args.use_amscope:
             Camera = camera.AmscopeCamera
             CameraManager = CameraSettings.AmscopeCameraSettings
+            options["dynamicResolution"] = args.dynamic_resolution
+            # Camera processes poll their camera's stream, so they keep streaming.
+            options["trigger"] = args.trigger and not args.processes
         else:
             Camera = camera.WebCamera
             CameraManager = CameraSettings.WebCameraSettings
+            options["backgroundReader"] = args.webcam_reader
+            options["fourcc"] = args.webcam_fourcc
+            options["passthrough"] = args.passthrough
+
+        if args.processes:
+            makeCamera = lambda device: captureProcess.ProcessCamera(Camera, device, fullRes=True, **options)
+        else:
+            makeCamera = lambda device: Camera(device, fullRes=True, **options)
 
-        cams = [CameraManager(Camera(device, fullRes=True), device, change_signal=self.change_detected) 
+        settingsJournal = journal.Journal()
+        cams = [CameraManager(makeCamera(device), device, change_signal=self.change_detected,
+                    journal=settingsJournal) 
                     for device in args.devices]
-        worker = Worker(cams)
+        worker = Worker(cams, settingsJournal)
+        worker.setEncoder(args.encoder)
+        worker.setFrameStoreEnabled(args.frame_store)
+        worker.setManifestEnabled(not args.no_manifest)
+        # Grouped grabs need the VideoCaptures, which live in the camera processes.
+        worker.setSyncWebcams(args.sync_webcams and not args.use_amscope and not args.processes)
+        worker.setTriggerMode(options.get("trigger", False))
+        worker.setHealthAction(args.health_action)
+        worker.setThumbnailWidths(thumbnails.parse_widths(args.thumbnails))
+        worker.setVideoEnabled(args.video, args.video_part_frames)
+        worker.setMosaicEnabled(args.mosaic, args.mosaic_fps)
+        worker.setFrameServer(args.serve, args.serve_host, args.serve_fps)
+        worker.setMemoryMonitor(args.memory_monitor)
+        worker.setStaging(args.staging, args.migrate_threads, args.staging_retention, args.min_free_gb)
+        worker.setChangeDetection(args.change_threshold, args.change_metric, args.keyframe_interval)
         worker.start()
         mainWindow = MainWindow(worker, self.change_detected)
+        worker.actionQueue.append(worker.resumeStaging)
         mainWindow.show()
 
 def main():
@@ -282,6 +847,64 @@ def main():
     parser.add_argument("devices", type=int, nargs="+", help="Device index. (0, 1, 2, ...)")
     parser.add_argument('--amscope', dest='use_amscope', action='store_true')
     parser.add_argument('--webcam', dest='use_amscope', action='store_false')
+    parser.add_argument('--encoder', default=encoders.DEFAULT_PRESET,
+        help="Image encoder preset (%s) or 'png:<0-9>', 'jpeg:<0-100>', 'webp:<1-101>'."
+            % ", ".join(sorted(encoders.PRESETS)))
+    parser.add_argument('--frame-store', dest='frame_store', action='store_true',
+        help="Append raw frames to a per-camera frame store instead of writing one file per capture.")
+    parser.add_argument('--no-manifest', dest='no_manifest', action='store_true',
+        help="Don't record captures in the capture path's manifest.sqlite.")
+    parser.add_argument('--sync-webcams', dest='sync_webcams', action='store_true',
+        help="Grab all webcams back to back before decoding, so frames of a round are taken together.")
+    parser.add_argument('--webcam-reader', dest='webcam_reader', action='store_true',
+        help="Read active webcams continuously in a background thread and capture the newest frame.")
+    parser.add_argument('--webcam-fourcc', dest='webcam_fourcc', default="MJPG",
+        help="Pixel format requested from webcams (default MJPG). Pass '' to keep the driver default.")
+    parser.add_argument('--passthrough', dest='passthrough', action='store_true',
+        help="Write webcam JPEG bytes straight to disk when no rotation or processing is configured.")
+    parser.add_argument('--dynamic-resolution', dest='dynamic_resolution', action='store_true',
+        help="Stream Amscopes at a low resolution for preview and snap full-resolution stills for captures.")
+    parser.add_argument('--trigger', dest='trigger', action='store_true',
+        help="Keep Amscopes open without streaming and fire a software trigger for each capture.")
+    parser.add_argument('--processes', dest='processes', action='store_true',
+        help="Run every camera in its own process, handing frames over through shared memory.")
+    parser.add_argument('--health-action', dest='health_action', choices=frameHealth.ACTIONS,
+        help="Check captured frames for black, white, saturated, frozen or torn images and "
+            "retry the grab, reactivate the camera or just alert.")
+    parser.add_argument('--thumbnails', dest='thumbnails', default="",
+        help="Comma separated thumbnail widths (e.g. 320,80) written in the background for every capture.")
+    parser.add_argument('--video', dest='video', action='store_true',
+        help="Also append every capture to a per-camera timelapse video.")
+    parser.add_argument('--video-part-frames', dest='video_part_frames', type=int,
+        default=timelapseVideo.FRAMES_PER_PART, help="Start a new video file every N frames.")
+    parser.add_argument('--mosaic', dest='mosaic', action='store_true',
+        help="Preview every camera tiled in one window, with the age of each tile's frame.")
+    parser.add_argument('--mosaic-fps', dest='mosaic_fps', type=float, default=mosaic.MAX_FPS,
+        help="Highest rate the mosaic is redrawn at.")
+    parser.add_argument('--serve', dest='serve', type=int, default=0, metavar='PORT',
+        help="Serve MJPEG streams (/<i>.mjpg) and snapshots (/<i>.jpg) of every camera over HTTP.")
+    parser.add_argument('--serve-host', dest='serve_host', default="127.0.0.1",
+        help="Address to serve on; 0.0.0.0 for the whole network.")
+    parser.add_argument('--serve-fps', dest='serve_fps', type=float, default=frameServer.MAX_FPS,
+        help="Highest rate frames are encoded at, per camera.")
+    parser.add_argument('--memory-monitor', dest='memory_monitor', type=float, default=0, metavar='SECONDS',
+        help="Sample memory use (RSS, tracemalloc, per-camera buffers and callbacks) at this interval "
+            "and alert with the top allocation sites when it grows.")
+    parser.add_argument('--staging', dest='staging',
+        help="Write captures to this folder on fast local disk and move them to the capture path "
+            "in the background.")
+    parser.add_argument('--migrate-threads', dest='migrate_threads', type=int,
+        default=storageTiers.MIGRATE_THREADS, help="Files copied to the capture path at once.")
+    parser.add_argument('--staging-retention', dest='staging_retention', type=float,
+        default=storageTiers.RETENTION_HOURS, help="Hours archived captures are kept in staging.")
+    parser.add_argument('--min-free-gb', dest='min_free_gb', type=float, default=storageTiers.MIN_FREE_GB,
+        help="Prune staging early, or pause migration, when a tier has less free space than this.")
+    parser.add_argument('--change-threshold', dest='change_threshold', type=float, default=0,
+        help="Only save a frame if it changed this much since the last saved one. 0 saves every frame.")
+    parser.add_argument('--change-metric', dest='change_metric', default="diff", choices=changeDetector.METRICS,
+        help="Mean pixel difference (0-255) or histogram distance (0-100).")
+    parser.add_argument('--keyframe-interval', dest='keyframe_interval', type=int, default=10,
+        help="With --change-threshold, save every Nth round regardless of change.")
     args = parser.parse_args()
 
     os.chdir(HOME_FOLDER)
@@ -7,7 +7,6 @@
 
 from PyQt4.QtGui import *
 import inspect
-from datetime import datetime
 
 
 def strtobool(astr):
@@ -39,15 +38,14 @@ def guisave(self):
             value = obj.isChecked()  # get stored value from registry
             settings.setValue(name, value)
 
-        if isinstance(obj, QSpinBox):
+        if isinstance(obj, (QSpinBox, QDoubleSpinBox)):
             name = obj.objectName()
             state = obj.value()
             settings.setValue(name, state)
 
-def guidebug(self):
-    # debug UI
+def guivalues(self):
+    # current ui values as (name, value) pairs, e.g. for the settings journal
     settingsDebug = []
-    settings = self.settings
     for name, obj in inspect.getmembers(self.ui):
         if isinstance(obj, QComboBox):
             name = obj.objectName()  # get combobox name
@@ -70,16 +68,12 @@ def guidebug(self):
             value = obj.isChecked()  # get stored value from registry
             settingsDebug.append((name, value))
 
-        if isinstance(obj, QSpinBox):
+        if isinstance(obj, (QSpinBox, QDoubleSpinBox)):
             name = obj.objectName()
             state = obj.value()
             settingsDebug.append((name, state))
 
-    with open("settingsLog_" + str(self.deviceName.text()) + ".txt", "a") as f:
-        f.write(str(datetime.now()) + "\n")
-        for key, value in settingsDebug:
-            f.write("[" + str(key) + "] " + str(value) + "\n")
-        f.write("\n")
+    return settingsDebug
 
 def guirestore(self):
     settings = self.settings
@@ -124,4 +118,10 @@ def guirestore(self):
             name = obj.objectName()
             value = settings.value(name)
             if value != None:
-                obj.setValue(value.toInt()[0]) # toInt returns tuple??
\ No newline at end of file
+                obj.setValue(value.toInt()[0]) # toInt returns tuple??
+
+        if isinstance(obj, QDoubleSpinBox):
+            name = obj.objectName()
+            value = settings.value(name)
+            if value != None:
+                obj.setValue(value.toDouble()[0])
\ No newline at end of file
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Typed ctypes bindings for the ToupCam SDK (toupcam.dll / libtoupcam.dylib).
+    Every entry point is resolved once, with argtypes and restype declared
+    from toupcam.h, so ctypes checks arguments instead of the DLL crashing on
+    them, and failed HRESULTs raise ToupcamError.
+    author: Jacob Kosberg
+"""
+
+import ctypes
+import sys
+
+
+class ToupcamError(IOError):
+    """A ToupCam SDK call returned a failure HRESULT."""
+    def __init__(self, func, hresult):
+        IOError.__init__(self, "Toupcam_%s failed with HRESULT 0x%08X" % (func, hresult & 0xFFFFFFFF))
+        self.func = func
+        self.hresult = hresult
+
+
+class HToupCam(ctypes.Structure):
+    _fields_ = [('unused', ctypes.c_int)]
+
+
+HANDLE = ctypes.POINTER(HToupCam)
+HRESULT = ctypes.c_int32
+BOOL = ctypes.c_int
+UINT = ctypes.c_uint
+USHORT = ctypes.c_ushort
+INT = ctypes.c_int
+P = ctypes.POINTER
+
+# The SDK uses __stdcall on Windows (identical to cdecl on x64).
+if sys.platform == 'win32':
+    FUNCTYPE = ctypes.WINFUNCTYPE
+else:
+    FUNCTYPE = ctypes.CFUNCTYPE
+
+# void (*PTOUPCAM_EVENT_CALLBACK)(unsigned nEvent, void* pCallbackCtx)
+EVENT_CALLBACK = FUNCTYPE(None, ctypes.c_uint, ctypes.c_void_p)
+# void (*PITOUPCAM_TEMPTINT_CALLBACK)(const int nTemp, const int nTint, void* pCtx)
+TEMPTINT_CALLBACK = FUNCTYPE(None, ctypes.c_int, ctypes.c_int, ctypes.c_void_p)
+
+# name: (restype, argtypes), from toupcam.h. HRESULT functions get errcheck.
+PROTOTYPES = {
+    "OpenByIndex": (HANDLE, [UINT]),
+    "Close": (None, [HANDLE]),
+    "StartPullModeWithCallback": (HRESULT, [HANDLE, EVENT_CALLBACK, ctypes.c_void_p]),
+    "PullImage": (HRESULT, [HANDLE, ctypes.c_void_p, INT, P(UINT), P(UINT)]),
+    "PullStillImage": (HRESULT, [HANDLE, ctypes.c_void_p, INT, P(UINT), P(UINT)]),
+    "Stop": (HRESULT, [HANDLE]),
+    "Pause": (HRESULT, [HANDLE, BOOL]),
+    "Snap": (HRESULT, [HANDLE, UINT]),
+    "Trigger": (HRESULT, [HANDLE, USHORT]),
+    "get_SerialNumber": (HRESULT, [HANDLE, ctypes.c_char_p]),
+    "get_FwVersion": (HRESULT, [HANDLE, ctypes.c_char_p]),
+    "get_HwVersion": (HRESULT, [HANDLE, ctypes.c_char_p]),
+    "get_ResolutionNumber": (HRESULT, [HANDLE]),
+    "get_Resolution": (HRESULT, [HANDLE, UINT, P(INT), P(INT)]),
+    "put_eSize": (HRESULT, [HANDLE, UINT]),
+    "get_eSize": (HRESULT, [HANDLE, P(UINT)]),
+    "put_Size": (HRESULT, [HANDLE, INT, INT]),
+    "get_Size": (HRESULT, [HANDLE, P(INT), P(INT)]),
+    "get_FinalSize": (HRESULT, [HANDLE, P(INT), P(INT)]),
+    "put_Roi": (HRESULT, [HANDLE, UINT, UINT, UINT, UINT]),
+    "get_Roi": (HRESULT, [HANDLE, P(UINT), P(UINT), P(UINT), P(UINT)]),
+    "put_Option": (HRESULT, [HANDLE, UINT, INT]),
+    "get_Option": (HRESULT, [HANDLE, UINT, P(INT)]),
+    "put_AutoExpoEnable": (HRESULT, [HANDLE, BOOL]),
+    "get_AutoExpoEnable": (HRESULT, [HANDLE, P(BOOL)]),
+    "put_AutoExpoTarget": (HRESULT, [HANDLE, USHORT]),
+    "get_AutoExpoTarget": (HRESULT, [HANDLE, P(USHORT)]),
+    "put_ExpoTime": (HRESULT, [HANDLE, UINT]),
+    "get_ExpoTime": (HRESULT, [HANDLE, P(UINT)]),
+    "put_ExpoAGain": (HRESULT, [HANDLE, USHORT]),
+    "get_ExpoAGain": (HRESULT, [HANDLE, P(USHORT)]),
+    "put_Hue": (HRESULT, [HANDLE, INT]),
+    "get_Hue": (HRESULT, [HANDLE, P(INT)]),
+    "put_Saturation": (HRESULT, [HANDLE, INT]),
+    "get_Saturation": (HRESULT, [HANDLE, P(INT)]),
+    "put_Brightness": (HRESULT, [HANDLE, INT]),
+    "get_Brightness": (HRESULT, [HANDLE, P(INT)]),
+    "put_Contrast": (HRESULT, [HANDLE, INT]),
+    "get_Contrast": (HRESULT, [HANDLE, P(INT)]),
+    "put_Gamma": (HRESULT, [HANDLE, INT]),
+    "get_Gamma": (HRESULT, [HANDLE, P(INT)]),
+    "put_TempTint": (HRESULT, [HANDLE, INT, INT]),
+    "get_TempTint": (HRESULT, [HANDLE, P(INT), P(INT)]),
+    # aLow[4] and aHigh[4]; passing a plain int is what used to crash.
+    "put_LevelRange": (HRESULT, [HANDLE, P(USHORT), P(USHORT)]),
+    "get_LevelRange": (HRESULT, [HANDLE, P(USHORT), P(USHORT)]),
+    "AwbOnePush": (HRESULT, [HANDLE, TEMPTINT_CALLBACK, ctypes.c_void_p]),
+}
+
+LEVEL_RANGE = USHORT * 4
+
+
+def check_hresult(name):
+    """errcheck hook: raise on failure HRESULTs (negative); S_OK and S_FALSE pass."""
+    def errcheck(result, func, args):
+        if result < 0:
+            raise ToupcamError(name, result)
+        return result
+    return errcheck
+
+
+def unsupported(name):
+    def call(*args):
+        raise ToupcamError(name, -1)
+    return call
+
+
+class ToupcamSdk(object):
+    """
+    The SDK's entry points as attributes without the ``Toupcam_`` prefix,
+    e.g. ``sdk.put_Gamma(handle, 100)``. Entry points missing from an older
+    DLL raise ToupcamError when called.
+    """
+    def __init__(self, lib):
+        self.lib = lib
+        for name, (restype, argtypes) in PROTOTYPES.items():
+            try:
+                func = getattr(lib, "Toupcam_" + name)
+            except AttributeError:
+                setattr(self, name, unsupported(name))
+                continue
+            func.restype = restype
+            func.argtypes = argtypes
+            if restype is HRESULT:
+                func.errcheck = check_hresult(name)
+            setattr(self, name, func)
+
+
+def load(path):
+    """Load the SDK library at ``path`` and bind it."""
+    if sys.platform == 'win32':
+        lib = ctypes.windll.LoadLibrary(path)
+    else:
+        lib = ctypes.cdll.LoadLibrary(path)
+    return ToupcamSdk(lib)
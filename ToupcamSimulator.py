@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Stand-in for the ToupCam SDK, for load and fault testing without
+    hardware. It implements the same entry points as ToupcamBindings and
+    fires TOUPCAM_EVENT_IMAGE from a thread per camera, like the driver.
+    Simulated cameras share one USB bus: when their combined demand passes
+    its bandwidth, frame rates drop and timeouts start to appear.
+
+    Amscope.py loads the simulator instead of the DLL when TOUPCAM_SIMULATOR
+    is set to the number of cameras to simulate. Optional settings:
+
+        TOUPCAM_SIMULATOR_FPS         frames per second per camera (15)
+        TOUPCAM_SIMULATOR_BANDWIDTH   bus bandwidth in MB/s (40)
+        TOUPCAM_SIMULATOR_FAULTS      per-frame odds, e.g. "timeout=0.01,error=0.001,disconnected=0.0001"
+
+    Run as a script for a throughput and fault-handling load test:
+
+        python ToupcamSimulator.py [<cameras>] [<seconds>] [<roi width>x<roi height>]
+
+    author: Jacob Kosberg
+"""
+
+import ctypes
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy
+
+from ToupcamBindings import ToupcamError, HToupCam, HANDLE, PROTOTYPES
+
+EVENT_IMAGE = 4
+EVENT_STILLIMAGE = 5
+EVENT_ERROR = 128
+EVENT_DISCONNECTED = 129
+EVENT_TIMEOUT = 130
+FAULT_EVENTS = {"timeout": EVENT_TIMEOUT, "error": EVENT_ERROR, "disconnected": EVENT_DISCONNECTED}
+
+OPTION_TRIGGER = 0x0b
+
+# eSize index -> sensor size, like an MU500.
+RESOLUTIONS = [(2592, 1944), (1296, 972), (648, 486)]
+DEFAULT_FPS = 15.0
+DEFAULT_BANDWIDTH_MB = 40.0
+# Bytes per pixel on the wire (8-bit raw Bayer).
+WIRE_BYTES_PER_PIXEL = 1
+# Below this share of the requested bandwidth a camera starts timing out.
+TIMEOUT_SHARE = 0.25
+NOISE_VARIANTS = 4
+
+E_FAIL = -0x7FFFBFFB  # 0x80004005
+E_INVALIDARG = -0x7FF8FFA9  # 0x80070057
+
+
+def write_out(ref, value):
+    """Store ``value`` through a ctypes.byref() argument, if one was passed."""
+    if ref is not None:
+        ref._obj.value = value
+
+
+def parse_faults(text):
+    faults = {}
+    for item in (text or "").split(","):
+        if "=" in item:
+            name, odds = item.split("=")
+            faults[FAULT_EVENTS[name.strip()]] = float(odds)
+    return faults
+
+
+class UsbBus(object):
+    """Bandwidth shared by every streaming camera."""
+    def __init__(self, megabytesPerSecond=DEFAULT_BANDWIDTH_MB):
+        self.capacity = megabytesPerSecond * 1e6
+        self.demand = {}
+        self.lock = threading.Lock()
+
+    def set_demand(self, camera, bytesPerSecond):
+        with self.lock:
+            if bytesPerSecond:
+                self.demand[camera] = bytesPerSecond
+            else:
+                self.demand.pop(camera, None)
+
+    def share(self):
+        """Fraction of its requested bandwidth each camera actually gets."""
+        with self.lock:
+            total = sum(self.demand.values())
+        return min(1.0, self.capacity / total) if total else 1.0
+
+
+class SimulatedCamera(object):
+    """One simulated camera: properties, frame source and streaming thread."""
+    def __init__(self, index, sdk):
+        self.index = index
+        self.sdk = sdk
+        self.serial = "SIM%013d" % index
+        self.attached = True
+        self.opened = False
+        self.esize = 0
+        self.roi = None
+        self.properties = {}
+        self.levels = ((0,) * 4, (255,) * 4)
+        self.trigger = 0
+        self.callback = None
+        self.thread = None
+        self.streaming = False
+        self.pendingTriggers = 0
+        self.pendingStill = False
+        self.stillSize = 0
+        self.frame = 0
+        self.delivered = 0
+        self.requested = 0
+        self.faults = dict((event, 0) for event in FAULT_EVENTS.values())
+        self.patterns = {}
+
+    def size(self, esize=None):
+        width, height = RESOLUTIONS[self.esize if esize is None else esize]
+        if self.roi and esize is None:
+            width, height = self.roi[2], self.roi[3]
+        return width, height
+
+    def pattern(self, width, height):
+        """A few noisy variants of a gradient, cycled so frames never repeat exactly."""
+        key = (width, height)
+        if key not in self.patterns:
+            y, x = numpy.mgrid[0:height, 0:width]
+            base = ((x * 255 // max(width - 1, 1) + y * 255 // max(height - 1, 1)) // 2).astype(numpy.int16)
+            rng = numpy.random.RandomState(self.index)
+            variants = []
+            for i in range(NOISE_VARIANTS):
+                gray = numpy.clip(base + rng.randint(-6, 7, base.shape), 0, 255).astype(numpy.uint8)
+                bgrx = numpy.zeros((height, width, 4), numpy.uint8)
+                bgrx[..., 0] = gray
+                bgrx[..., 1] = gray[:, ::-1]
+                bgrx[..., 2] = 255 - gray
+                variants.append(bgrx)
+            self.patterns[key] = variants
+        return self.patterns[key]
+
+    def copy_frame(self, address, bits, width, height):
+        variant = self.pattern(width, height)[self.frame % NOISE_VARIANTS]
+        # Stamp the frame number into the first pixels so every frame differs.
+        stamped = variant.copy() if bits == 32 else numpy.ascontiguousarray(variant[..., :3])
+        stamped.reshape(-1)[:8] = numpy.frombuffer(numpy.int64(self.frame).tobytes(), numpy.uint8)
+        ctypes.memmove(address, stamped.ctypes.data, stamped.nbytes)
+
+    def fire(self, event):
+        if self.callback:
+            self.callback(event, None)
+
+    def start(self, callback):
+        self.callback = callback
+        self.streaming = True
+        self.thread = threading.Thread(target=self.run, name="Simulated camera %d" % self.index)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.streaming = False
+        self.sdk.bus.set_demand(self, 0)
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def run(self):
+        width, height = self.size()
+        nextFrame = time.time()
+        while self.streaming:
+            if self.pendingStill:
+                self.pendingStill = False
+                # A still crosses the bus in full, at the camera's share of it.
+                stillWidth, stillHeight = self.size(self.stillSize)
+                time.sleep(stillWidth * stillHeight * WIRE_BYTES_PER_PIXEL /
+                    (self.sdk.bus.capacity * self.sdk.bus.share()))
+                self.fire(EVENT_STILLIMAGE)
+
+            if self.trigger:
+                self.sdk.bus.set_demand(self, 0)
+                if not self.pendingTriggers:
+                    time.sleep(0.001)
+                    continue
+                self.pendingTriggers -= 1
+            else:
+                self.sdk.bus.set_demand(self, self.sdk.fps * width * height * WIRE_BYTES_PER_PIXEL)
+                nextFrame += 1.0 / self.sdk.fps
+                delay = nextFrame - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                self.requested += 1
+
+            event = self.pick_event()
+            if event == EVENT_DISCONNECTED:
+                self.attached = False
+                self.streaming = False
+            elif event == EVENT_IMAGE:
+                self.frame += 1
+                self.delivered += 1
+            if event is not None:
+                self.fire(event)
+        self.sdk.bus.set_demand(self, 0)
+
+    def pick_event(self):
+        """The next event: a frame, an injected fault, or a drop when the bus is saturated."""
+        share = self.sdk.bus.share()
+        roll = random.random()
+        for event, odds in self.sdk.faults.items():
+            if roll < odds:
+                self.faults[event] += 1
+                return event
+            roll -= odds
+        if share < 1.0 and random.random() > share:
+            if share < TIMEOUT_SHARE:
+                self.faults[EVENT_TIMEOUT] += 1
+                return EVENT_TIMEOUT
+            return None
+        return EVENT_IMAGE
+
+
+class SimulatedSdk(object):
+    """Drop-in replacement for ToupcamBindings.ToupcamSdk backed by simulated cameras."""
+    def __init__(self, cameras=1, fps=DEFAULT_FPS, bandwidth=DEFAULT_BANDWIDTH_MB, faults=None):
+        self.lib = self
+        self.fps = fps
+        self.bus = UsbBus(bandwidth)
+        self.faults = faults or {}
+        self.cameras = [SimulatedCamera(i, self) for i in range(cameras)]
+
+    def camera(self, handle, func):
+        cam = self.cameras[handle.contents.unused]
+        if not cam.attached or not cam.opened:
+            raise ToupcamError(func, E_FAIL)
+        return cam
+
+    # Fault injection
+    def detach(self, index):
+        """Unplug a camera: it fires DISCONNECTED and every call on it fails."""
+        cam = self.cameras[index]
+        streaming = cam.streaming
+        cam.stop()
+        cam.attached = False
+        if streaming:
+            cam.fire(EVENT_DISCONNECTED)
+
+    def attach(self, index):
+        self.cameras[index].attached = True
+        self.cameras[index].opened = False
+
+    def inject(self, index, event):
+        self.cameras[index].faults[event] += 1
+        self.cameras[index].fire(event)
+
+    # SDK entry points
+    def OpenByIndex(self, index):
+        attached = [cam for cam in self.cameras if cam.attached]
+        if index >= len(attached):
+            return HANDLE()
+        cam = attached[index]
+        cam.opened = True
+        return ctypes.pointer(HToupCam(cam.index))
+
+    def Close(self, handle):
+        cam = self.cameras[handle.contents.unused]
+        cam.stop()
+        cam.opened = False
+        cam.callback = None
+
+    def StartPullModeWithCallback(self, handle, callback, ctx):
+        self.camera(handle, "StartPullModeWithCallback").start(callback)
+        return 0
+
+    def Stop(self, handle):
+        self.camera(handle, "Stop").stop()
+        return 0
+
+    def Pause(self, handle, pause):
+        return 0
+
+    def PullImage(self, handle, address, bits, width, height):
+        cam = self.camera(handle, "PullImage")
+        w, h = cam.size()
+        cam.copy_frame(address, bits, w, h)
+        write_out(width, w)
+        write_out(height, h)
+        return 0
+
+    def PullStillImage(self, handle, address, bits, width, height):
+        cam = self.camera(handle, "PullStillImage")
+        w, h = cam.size(cam.stillSize)
+        cam.copy_frame(address, bits, w, h)
+        write_out(width, w)
+        write_out(height, h)
+        return 0
+
+    def Snap(self, handle, resolution):
+        cam = self.camera(handle, "Snap")
+        cam.stillSize = resolution
+        cam.pendingStill = True
+        return 0
+
+    def Trigger(self, handle, count):
+        cam = self.camera(handle, "Trigger")
+        if not cam.trigger:
+            raise ToupcamError("Trigger", E_FAIL)
+        cam.pendingTriggers += count
+        return 0
+
+    def get_SerialNumber(self, handle, buf):
+        buf.value = self.camera(handle, "get_SerialNumber").serial.encode("ascii")
+        return 0
+
+    def get_FwVersion(self, handle, buf):
+        buf.value = b"3.0.0.0"
+        return 0
+
+    def get_HwVersion(self, handle, buf):
+        buf.value = b"3.0"
+        return 0
+
+    def get_ResolutionNumber(self, handle):
+        self.camera(handle, "get_ResolutionNumber")
+        return len(RESOLUTIONS)
+
+    def get_Resolution(self, handle, index, width, height):
+        self.camera(handle, "get_Resolution")
+        write_out(width, RESOLUTIONS[index][0])
+        write_out(height, RESOLUTIONS[index][1])
+        return 0
+
+    def put_eSize(self, handle, esize):
+        cam = self.camera(handle, "put_eSize")
+        if esize >= len(RESOLUTIONS) or cam.streaming:
+            raise ToupcamError("put_eSize", E_INVALIDARG)
+        cam.esize = esize
+        cam.roi = None
+        return 0
+
+    def get_eSize(self, handle, esize):
+        write_out(esize, self.camera(handle, "get_eSize").esize)
+        return 0
+
+    def get_Size(self, handle, width, height):
+        w, h = RESOLUTIONS[self.camera(handle, "get_Size").esize]
+        write_out(width, w)
+        write_out(height, h)
+        return 0
+
+    def get_FinalSize(self, handle, width, height):
+        w, h = self.camera(handle, "get_FinalSize").size()
+        write_out(width, w)
+        write_out(height, h)
+        return 0
+
+    def put_Roi(self, handle, x, y, width, height):
+        cam = self.camera(handle, "put_Roi")
+        full = RESOLUTIONS[cam.esize]
+        if width == 0 and height == 0:
+            cam.roi = None
+        elif x + width > full[0] or y + height > full[1] or width < 16 or height < 16:
+            raise ToupcamError("put_Roi", E_INVALIDARG)
+        else:
+            cam.roi = (x, y, width, height)
+        return 0
+
+    def get_Roi(self, handle, x, y, width, height):
+        cam = self.camera(handle, "get_Roi")
+        roi = cam.roi or ((0, 0) + RESOLUTIONS[cam.esize])
+        for ref, value in zip((x, y, width, height), roi):
+            write_out(ref, value)
+        return 0
+
+    def put_Option(self, handle, option, value):
+        cam = self.camera(handle, "put_Option")
+        if option == OPTION_TRIGGER:
+            cam.trigger = value
+        cam.properties[("Option", option)] = value
+        return 0
+
+    def get_Option(self, handle, option, value):
+        write_out(value, self.camera(handle, "get_Option").properties.get(("Option", option), 0))
+        return 0
+
+    def put_LevelRange(self, handle, low, high):
+        self.camera(handle, "put_LevelRange").levels = (tuple(low), tuple(high))
+        return 0
+
+    def get_LevelRange(self, handle, low, high):
+        levels = self.camera(handle, "get_LevelRange").levels
+        low[:] = levels[0]
+        high[:] = levels[1]
+        return 0
+
+    def AwbOnePush(self, handle, callback, ctx):
+        self.camera(handle, "AwbOnePush")
+        callback(6503, 1000, ctx)
+        return 0
+
+    def __getattr__(self, name):
+        # The remaining get_/put_ pairs are plain stored properties.
+        if name not in PROTOTYPES or not name.startswith(("get_", "put_")):
+            raise AttributeError(name)
+        key = name[4:]
+
+        def put(handle, *values):
+            self.camera(handle, name).properties[key] = values
+            return 0
+
+        def get(handle, *refs):
+            values = self.camera(handle, name).properties.get(key, (0,) * len(refs))
+            for ref, value in zip(refs, values):
+                write_out(ref, value)
+            return 0
+        return put if name.startswith("put_") else get
+
+
+def from_environment():
+    """The simulated SDK configured by TOUPCAM_SIMULATOR* variables."""
+    return SimulatedSdk(int(os.environ.get("TOUPCAM_SIMULATOR", "1")),
+        fps=float(os.environ.get("TOUPCAM_SIMULATOR_FPS", DEFAULT_FPS)),
+        bandwidth=float(os.environ.get("TOUPCAM_SIMULATOR_BANDWIDTH", DEFAULT_BANDWIDTH_MB)),
+        faults=parse_faults(os.environ.get("TOUPCAM_SIMULATOR_FAULTS")))
+
+
+def main():
+    cameras = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    roi = (0, 0) + tuple(int(v) for v in sys.argv[3].split("x")) if len(sys.argv) > 3 else None
+    os.environ["TOUPCAM_SIMULATOR"] = str(cameras)
+    import Amscope
+
+    caps = [Amscope.ToupCamCamera(camIndex=i, resolution=1, roi=roi) for i in range(cameras)]
+    for cap in caps:
+        cap.open()
+    start = time.time()
+    detached = False
+    while time.time() < start + seconds:
+        time.sleep(0.1)
+        # Unplug the last camera halfway through to exercise disconnect handling.
+        if not detached and time.time() > start + seconds / 2:
+            Amscope.sdk.detach(cameras - 1)
+            detached = True
+    elapsed = time.time() - start
+
+    print("Bus share at the end: %.0f%%" % (100 * Amscope.sdk.bus.share()))
+    for cap, sim in zip(caps, Amscope.sdk.cameras):
+        fps = cap.get_frame_count() / elapsed
+        height, width = cap.get_image_data().shape
+        print("Camera %d: %dx%d, %.1f fps delivered (%.1f Mpixel/s), %d frames dropped, "
+            "%d timeouts, %d errors, disconnected: %s" %
+            (sim.index, width, height, fps, fps * width * height / 1e6, sim.requested - sim.delivered,
+            sim.faults[EVENT_TIMEOUT], sim.faults[EVENT_ERROR], cap.disconnected))
+        cap.close()
+
+if __name__ == "__main__":
+    main()
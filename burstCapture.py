@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Burst capture: grab N frames from one camera at its full rate into a
+    preallocated in-memory ring, while a background thread writes them out.
+    Files are named by capture time with microseconds, kept unique and
+    increasing per camera, e.g. '2017-08-08_10-29-57-123456.png'.
+    author: Jacob Kosberg
+"""
+
+import os
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import numpy
+
+from captureManifest import monotonic
+
+RING_SLOTS = 64
+RING_BYTES = 512 * 1024 ** 2
+
+
+class FileNamer(object):
+    """
+    Sub-second file names that never collide and always increase per
+    device, even when the clock steps back or two captures share a
+    microsecond.
+    """
+    def __init__(self):
+        self.last = {}
+        self.lock = threading.Lock()
+
+    def name(self, device, timestamp=None):
+        with self.lock:
+            micros = int(round((time.time() if timestamp is None else timestamp) * 1e6))
+            micros = max(micros, self.last.get(device, -1) + 1)
+            self.last[device] = micros
+        seconds, fraction = divmod(micros, 1000000)
+        return time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime(seconds)) + "-%06d" % fraction
+
+
+class BurstRing(threading.Thread):
+    """
+    A ring of up to ``slots`` preallocated frames, at most ``maxBytes`` in
+    total. ``capture`` copies frames into free slots and hands them to this
+    thread, which encodes and writes them and frees the slot again, so a
+    burst only waits on disk once the whole ring is full.
+    """
+    def __init__(self, shape, dtype, slots=RING_SLOTS, maxBytes=RING_BYTES):
+        threading.Thread.__init__(self, name="Burst flush")
+        self.daemon = True
+        frameBytes = int(numpy.prod(shape)) * numpy.dtype(dtype).itemsize
+        slots = max(2, min(slots, maxBytes // frameBytes))
+        self.frames = numpy.empty((slots,) + shape, dtype)
+        self.free = queue.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+        self.filled = queue.Queue()
+        self.bursts = []
+
+    def fits(self, frame):
+        return frame.shape == self.frames.shape[1:] and frame.dtype == self.frames.dtype
+
+    def capture(self, camera, count, folder, namer, device, encoder, firstFrame=None, written=None):
+        """
+        Grab ``count`` frames with ``camera.get_new_frame`` and queue them
+        for writing. Returns the file names the frames will be written to.
+        ``written`` is called with each file name, frame shape, and wall and
+        monotonic capture time once the file is complete.
+        """
+        burst = {"start": time.time()}
+        filenames = []
+        for i in range(count):
+            frame = firstFrame if i == 0 and firstFrame is not None else camera.get_new_frame()
+            if frame is None or not self.fits(frame):
+                break
+            timestamp = time.time()
+            captured = monotonic()
+            slot = self.free.get()
+            self.frames[slot][...] = frame
+            filename = os.path.join(folder, namer.name(device, timestamp) + encoder.extension)
+            filenames.append(filename)
+            self.filled.put((slot, filename, encoder, (written, timestamp, captured)))
+        burst["count"] = len(filenames)
+        burst["captured"] = time.time()
+        self.bursts.append(burst)
+        # Marks the end of the burst for the flush thread.
+        self.filled.put((None, None, burst, None))
+        return filenames
+
+    def run(self):
+        while True:
+            item = self.filled.get()
+            if item is None:
+                break
+            slot, filename, encoder, done = item
+            if slot is None:
+                burst = encoder
+                burst["flushed"] = time.time()
+                print(self.describe(burst))
+                continue
+            try:
+                encoder.write(filename, self.frames[slot])
+                written, timestamp, captured = done
+                if written:
+                    written(filename, self.frames.shape[1:], timestamp, captured)
+            except (IOError, OSError) as e:
+                print("Burst frame %s failed: %s" % (filename, e))
+            self.free.put(slot)
+
+    def describe(self, burst):
+        captureSeconds = burst["captured"] - burst["start"]
+        return "Burst of %d frames at %.1f fps, flushed %.2f s after capture ended" % (burst["count"],
+            burst["count"] / captureSeconds if captureSeconds else 0, burst["flushed"] - burst["captured"])
+
+    def stop(self):
+        """Write out everything still in the ring and stop the thread."""
+        self.filled.put(None)
+        self.join()
+
+    def report(self):
+        done = [burst for burst in self.bursts if "flushed" in burst]
+        if not done:
+            return []
+        frames = sum(burst["count"] for burst in done)
+        captureSeconds = sum(burst["captured"] - burst["start"] for burst in done)
+        flushSeconds = sum(burst["flushed"] - burst["captured"] for burst in done)
+        return ["Bursts: %d frames in %d bursts, %.1f fps while capturing, %.2f s mean flush after capture" %
+            (frames, len(done), frames / captureSeconds if captureSeconds else 0, flushSeconds / len(done))]
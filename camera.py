@@ -7,6 +7,24 @@
 import cv2
 import Amscope
 import numpy
+import threading
+import time
+
+# Highest device index probed when looking for a reattached camera by serial.
+MAX_DEVICE_INDEX = 8
+
+# Frames grabbed and thrown away per webcam before a synchronized grab, so
+# stale frames sitting in the driver buffer are not mistaken for new ones.
+WEBCAM_FLUSH_FRAMES = 2
+
+# How long get_frame waits for a background reader to deliver a frame.
+READER_TIMEOUT_SECONDS = 5.0
+
+# eSize an Amscope streams at between captures with dynamic resolution.
+DYNAMIC_STREAM_RESOLUTION = 2
+
+# How long an Amscope still snap, or a triggered frame, may take.
+STILL_TIMEOUT_SECONDS = 5.0
 
 class CameraError(Exception):
     """Camera error."""
@@ -34,6 +52,24 @@ class AbstractCamera(object):
     def get_frame(self):
         raise NotImplementedError
 
+    def get_new_frame(self):
+        """A frame the camera delivered after this call, as opposed to the latest one."""
+        return self.get_frame()
+
+    def get_capture_frame(self, new=False):
+        """
+        The frame to save for a capture. Cameras that preview at a lower
+        resolution than they capture at override this.
+        """
+        return self.get_new_frame() if new else self.get_frame()
+
+    def reconnect(self, serial=None):
+        """
+        Look for this camera again after it was detached. Returns True if it
+        was found; the camera is left deactivated.
+        """
+        raise NotImplementedError
+
     def show_frame(self, title, scale=80.0):
         """
         Show current frames from cameras.
@@ -41,6 +77,8 @@ class AbstractCamera(object):
         ``wait`` is the wait interval in milliseconds before the window closes.
         """
         frame = self.get_frame()
+        if frame is None:
+            raise CameraTimeoutError("No frame to show from camera %s." % self.device)
         if frame.any():
             frame = cv2.resize(frame, None, 
                 fx=scale/100.0, fy=scale/100.0, 
@@ -95,15 +133,25 @@ class AmscopeCamera(AbstractCamera):
     """Camera class impl for the Amscope cameras, which have more camera settings than webcams."""
     parameters = ["brightness", "contrast", "level_range", "exposure_time",
                 "exposure_gain", "temperature_tint", "hue", "saturation", "gamma"]
-    def __init__(self, device, fullRes=False):
+    def __init__(self, device, fullRes=False, dynamicResolution=False, trigger=False):
         self.rotation = 0
         self.device = device
         self.capture = None
         self.disabled = False
+        self.roi = None
+        self.activated = None
         if not fullRes:
             self.resolution = 1
         else:
             self.resolution = 0
+        # Stream at a low eSize and snap stills at self.resolution for captures.
+        self.dynamicResolution = dynamicResolution
+        self.buffers = {}
+        self.stillSeconds = []
+        # Stay open without streaming and send one frame per software trigger.
+        self.triggerMode = trigger
+        self.triggered = None
+        self.triggerSeconds = []
 
     def get_serial(self):
         return self.capture.get_serial() if not self.disabled else None
@@ -113,8 +161,15 @@ class AmscopeCamera(AbstractCamera):
         if self.capture:
             self.deactivate()
         try:
-            self.capture = self.open_cam(self.device)
-            self.capture.set_auto_exposure_enabled(False)
+            capture = self.open_cam(self.device)
+            try:
+                capture.set_auto_exposure_enabled(False)
+            except IOError:
+                capture.close()
+                raise
+            # Only a fully set up camera counts as activated.
+            self.capture = capture
+            self.activated = time.time()
         except IOError as e:
             print(e)
             self.disabled = True
@@ -123,20 +178,178 @@ class AmscopeCamera(AbstractCamera):
     def deactivate(self):
         #print "deactivating camera " + str(self.device)
         if self.capture:
+            print(self.describe_stream())
+            if self.stillSeconds:
+                print("Amscope %s: %d stills, %.0f ms mean, %.0f ms max from request to frame" % (
+                    self.device, len(self.stillSeconds), 1000 * sum(self.stillSeconds) / len(self.stillSeconds),
+                    1000 * max(self.stillSeconds)))
+                self.stillSeconds = []
+            if self.triggerSeconds:
+                print("Amscope %s: %d triggered frames, %.0f ms mean, %.0f ms max from trigger to frame" % (
+                    self.device, len(self.triggerSeconds),
+                    1000 * sum(self.triggerSeconds) / len(self.triggerSeconds), 1000 * max(self.triggerSeconds)))
+                self.triggerSeconds = []
             self.capture.close()
         self.capture = None
 
+    def memory_usage(self):
+        """Pooled frame buffers, plus SDK handles and callbacks still alive for this camera."""
+        handles = [cap for cap in list(Amscope.ToupCamCamera.live) if cap.camIndex == self.device]
+        return {"buffer bytes": sum(b.nbytes for b in self.buffers.values()),
+            "handles": len(handles),
+            "callbacks": sum((cap._frame_fn is not None) + (cap._temptint_cb is not None) for cap in handles)}
+
+    def stream_resolution(self):
+        # A triggered camera only sends the frames it captures.
+        if self.dynamicResolution and not self.triggerMode:
+            return max(self.resolution, DYNAMIC_STREAM_RESOLUTION)
+        return self.resolution
+
+    def get_capture_frame(self, new=False):
+        """
+        With dynamic resolution, a still at the capture resolution, taken
+        while the stream stays at its low one. The ROI, in pixels of the
+        capture resolution, is cropped from the still in software. In
+        trigger mode, always a frame triggered for this capture.
+        """
+        if self.triggerMode:
+            return self.get_new_frame()
+        if not self.dynamicResolution or not self.capture:
+            return AbstractCamera.get_capture_frame(self, new)
+        if self.capture.disconnected:
+            raise CameraDisconnectedError("Amscope at index %s was disconnected." % self.device)
+        start = time.time()
+        still = self.capture.snap_still(self.resolution, STILL_TIMEOUT_SECONDS)
+        if still is None:
+            raise CameraTimeoutError("No still from Amscope at index %s." % self.device)
+        self.stillSeconds.append(time.time() - start)
+        frame = self.capture.get_np_image(still)
+        if self.roi:
+            x, y, w, h = self.roi
+            frame = frame[y:y + h, x:x + w]
+        return self.rotate_bound(frame, self.rotation)
+
+    def describe_stream(self):
+        """Frame rate and pixel rate since activation, to compare ROIs by."""
+        w, h = self.capture._data.shape[1], self.capture._data.shape[0]
+        seconds = time.time() - self.activated
+        fps = self.frame_count() / seconds if seconds > 0 else 0.0
+        return "Amscope %s: %dx%d at %.1f fps, %.1f Mpixel/s" % (
+            self.device, w, h, fps, fps * w * h / 1e6)
+
+    def set_roi(self, roi):
+        """
+        Crop to ``roi`` (x, y, width, height) on the sensor, so only those
+        pixels cross the USB bus; None streams the full frame. The ROI is in
+        pixels of the capture resolution, whatever the stream runs at. Frame
+        buffers are sized when the camera opens, so an active camera is
+        reopened when the ROI changes.
+        """
+        if roi == self.roi:
+            return
+        self.roi = roi
+        if self.capture:
+            self.activate()
+            if not self.capture:
+                raise CameraDisconnectedError("Amscope at index %s did not reopen with ROI %s." % (self.device, roi))
+
+    def fire_trigger(self):
+        """
+        Ask a camera in trigger mode for exactly one frame, without waiting
+        for it; get_triggered_frame does. Lets several cameras be triggered
+        back to back.
+        """
+        if not self.capture:
+            raise CameraDeactivatedError("Amscope at index %s is not activated." % self.device)
+        if self.capture.disconnected:
+            raise CameraDisconnectedError("Amscope at index %s was disconnected." % self.device)
+        self.triggered = time.time()
+        self.capture.trigger()
+
+    def get_triggered_frame(self, timeout=STILL_TIMEOUT_SECONDS):
+        data = self.capture.wait_image(timeout)
+        if data is None:
+            if self.capture.disconnected:
+                raise CameraDisconnectedError("Amscope at index %s was disconnected." % self.device)
+            raise CameraTimeoutError("No triggered frame from Amscope at index %s." % self.device)
+        self.triggerSeconds.append(time.time() - self.triggered)
+        return self.rotate_bound(self.capture.get_np_image(data), self.rotation)
+
+    def stream_roi(self, cap):
+        """The ROI in pixels of the stream's eSize, scaled down from the capture resolution."""
+        if not self.roi or self.stream_resolution() == self.resolution:
+            return self.roi
+        scale = float(cap.get_resolution(self.stream_resolution())[0]) / cap.get_resolution(self.resolution)[0]
+        return tuple(int(round(v * scale)) for v in self.roi)
+
     def open_cam(self, device):
-        cap = Amscope.ToupCamCamera(camIndex=device, resolution=self.resolution)
+        cap = Amscope.ToupCamCamera(camIndex=device, resolution=self.stream_resolution(),
+            buffers=self.buffers, trigger=self.triggerMode)
+        if cap.cam:
+            cap.roi = self.stream_roi(cap)
         if cap.open():
             return cap
         else:
             raise IOError('Could not find Amscope at index: ' + str(device))
 
+    def find_device(self, serial, maxIndex=MAX_DEVICE_INDEX):
+        """
+        Return the index of the Amscope with the given serial, or None.
+        Only opens a handle; nothing is streamed.
+        """
+        for index in range(maxIndex):
+            cap = Amscope.ToupCamCamera(camIndex=index, resolution=self.resolution)
+            try:
+                if cap.cam and str(cap.get_serial()) == serial:
+                    return index
+            finally:
+                cap.close()
+        return None
+
+    def frame_count(self):
+        """Live frames received since activation; lets pollers skip repeats."""
+        return self.capture.get_frame_count() if self.capture else 0
+
+    def get_new_frame(self, timeout=5.0):
+        if self.triggerMode:
+            self.fire_trigger()
+            return self.get_triggered_frame(timeout)
+        count = self.frame_count()
+        deadline = time.time() + timeout
+        while self.capture and self.frame_count() == count:
+            if time.time() > deadline:
+                raise CameraTimeoutError("No new frame from Amscope at index %s." % self.device)
+            time.sleep(0.001)
+        return self.get_frame()
+
+    def reconnect(self, serial=None):
+        self.deactivate()
+        if serial is not None:
+            index = self.find_device(serial)
+            if index is None:
+                return False
+            self.device = index
+        elif not self.device_present(self.device):
+            # Without a serial, all we can check is that something answers
+            # at the old index.
+            return False
+        self.disabled = False
+        return True
+
+    def device_present(self, index):
+        """True if an Amscope can be opened at ``index``. Nothing is streamed."""
+        cap = Amscope.ToupCamCamera(camIndex=index, resolution=self.resolution)
+        try:
+            return bool(cap.cam)
+        finally:
+            cap.close()
+
     def get_frame(self):
         if not self.capture:
             #raise CameraDeactivatedError("You must activate the camera before snapping!")
             return None
+        if self.capture.disconnected:
+            raise CameraDisconnectedError("Amscope at index %s was disconnected." % self.device)
         frame = self.rotate_bound(self.capture.get_np_image(), self.rotation)
         return frame
 
@@ -179,37 +392,210 @@ class AmscopeCamera(AbstractCamera):
     
 
 
+class FrameReader(threading.Thread):
+    """
+    Reads a VideoCapture continuously in the background and keeps only the
+    newest frame, so callers never block on the driver.
+    """
+    def __init__(self, capture, name):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.capture = capture
+        self.running = True
+        self.condition = threading.Condition()
+        self.frame = None
+        self.sequence = 0
+        self.timestamp = 0.0
+        self.failed = False
+        self.started = time.time()
+
+    def run(self):
+        while self.running:
+            ok, frame = self.capture.read()
+            with self.condition:
+                if not ok:
+                    self.failed = True
+                    self.condition.notify_all()
+                    return
+                self.frame = frame
+                self.sequence += 1
+                self.timestamp = time.time()
+                self.condition.notify_all()
+
+    def latest(self, fresherThan=None, timeout=READER_TIMEOUT_SECONDS):
+        """
+        Returns ``(sequence, timestamp, frame)`` of the newest frame. Waits for
+        a first frame, and with ``fresherThan`` (seconds) for one at most that old.
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            while not self.failed:
+                now = time.time()
+                if self.frame is not None and \
+                        (fresherThan is None or now - self.timestamp <= fresherThan):
+                    break
+                if now >= deadline:
+                    break
+                self.condition.wait(deadline - now)
+            if self.failed or self.frame is None:
+                raise CameraDisconnectedError("%s stopped delivering frames." % self.name)
+            return self.sequence, self.timestamp, self.frame
+
+    def fps(self):
+        elapsed = time.time() - self.started
+        return self.sequence / elapsed if elapsed > 0 else 0.0
+
+    def stop(self):
+        self.running = False
+        self.join(READER_TIMEOUT_SECONDS)
+
+
 class WebCamera(AbstractCamera):
     """Camera class impl for webcams that are supported by OpenCV3."""
     parameters = {"brightness" : cv2.CAP_PROP_BRIGHTNESS,
                     "contrast" : cv2.CAP_PROP_CONTRAST, 
                     "exposure_gain" : cv2.CAP_PROP_GAIN, 
                     "exposure_time" : cv2.CAP_PROP_EXPOSURE}
-    def __init__(self, device, fullRes=True):
+    def __init__(self, device, fullRes=True, backgroundReader=False, fourcc="MJPG", passthrough=False):
         self.rotation = 0
         self.device = device
-        self.capture = cv2.VideoCapture(device)
-        if fullRes:
+        self.fullRes = fullRes
+        self.disabled = False
+        self.backgroundReader = backgroundReader
+        self.reader = None
+        self.fourcc = fourcc
+        self.passthrough = False
+        self.open_capture()
+        print("Webcam %s: %s" % (device, self.describe_format()))
+        if passthrough:
+            self.passthrough = self.enable_passthrough()
+
+    def open_capture(self):
+        self.capture = cv2.VideoCapture(self.device)
+        # Not every backend honours this; the flush in grab_synchronized covers the rest.
+        self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # Without a FOURCC many UVC cameras fall back to raw YUYV, which at
+        # 1080p means a few FPS and most of the USB bandwidth. The format has
+        # to be requested before the frame size.
+        if self.fourcc:
+            self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc))
+        if self.fullRes:
             self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, 1920.0)
             self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080.0)
 
-    """Activation and deactivation are probably not required for webcams."""
+    def describe_format(self):
+        """The format the driver actually negotiated, e.g. 'MJPG 1920x1080 @ 30.0 fps'."""
+        code = int(self.capture.get(cv2.CAP_PROP_FOURCC))
+        fourcc = "".join(chr((code >> 8 * i) & 0xFF) for i in range(4))
+        return "%s %dx%d @ %.1f fps" % (fourcc,
+            self.capture.get(cv2.CAP_PROP_FRAME_WIDTH),
+            self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT),
+            self.capture.get(cv2.CAP_PROP_FPS))
+
+    def enable_passthrough(self):
+        """
+        Ask OpenCV for the camera's undecoded JPEG buffers. Only some backends
+        (e.g. V4L2, MSMF) support this; returns False and restores normal
+        decoding if the camera does not deliver JPEG.
+        """
+        self.capture.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        ok, data = self.capture.read()
+        if ok and is_jpeg(data):
+            return True
+        print("Webcam %s does not deliver JPEG; passthrough disabled." % self.device)
+        self.capture.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+        return False
+
+    def decode(self, frame):
+        """Frames are JPEG buffers in passthrough mode; decode them for display and processing."""
+        if self.passthrough:
+            return cv2.imdecode(frame, cv2.IMREAD_COLOR)
+        return frame
+
+    def get_jpeg_data(self):
+        """
+        The camera's own JPEG bytes for the next frame, without decoding or
+        re-encoding. None unless passthrough is on and no rotation is set.
+        """
+        if not self.passthrough or self.rotation:
+            return None
+        if self.reader:
+            data = self.reader.latest()[2]
+        else:
+            ok, data = self.capture.read()
+            if not ok:
+                raise CameraDisconnectedError("Webcam at index %s returned no frame." % self.device)
+        return data.tobytes()
+
+    """
+    Activation and deactivation are probably not required for webcams, but
+    they start and stop the background reader when it is enabled.
+    """
     def activate(self):
-        pass
+        if self.backgroundReader and not self.reader:
+            self.reader = FrameReader(self.capture, "Webcam %s reader" % self.device)
+            self.reader.start()
 
     def deactivate(self):
-        pass
+        if self.reader:
+            self.reader.stop()
+            print("%s: %.1f fps" % (self.reader.name, self.reader.fps()))
+            self.reader = None
 
-    def get_frame(self):
-        frame = self.rotate_bound(self.capture.read()[1], self.rotation)
+    def get_frame(self, fresherThan=None):
+        """
+        With a background reader this returns its newest frame without
+        blocking (the frame is shared, so don't modify it in place);
+        ``fresherThan`` waits for a frame at most that many seconds old.
+        """
+        if self.reader:
+            frame = self.decode(self.reader.latest(fresherThan)[2])
+            return self.rotate_bound(frame, self.rotation) if self.rotation else frame
+        ok, frame = self.capture.read()
+        if not ok:
+            raise CameraDisconnectedError("Webcam at index %s returned no frame." % self.device)
+        frame = self.rotate_bound(self.decode(frame), self.rotation)
         return frame
 
+    def memory_usage(self):
+        frame = self.reader.frame if self.reader else None
+        return {"buffer bytes": frame.nbytes if frame is not None else 0}
+
+    def get_new_frame(self):
+        if not self.reader:
+            return self.get_frame()
+        # Wait until the reader has moved past the frame that is current now.
+        sequence = self.reader.sequence
+        deadline = time.time() + READER_TIMEOUT_SECONDS
+        while self.reader.sequence == sequence:
+            if time.time() > deadline:
+                raise CameraTimeoutError("No new frame from webcam at index %s." % self.device)
+            time.sleep(0.001)
+        return self.get_frame()
+
+    def retrieve_frame(self):
+        """Decode the frame latched by the last ``capture.grab()``."""
+        ok, frame = self.capture.retrieve()
+        if not ok:
+            raise CameraDisconnectedError("Webcam at index %s returned no frame." % self.device)
+        return self.rotate_bound(self.decode(frame), self.rotation)
+
+    def reconnect(self, serial=None):
+        # OpenCV has no serials, so the device index is all we can go on.
+        self.deactivate()
+        self.capture.release()
+        self.open_capture()
+        if self.passthrough:
+            self.passthrough = self.enable_passthrough()
+        return self.capture.isOpened() and self.capture.read()[0]
+
     def set_parameter(self, key, value):
         assert (key in self.parameters.keys())
         self.capture.set(self.parameters[key], value)
 
 
     def close(self):
+        self.deactivate()
         self.capture.release()
         cv2.destroyAllWindows()
     
@@ -226,4 +612,58 @@ class WebCamera(AbstractCamera):
 
     def set_exposure(self, value):
         self.capture.set(cv2.CAP_PROP_EXPOSURE, value)
-    
\ No newline at end of file
+    
+
+
+def grab_synchronized(webcams, flush=WEBCAM_FLUSH_FRAMES):
+    """
+    Capture one frame from each webcam as close together in time as possible.
+    Stale buffered frames are flushed first, then every camera is grabbed
+    back to back and only afterwards are the frames retrieved and decoded.
+
+    Returns ``(frames, skew)``: a frame per webcam (None for a camera that
+    failed) and the spread of the grab times in seconds.
+    """
+    # Webcams with a background reader are already streaming; their newest
+    # frame stands in for a grab, and the reader owns the VideoCapture.
+    direct = [cam for cam in webcams if not cam.reader]
+    for cam in direct:
+        for _ in range(flush):
+            cam.capture.grab()
+
+    grabbed = []
+    stamps = []
+    latest = {}
+    for cam in webcams:
+        if cam.reader:
+            try:
+                latest[cam] = cam.get_frame()
+                grabbed.append(True)
+                stamps.append(cam.reader.timestamp)
+            except CameraError:
+                grabbed.append(False)
+                stamps.append(time.time())
+        else:
+            grabbed.append(cam.capture.grab())
+            stamps.append(time.time())
+
+    frames = []
+    for cam, ok in zip(webcams, grabbed):
+        try:
+            if not ok:
+                frames.append(None)
+            elif cam in latest:
+                frames.append(latest[cam])
+            else:
+                frames.append(cam.retrieve_frame())
+        except CameraError:
+            frames.append(None)
+    okStamps = [stamp for stamp, ok in zip(stamps, grabbed) if ok]
+    skew = max(okStamps) - min(okStamps) if okStamps else 0.0
+    return frames, skew
+
+
+def is_jpeg(data):
+    """True if a raw capture buffer holds a JPEG image (starts with the SOI marker)."""
+    return data is not None and data.size > 2 and data.ndim <= 2 \
+        and data.ravel()[0] == 0xFF and data.ravel()[1] == 0xD8
@@ -0,0 +1,268 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Indexed manifest of every capture, in an SQLite database at
+    <capturePath>/manifest.sqlite: path (relative to the capture path),
+    device name, serial, wall and monotonic time, frame shape and encoder.
+    Lookups by camera and time range use the indexes, so they stay fast
+    across millions of frames:
+
+        python captureManifest.py query <capturePath> [<device>|all [<start> [<end>]]]
+
+    Times are '2017-08-08 02:00', '2017-08-08_02-00-00' (as in file names) or
+    seconds since the epoch. Index existing capture folders, one process per
+    camera folder, with:
+
+        python captureManifest.py rebuild <capturePath> [<processes>]
+
+    author: Jacob Kosberg
+"""
+
+import collections
+import multiprocessing
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+MANIFEST_FILENAME = "manifest.sqlite"
+FLUSH_RECORDS = 256
+FLUSH_SECONDS = 10.0
+NAME_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})(?:-(\d{6}))?$")
+TIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    path TEXT PRIMARY KEY,
+    device TEXT NOT NULL,
+    serial TEXT,
+    wall REAL NOT NULL,
+    monotonic REAL,
+    height INTEGER,
+    width INTEGER,
+    channels INTEGER,
+    encoder TEXT
+);
+CREATE INDEX IF NOT EXISTS captures_device_wall ON captures (device, wall);
+CREATE INDEX IF NOT EXISTS captures_serial_wall ON captures (serial, wall);
+CREATE INDEX IF NOT EXISTS captures_wall ON captures (wall);
+"""
+COLUMNS = ("path", "device", "serial", "wall", "monotonic", "height", "width", "channels", "encoder")
+
+Capture = collections.namedtuple("Capture", COLUMNS)
+
+
+def monotonic():
+    """Monotonic clock reading, or None where Python has none (Python 2)."""
+    clock = getattr(time, "monotonic", None)
+    return clock() if clock else None
+
+
+def parse_time(text):
+    """Seconds since the epoch from a file name time, a local date and time, or a number."""
+    match = NAME_PATTERN.match(text)
+    if match:
+        return time.mktime(time.strptime(match.group(1), "%Y-%m-%d_%H-%M-%S")) + int(match.group(2) or 0) / 1e6
+    for timeFormat in TIME_FORMATS:
+        try:
+            return time.mktime(time.strptime(text, timeFormat))
+        except ValueError:
+            pass
+    return float(text)
+
+
+def name_time(filename):
+    """Capture time encoded in a file name, or None if it has none."""
+    base = os.path.splitext(os.path.basename(filename))[0]
+    return parse_time(base) if NAME_PATTERN.match(base) else None
+
+
+def has_manifest(path):
+    return os.path.isfile(os.path.join(path, MANIFEST_FILENAME))
+
+
+def split_shape(shape):
+    if shape is None:
+        return None, None, None
+    return shape[0], shape[1], shape[2] if len(shape) > 2 else 1
+
+
+class Manifest(object):
+    """
+    The capture manifest of ``root``. Records are buffered and written in
+    batches, like the settings journal; queries write out the buffer first.
+    Safe to share between threads.
+    """
+    def __init__(self, root, filename=MANIFEST_FILENAME):
+        self.root = root
+        self.path = os.path.join(root, filename)
+        if not os.path.exists(root):
+            os.makedirs(root)
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.bufferedSince = None
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        # Readers (queries from another process) don't block the writer.
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def record(self, path, device, serial=None, wall=None, monotonicTime=None, shape=None, encoder=None):
+        """Record a capture at ``path``, relative to the root or absolute below it."""
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.root)
+        row = (path, device, serial, time.time() if wall is None else wall, monotonicTime) + \
+            split_shape(shape) + (encoder,)
+        with self.lock:
+            self.buffer.append(row)
+            if self.bufferedSince is None:
+                self.bufferedSince = time.time()
+            if len(self.buffer) >= FLUSH_RECORDS:
+                self.write()
+
+    def insert(self, rows):
+        """Add rows (in COLUMNS order) at once, keeping what is recorded already for a path."""
+        with self.lock:
+            self.db.executemany("INSERT OR IGNORE INTO captures VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.db.commit()
+
+    def flush_if_due(self):
+        """Write out buffered records that have waited long enough. Cheap to call often."""
+        if self.bufferedSince is not None and time.time() - self.bufferedSince > FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.write()
+
+    def write(self):
+        if not self.buffer:
+            return
+        self.db.executemany("INSERT OR REPLACE INTO captures VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", self.buffer)
+        self.db.commit()
+        self.buffer = []
+        self.bufferedSince = None
+
+    def query(self, device=None, serial=None, start=None, end=None, limit=None):
+        """Captures of one camera (by name or serial, or all) from ``start`` up to ``end``, oldest first."""
+        conditions, values = [], []
+        for clause, value in (("device = ?", device), ("serial = ?", serial),
+                ("wall >= ?", start), ("wall < ?", end)):
+            if value is not None:
+                conditions.append(clause)
+                values.append(value)
+        sql = "SELECT %s FROM captures" % ", ".join(COLUMNS)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY wall"
+        if limit:
+            sql += " LIMIT %d" % limit
+        with self.lock:
+            self.write()
+            return [Capture(*row) for row in self.db.execute(sql, values)]
+
+    def paths(self, device=None, serial=None, start=None, end=None):
+        """Full paths of the captures ``query`` returns."""
+        return [os.path.join(self.root, capture.path) for capture in self.query(device, serial, start, end)]
+
+    def devices(self):
+        with self.lock:
+            self.write()
+            return [row[0] for row in self.db.execute("SELECT DISTINCT device FROM captures ORDER BY device")]
+
+    def count(self):
+        with self.lock:
+            self.write()
+            return self.db.execute("SELECT COUNT(*) FROM captures").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.write()
+            self.db.close()
+
+
+def image_shape(path):
+    """Shape of an image file, reading only its header where possible."""
+    if path.endswith(".npy"):
+        import numpy
+        return numpy.load(path, mmap_mode="r").shape
+    try:
+        from PIL import Image
+        image = Image.open(path)
+        width, height = image.size
+        return (height, width, len(image.getbands()))
+    except ImportError:
+        import cv2
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        return image.shape if image is not None else None
+    except (IOError, OSError):
+        return None
+
+
+def index_folder(job):
+    """Manifest rows for the images of one camera folder."""
+    import timelapseVideo
+    root, folder = job
+    device = os.path.basename(folder)
+    rows = []
+    for path in timelapseVideo.list_images(folder):
+        wall = name_time(path)
+        if wall is None:
+            wall = os.path.getmtime(path)
+        # The preset isn't known afterwards, only the format.
+        encoder = os.path.splitext(path)[1][1:].lower()
+        rows.append((os.path.relpath(path, root), device, None, wall, None) +
+            split_shape(image_shape(path)) + (encoder,))
+    return folder, rows
+
+
+def rebuild(capturePath, processes=None):
+    """
+    Index every camera folder under ``capturePath`` in parallel. Captures
+    the manifest already holds keep their recorded details.
+    """
+    folders = [os.path.join(capturePath, d) for d in sorted(os.listdir(capturePath))
+        if d != "reconstruction" and os.path.isdir(os.path.join(capturePath, d))]
+    manifest = Manifest(capturePath)
+    pool = multiprocessing.Pool(processes)
+    counts = []
+    try:
+        for folder, rows in pool.imap_unordered(index_folder, [(capturePath, folder) for folder in folders]):
+            manifest.insert(rows)
+            counts.append((folder, len(rows)))
+    finally:
+        pool.close()
+        pool.join()
+        manifest.close()
+    return sorted(counts)
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ("rebuild", "query"):
+        print("Usage: python captureManifest.py rebuild <capturePath> [<processes>]\n"
+            "       python captureManifest.py query <capturePath> [<device>|all [<start> [<end>]]]")
+        sys.exit(1)
+    capturePath = sys.argv[2]
+    start = time.time()
+    if sys.argv[1] == "rebuild":
+        processes = int(sys.argv[3]) if len(sys.argv) > 3 else None
+        for folder, count in rebuild(capturePath, processes):
+            print("%s: %d captures" % (folder, count))
+        print("Indexed in %.1f s" % (time.time() - start))
+        return
+    device = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3] != "all" else None
+    begin = parse_time(sys.argv[4]) if len(sys.argv) > 4 else None
+    end = parse_time(sys.argv[5]) if len(sys.argv) > 5 else None
+    manifest = Manifest(capturePath)
+    start = time.time()
+    paths = manifest.paths(device, start=begin, end=end)
+    seconds = time.time() - start
+    for path in paths:
+        print(path)
+    print("%d captures in %.1f ms" % (len(paths), 1000 * seconds))
+
+if __name__ == "__main__":
+    main()
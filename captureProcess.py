@@ -0,0 +1,342 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Runs each camera in its own process. The process writes frames into a
+    shared-memory ring that the main process copies the newest frame out of,
+    and takes commands (activate, parameter changes, snap) over a pipe. Driver
+    callbacks, rotation and the GUI then no longer share one GIL.
+    author: Jacob Kosberg
+"""
+
+import ctypes
+import multiprocessing
+import threading
+import time
+
+import numpy
+
+from camera import AbstractCamera, CameraDisconnectedError
+
+RING_SLOTS = 4
+SLOT_MEGABYTES = 32
+FRAME_TIMEOUT_SECONDS = 5.0
+IDLE_POLL_SECONDS = 0.5
+
+# Per-slot metadata: sequence number, timestamp, height, width, channels.
+META_FIELDS = 5
+
+
+class SharedFrameRing(object):
+    """
+    A ring of 8-bit frame slots in shared memory, written by one camera
+    process and read by others. Readers copy a frame out and check its
+    sequence number again afterwards, like a seqlock: the writer marks a
+    slot as being written before touching it, so a copy torn by the writer
+    is noticed and retried. Any number of readers may read at once.
+    """
+    def __init__(self, slots=RING_SLOTS, slotBytes=SLOT_MEGABYTES * 1024 ** 2):
+        self.slots = slots
+        self.slotBytes = slotBytes
+        self.buffer = multiprocessing.RawArray(ctypes.c_uint8, slots * slotBytes)
+        self.meta = multiprocessing.RawArray(ctypes.c_double, slots * META_FIELDS)
+        # Latest published sequence number.
+        self.state = multiprocessing.RawArray(ctypes.c_double, 1)
+        self.lastSlot = -1
+        self._views = None
+        # Each reader's own frame buffer, reused by the next ``latest``.
+        self._copy = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_views"] = None
+        state["_copy"] = None
+        return state
+
+    def views(self):
+        if self._views is None:
+            data = numpy.frombuffer(self.buffer, dtype=numpy.uint8).reshape(self.slots, self.slotBytes)
+            meta = numpy.frombuffer(self.meta, dtype=numpy.float64).reshape(self.slots, META_FIELDS)
+            state = numpy.frombuffer(self.state, dtype=numpy.float64)
+            self._views = data, meta, state
+        return self._views
+
+    def write(self, frame, timestamp=None):
+        """Publish a frame. Only one process may write to a ring."""
+        data, meta, state = self.views()
+        frame = numpy.ascontiguousarray(frame, dtype=numpy.uint8)
+        if frame.nbytes > self.slotBytes:
+            raise ValueError("Frame of %d bytes does not fit a %d byte ring slot." %
+                (frame.nbytes, self.slotBytes))
+
+        slot = (self.lastSlot + 1) % self.slots
+        seq = state[0] + 1
+        shape = frame.shape + (1,) * (3 - frame.ndim)
+
+        meta[slot, 0] = -1
+        data[slot, :frame.nbytes] = frame.reshape(-1)
+        meta[slot, 1:] = (time.time() if timestamp is None else timestamp,) + shape
+        meta[slot, 0] = seq
+        state[0] = seq
+        self.lastSlot = slot
+        return int(seq)
+
+    def sequence(self):
+        return int(self.views()[2][0])
+
+    def latest(self):
+        """
+        Returns ``(sequence, timestamp, frame)`` of the newest frame, or None
+        if nothing was written yet. ``frame`` is this reader's copy, reused by
+        the next call.
+        """
+        data, meta, state = self.views()
+        while True:
+            seq = state[0]
+            if seq <= 0:
+                return None
+            slots = numpy.flatnonzero(meta[:, 0] == seq)
+            if not len(slots):
+                continue
+            slot = slots[0]
+            timestamp, height, width, channels = meta[slot, 1:]
+            shape = (int(height), int(width)) + ((int(channels),) if channels > 1 else ())
+            nbytes = int(height * width * channels)
+            if self._copy is None or self._copy.shape != shape:
+                self._copy = numpy.empty(shape, numpy.uint8)
+            self._copy.reshape(-1)[...] = data[slot, :nbytes]
+            # Valid only if the writer did not start on the slot meanwhile.
+            if meta[slot, 0] == seq:
+                return int(seq), timestamp, self._copy
+
+
+def snap(cam, ring):
+    """Write one frame newer than anything already in the ring; returns its sequence."""
+    if hasattr(cam, "frame_count"):
+        count = cam.frame_count()
+        deadline = time.time() + FRAME_TIMEOUT_SECONDS
+        while cam.frame_count() == count and time.time() < deadline:
+            time.sleep(0.001)
+    frame = cam.get_frame()
+    if frame is None:
+        raise IOError("Camera is not activated.")
+    return ring.write(frame)
+
+
+def run_camera(cameraClass, args, kwargs, ring, conn, failed):
+    """
+    Camera process main loop: serve commands and stream frames into the
+    ring. ``failed`` is set when streaming stops on an error, until the
+    camera is activated again.
+    """
+    cam = cameraClass(*args, **kwargs)
+    active = False
+    # Set while the parent reads a capture frame, so the stream doesn't overwrite it.
+    held = False
+    lastCount = None
+    checked = time.time()
+    while True:
+        if conn.poll(0 if active and not held else IDLE_POLL_SECONDS):
+            command, params = conn.recv()
+            if command == "stop":
+                cam.close()
+                conn.send((True, None))
+                return
+            try:
+                if command == "activate":
+                    failed.value = False
+                    cam.activate()
+                    active = not getattr(cam, "disabled", False)
+                    lastCount = None
+                    result = not active
+                elif command == "deactivate":
+                    cam.deactivate()
+                    active = False
+                    result = None
+                elif command == "snap":
+                    result = snap(cam, ring)
+                elif command == "capture":
+                    result = ring.write(cam.get_capture_frame(*params))
+                    held = True
+                elif command == "resume":
+                    held = False
+                    result = None
+                elif command == "attribute":
+                    result = getattr(cam, params[0], params[1])
+                else:
+                    target = cam
+                    for name in command.split("."):
+                        target = getattr(target, name)
+                    result = target(*params)
+                conn.send((True, result))
+            except Exception as e:
+                conn.send((False, "%s: %s" % (type(e).__name__, e)))
+
+        if active and not held:
+            try:
+                # Amscope frames arrive through the driver callback; only copy
+                # new ones. A stalled stream is still checked now and then,
+                # since get_frame is what notices a detached camera.
+                if hasattr(cam, "frame_count"):
+                    count = cam.frame_count()
+                    if count == lastCount:
+                        if time.time() - checked > IDLE_POLL_SECONDS:
+                            cam.get_frame()
+                            checked = time.time()
+                        time.sleep(0.001)
+                        continue
+                    lastCount = count
+                    checked = time.time()
+                frame = cam.get_frame()
+            except Exception as e:
+                print("Camera process %s: %s" % (args[0], e))
+                failed.value = True
+                active = False
+                continue
+            if frame is not None:
+                ring.write(frame)
+
+
+class RemoteCapture(object):
+    """Stands in for a camera's ``capture`` object, forwarding calls to the process."""
+    def __init__(self, owner):
+        self.owner = owner
+
+    def __getattr__(self, name):
+        return lambda *args: self.owner.call("capture." + name, *args)
+
+
+class ProcessCamera(AbstractCamera):
+    """
+    Proxy for a camera running in its own process. Has the same interface as
+    the camera it wraps; frames come from the shared-memory ring.
+    """
+    def __init__(self, cameraClass, device, slotMegabytes=SLOT_MEGABYTES, **kwargs):
+        self.device = device
+        self.rotation = 0
+        self.disabled = False
+        self.capture = None
+        self.activated = 0.0
+        self.startSequence = 0
+        self.ring = SharedFrameRing(slotBytes=slotMegabytes * 1024 ** 2)
+        # Set by the camera process when its stream fails.
+        self.failed = multiprocessing.RawValue(ctypes.c_bool, False)
+        self.lock = threading.Lock()
+        self.conn, childConn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=run_camera,
+            args=(cameraClass, (device,), kwargs, self.ring, childConn, self.failed),
+            name="Camera %s" % device)
+        self.process.daemon = True
+        self.process.start()
+
+    def call(self, command, *params):
+        # Settings widgets call in from the GUI thread while the Worker
+        # captures, so requests are serialized.
+        with self.lock:
+            self.conn.send((command, params))
+            ok, result = self.conn.recv()
+        if not ok:
+            raise IOError("Camera %s: %s" % (self.device, result))
+        return result
+
+    def __getattr__(self, name):
+        if name.startswith(("set_", "get_")):
+            return lambda *args: self.call(name, *args)
+        raise AttributeError(name)
+
+    def activate(self):
+        self.disabled = self.call("activate")
+        self.capture = None if self.disabled else RemoteCapture(self)
+        self.activated = time.time()
+        self.startSequence = self.ring.sequence()
+
+    def deactivate(self):
+        if self.capture:
+            frames = self.ring.sequence() - self.startSequence
+            print("Camera process %s: %.1f fps" % (self.device, frames / (time.time() - self.activated)))
+        self.call("deactivate")
+        self.capture = None
+
+    @property
+    def passthrough(self):
+        """
+        Whether the camera hands out its own JPEG bytes. Asked each time,
+        since a camera turns passthrough off when its backend can't do it.
+        """
+        return self.call("attribute", "passthrough", False)
+
+    def check_stream(self):
+        """
+        Raise if the camera process stopped streaming on an error, rather
+        than hand out the last frame in the ring again.
+        """
+        if self.failed.value:
+            raise CameraDisconnectedError("Camera process %s stopped streaming." % self.device)
+
+    def get_frame(self):
+        """
+        The newest frame, in a buffer that is reused by the next get_frame.
+        Waits for a first frame after activation.
+        """
+        if not self.capture:
+            return None
+        deadline = time.time() + FRAME_TIMEOUT_SECONDS
+        while self.ring.sequence() <= self.startSequence:
+            self.check_stream()
+            if time.time() > deadline or not self.process.is_alive():
+                return None
+            time.sleep(0.005)
+        self.check_stream()
+        return self.ring.latest()[2]
+
+    def snap(self):
+        """Have the camera process deliver a fresh frame and return it."""
+        if not self.capture:
+            return None
+        self.check_stream()
+        self.call("snap")
+        return self.ring.latest()[2]
+
+    def get_new_frame(self):
+        return self.snap()
+
+    def memory_usage(self):
+        return {"buffer bytes": self.ring.slots * self.ring.slotBytes}
+
+    def get_capture_frame(self, new=False):
+        """The camera's capture frame, in a buffer of its own."""
+        if not self.capture:
+            return None
+        self.check_stream()
+        self.call("capture", new)
+        try:
+            return self.ring.latest()[2].copy()
+        finally:
+            self.call("resume")
+
+    def reconnect(self, serial=None):
+        return self.call("reconnect", serial)
+
+    def close(self):
+        if self.process.is_alive():
+            self.call("stop")
+            self.process.join(FRAME_TIMEOUT_SECONDS)
+
+    def set_parameter(self, key, value):
+        self.call("set_parameter", key, value)
+
+    def set_brightness(self, value):
+        self.call("set_brightness", value)
+
+    def set_contrast(self, value):
+        self.call("set_contrast", value)
+
+    def set_gain(self, value):
+        self.call("set_gain", value)
+
+    def set_exposure(self, value):
+        self.call("set_exposure", value)
+
+    def set_rotation(self, value):
+        self.rotation = value
+        self.call("set_rotation", value)
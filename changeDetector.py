@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Change-triggered capture. Each new frame is compared with the last saved
+    frame of the same camera on a small grayscale thumbnail, and only saved
+    when the change crosses a threshold. Every Nth round is saved regardless.
+    author: Jacob Kosberg
+"""
+
+import cv2
+import numpy
+
+THUMBNAIL_SIZE = (64, 48)
+METRICS = ("diff", "hist")
+
+
+def thumbnail(frame):
+    if frame.ndim == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(frame, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+
+
+def mean_difference(a, b):
+    """Mean absolute pixel difference, 0 to 255."""
+    return float(cv2.absdiff(a, b).mean())
+
+
+def histogram_distance(a, b):
+    """Bhattacharyya distance between grayscale histograms, scaled to 0 to 100."""
+    ha = cv2.calcHist([a], [0], None, [32], [0, 256])
+    hb = cv2.calcHist([b], [0], None, [32], [0, 256])
+    cv2.normalize(ha, ha)
+    cv2.normalize(hb, hb)
+    return 100.0 * cv2.compareHist(ha, hb, cv2.HISTCMP_BHATTACHARYYA)
+
+
+class CameraHistory(object):
+    """What the detector remembers about one camera."""
+    def __init__(self):
+        self.reference = None
+        self.sinceSaved = 0
+        self.saved = 0
+        self.skipped = 0
+        self.savedBytes = 0
+        self.savedSeconds = 0.0
+
+
+class ChangeDetector(object):
+    """
+    Decides per camera whether a frame differs enough from the last saved
+    one to be worth writing. ``threshold`` is in units of the chosen metric;
+    ``keyframeInterval`` forces a save every N rounds (0 never forces).
+    """
+    def __init__(self, threshold, metric="diff", keyframeInterval=10):
+        if metric not in METRICS:
+            raise ValueError("Unknown change metric '%s'. Use one of: %s" % (metric, ", ".join(METRICS)))
+        self.threshold = threshold
+        self.metric = mean_difference if metric == "diff" else histogram_distance
+        self.keyframeInterval = keyframeInterval
+        self.cameras = {}
+
+    def history(self, deviceName):
+        return self.cameras.setdefault(deviceName, CameraHistory())
+
+    def shouldSave(self, deviceName, frame):
+        """Returns True if the frame should be saved and remembers it as the reference."""
+        history = self.history(deviceName)
+        small = thumbnail(frame)
+        history.sinceSaved += 1
+        keyframe = self.keyframeInterval and history.sinceSaved >= self.keyframeInterval
+        if history.reference is None or keyframe or \
+                self.metric(history.reference, small) >= self.threshold:
+            history.reference = small
+            history.sinceSaved = 0
+            return True
+        history.skipped += 1
+        return False
+
+    def recordSave(self, deviceName, seconds, nbytes):
+        """Record the cost of a save, used to estimate what skipping saved."""
+        history = self.history(deviceName)
+        history.saved += 1
+        history.savedSeconds += seconds
+        history.savedBytes += nbytes
+
+    def report(self):
+        """Per-camera lines of skipped frames and estimated disk and encode time saved."""
+        lines = []
+        for name in sorted(self.cameras, key=str):
+            history = self.cameras[name]
+            saved = max(history.saved, 1)
+            lines.append("%s: %d saved, %d skipped, ~%.1f MB and ~%.1f s of encoding saved" %
+                (name, history.saved, history.skipped,
+                history.skipped * history.savedBytes / saved / 1e6,
+                history.skipped * history.savedSeconds / saved))
+        return lines
@@ -0,0 +1,148 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Image encoders for captured frames, with speed/size presets.
+    Run as a script to benchmark the presets on representative frames:
+
+        python encoders.py <image> [<image> ...]
+
+    author: Jacob Kosberg
+"""
+
+import io
+import os
+import sys
+import time
+
+import cv2
+import numpy
+
+# Not every OpenCV build exposes the TIFF compression flag; 259 is the TIFF tag.
+IMWRITE_TIFF_COMPRESSION = getattr(cv2, "IMWRITE_TIFF_COMPRESSION", 259)
+TIFF_NONE = 1
+TIFF_LZW = 5
+
+
+class Encoder(object):
+    """Writes frames with one file format and one set of cv2.imwrite flags."""
+    def __init__(self, name, extension, params=()):
+        self.name = name
+        self.extension = extension
+        self.params = list(params)
+
+    def write(self, filename, frame):
+        if self.extension == ".npy":
+            numpy.save(filename, frame)
+        elif not cv2.imwrite(filename, frame, self.params):
+            raise IOError("Could not write " + filename)
+        return filename
+
+    def encode(self, frame):
+        """Encode to an in-memory buffer; used by the benchmark and the frame server."""
+        if self.extension == ".npy":
+            buf = io.BytesIO()
+            numpy.save(buf, frame)
+            return buf.getvalue()
+        ok, data = cv2.imencode(self.extension, frame, self.params)
+        if not ok:
+            raise IOError("Could not encode frame as " + self.extension)
+        return data.tobytes()
+
+    def __repr__(self):
+        return "Encoder(%s)" % self.name
+
+
+def png(level):
+    return Encoder("png:%d" % level, ".png", [cv2.IMWRITE_PNG_COMPRESSION, level])
+
+def tiff(compression):
+    name = "tiff-lzw" if compression == TIFF_LZW else "tiff"
+    return Encoder(name, ".tiff", [IMWRITE_TIFF_COMPRESSION, compression])
+
+def jpeg(quality):
+    return Encoder("jpeg:%d" % quality, ".jpg", [cv2.IMWRITE_JPEG_QUALITY, quality])
+
+def webp(quality):
+    # Quality above 100 makes OpenCV write lossless WebP.
+    return Encoder("webp:%d" % quality, ".webp", [cv2.IMWRITE_WEBP_QUALITY, quality])
+
+def npy():
+    return Encoder("npy", ".npy")
+
+
+PRESETS = {
+    "png": png(3),          # cv2.imwrite default
+    "png-fast": png(1),
+    "png-small": png(9),
+    "tiff": tiff(TIFF_NONE),
+    "tiff-lzw": tiff(TIFF_LZW),
+    "jpeg": jpeg(95),
+    "jpeg-small": jpeg(80),
+    "webp": webp(90),
+    "webp-lossless": webp(101),
+    "npy": npy(),
+}
+
+DEFAULT_PRESET = "png"
+
+_FACTORIES = {"png": png, "jpeg": jpeg, "webp": webp}
+
+
+def get_encoder(spec):
+    """
+    Look up an encoder by preset name ('png-fast', 'tiff-lzw', ...) or by
+    'format:level', e.g. 'png:6' or 'jpeg:90'.
+    """
+    if spec in PRESETS:
+        return PRESETS[spec]
+    kind, _, level = spec.partition(":")
+    if kind in _FACTORIES and level.isdigit():
+        return _FACTORIES[kind](int(level))
+    raise ValueError("Unknown encoder '%s'. Presets: %s" %
+        (spec, ", ".join(sorted(PRESETS))))
+
+
+def read_image(filename):
+    """cv2.imread that also understands .npy frames."""
+    if filename.endswith(".npy"):
+        return numpy.load(filename)
+    return cv2.imread(filename)
+
+
+def benchmark(frames, encoders=None, repeat=3):
+    """
+    Encode every frame with every encoder. Returns a list of
+    (name, ms per frame, bytes per frame), fastest first.
+    """
+    if encoders is None:
+        encoders = [PRESETS[name] for name in sorted(PRESETS)]
+    results = []
+    for encoder in encoders:
+        size = 0
+        start = time.time()
+        for _ in range(repeat):
+            for frame in frames:
+                size += len(encoder.encode(frame))
+        count = repeat * len(frames)
+        results.append((encoder.name, 1000.0 * (time.time() - start) / count, size // count))
+    return sorted(results, key=lambda result: result[1])
+
+
+def main():
+    paths = sys.argv[1:]
+    if not paths:
+        print("Usage: python encoders.py <image> [<image> ...]")
+        sys.exit(1)
+    frames = [read_image(path) for path in paths if os.path.isfile(path)]
+    frames = [frame for frame in frames if frame is not None]
+    if not frames:
+        print("No readable images given.")
+        sys.exit(1)
+    print("%d frames, %dx%d" % (len(frames), frames[0].shape[1], frames[0].shape[0]))
+    print("%-14s %10s %12s" % ("encoder", "ms/frame", "bytes/frame"))
+    for name, ms, size in benchmark(frames):
+        print("%-14s %10.1f %12d" % (name, ms, size))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Streaming multi-frame averaging for low-noise captures. Frames are
+    accumulated into preallocated float32 buffers as they arrive, so memory
+    stays at a few frames no matter how many are averaged.
+    author: Jacob Kosberg
+"""
+
+import time
+
+import cv2
+import numpy
+
+# Frames seen before sigma-clipping starts; the running deviation is
+# meaningless before that.
+CLIP_WARMUP_FRAMES = 3
+
+# Smallest variance a pixel is clipped against, in grey levels squared.
+# Without it, a pixel whose warm-up samples were all equal (dark, saturated
+# or quantised) has zero variance and rejects every later sample.
+MIN_VARIANCE = 1.0
+
+
+class FrameAverager(object):
+    """
+    Averages frames of one shape. Without ``sigma`` this is a plain running
+    sum. With ``sigma``, each pixel keeps a running mean and variance
+    (Welford), and samples further than ``sigma`` deviations from the
+    running mean are left out, which drops hot pixels, cosmic rays and the
+    odd flicker.
+    """
+    def __init__(self, shape, sigma=0):
+        self.sigma = sigma
+        self.count = 0
+        self.seconds = 0.0
+        if sigma:
+            self.mean = numpy.zeros(shape, numpy.float32)
+            self.m2 = numpy.zeros(shape, numpy.float32)
+            self.n = numpy.zeros(shape, numpy.float32)
+            self.delta = numpy.empty(shape, numpy.float32)
+            self.scratch = numpy.zeros(shape, numpy.float32)
+            self.keep = numpy.empty(shape, numpy.bool_)
+            self.limit = numpy.empty(shape, numpy.float32)
+        else:
+            self.sum = numpy.zeros(shape, numpy.float32)
+
+    def add(self, frame):
+        start = time.time()
+        if self.sigma:
+            self.add_clipped(frame)
+        else:
+            cv2.accumulate(frame, self.sum)
+        self.count += 1
+        self.seconds += time.time() - start
+
+    def add_clipped(self, frame):
+        delta, scratch, keep, limit = self.delta, self.scratch, self.keep, self.limit
+        numpy.subtract(frame, self.mean, out=delta, casting="unsafe")
+        if self.count >= CLIP_WARMUP_FRAMES:
+            # |delta| <= sigma * std  <=>  delta^2 * n / sigma^2 <= m2,
+            # with m2 floored at n * MIN_VARIANCE.
+            numpy.multiply(delta, delta, out=scratch)
+            scratch *= self.n
+            scratch *= 1.0 / self.sigma ** 2
+            numpy.multiply(self.n, MIN_VARIANCE, out=limit)
+            numpy.maximum(limit, self.m2, out=limit)
+            numpy.less_equal(scratch, limit, out=keep)
+        else:
+            keep.fill(True)
+        self.n += keep
+        # Welford update, applied only where the sample is kept.
+        numpy.divide(delta, self.n, out=scratch, where=keep)
+        scratch *= keep
+        self.mean += scratch
+        numpy.subtract(frame, self.mean, out=scratch, casting="unsafe")
+        scratch *= delta
+        scratch *= keep
+        self.m2 += scratch
+
+    def result(self, dtype=numpy.uint8):
+        """The averaged frame, converted to ``dtype``."""
+        if not self.count:
+            raise ValueError("No frames were averaged.")
+        average = self.mean if self.sigma else self.sum / self.count
+        return numpy.clip(numpy.rint(average), 0, numpy.iinfo(dtype).max).astype(dtype)
+
+    def cost_ms(self):
+        """Mean cost of adding one frame, in milliseconds."""
+        return 1000 * self.seconds / self.count if self.count else 0.0
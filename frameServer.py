@@ -0,0 +1,209 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Small HTTP server for watching cameras from a browser or another program.
+    For camera i (in device list order):
+
+        /i.mjpg    MJPEG stream
+        /i.jpg     latest frame as a JPEG
+
+    Each frame is JPEG-encoded once, in a background thread and at a capped
+    rate, and the bytes are shared by every client. A client that can't keep
+    up just gets the newest frame when it is ready for the next one, so slow
+    clients never hold up capture or each other.
+    author: Jacob Kosberg
+"""
+
+import re
+import threading
+import time
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+import encoders
+
+DEFAULT_PORT = 8080
+MAX_FPS = 5.0
+JPEG_QUALITY = 80
+BOUNDARY = "frame"
+PATH_PATTERN = re.compile(r"^/(\d+)\.(mjpg|jpg)$")
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FrameRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        frames = self.server.frames
+        match = PATH_PATTERN.match(self.path)
+        if self.path == "/":
+            self.send_index(frames)
+        elif match and int(match.group(1)) < len(frames.names):
+            if match.group(2) == "mjpg":
+                self.send_stream(frames, int(match.group(1)))
+            else:
+                self.send_snapshot(frames, int(match.group(1)))
+        else:
+            self.send_error(404)
+
+    def send_index(self, frames):
+        links = "".join('<li>%s: <a href="/%d.mjpg">stream</a> <a href="/%d.jpg">snapshot</a></li>' %
+            (name, i, i) for i, name in enumerate(frames.names))
+        body = ("<html><body><ul>%s</ul></body></html>" % links).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_snapshot(self, frames, index):
+        sequence, data = frames.latest(index)
+        if data is None:
+            self.send_error(503, "No frame yet")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_stream(self, frames, index):
+        self.send_response(200)
+        self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=" + BOUNDARY)
+        self.end_headers()
+        frames.connect()
+        try:
+            sequence = 0
+            while frames.running:
+                newer, data = frames.wait(index, sequence)
+                if data is None:
+                    continue
+                if sequence and newer > sequence + 1:
+                    frames.recordDropped(newer - sequence - 1)
+                sequence = newer
+                self.wfile.write(("--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" %
+                    (BOUNDARY, len(data))).encode("ascii"))
+                self.wfile.write(data)
+                self.wfile.write(b"\r\n")
+        except (IOError, OSError):
+            # The client went away.
+            pass
+        finally:
+            frames.disconnect()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FrameServer(object):
+    """
+    Serves the newest frame of each camera over HTTP. ``publish`` is cheap
+    and never blocks: it only keeps a reference to the frame for the
+    encoder thread, replacing one that was not encoded yet.
+    """
+    def __init__(self, names, port=DEFAULT_PORT, host="127.0.0.1", maxFps=MAX_FPS, quality=JPEG_QUALITY):
+        self.names = list(names)
+        self.interval = 1.0 / maxFps
+        self.encoder = encoders.jpeg(quality)
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.frames = {}
+        self.sequences = {}
+        self.published = {}
+        self.running = True
+        self.clients = 0
+        self.peakClients = 0
+        self.encoded = 0
+        self.encodeSeconds = 0.0
+        self.dropped = 0
+        self.httpd = ThreadingHTTPServer((host, port), FrameRequestHandler)
+        self.httpd.frames = self
+        self.threads = [threading.Thread(target=self.httpd.serve_forever, name="Frame server"),
+            threading.Thread(target=self.encode, name="Frame server encoder")]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+        print("Serving cameras on http://%s:%d/" % (host or "0.0.0.0", port))
+
+    def due(self, index):
+        """True when camera ``index`` may publish again under the rate cap."""
+        return time.time() - self.published.get(index, 0) >= self.interval
+
+    def publish(self, index, frame):
+        if not self.due(index):
+            return
+        if frame.base is not None:
+            frame = frame.copy()
+        self.published[index] = time.time()
+        with self.condition:
+            self.pending[index] = frame
+            self.condition.notify_all()
+
+    def encode(self):
+        while self.running:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait(1.0)
+                pending, self.pending = self.pending, {}
+            for index, frame in pending.items():
+                start = time.time()
+                try:
+                    data = self.encoder.encode(frame)
+                except Exception as e:
+                    # Skip the frame but keep the thread: every client waits on it.
+                    print("Frame server: camera %d: %s: %s" % (index, type(e).__name__, e))
+                    continue
+                self.encodeSeconds += time.time() - start
+                self.encoded += 1
+                with self.condition:
+                    self.frames[index] = data
+                    self.sequences[index] = self.sequences.get(index, 0) + 1
+                    self.condition.notify_all()
+
+    def latest(self, index):
+        with self.condition:
+            return self.sequences.get(index, 0), self.frames.get(index)
+
+    def wait(self, index, sequence, timeout=1.0):
+        """The first frame of camera ``index`` newer than ``sequence``, or (sequence, None) on timeout."""
+        with self.condition:
+            deadline = time.time() + timeout
+            while self.running and self.sequences.get(index, 0) <= sequence:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return sequence, None
+                self.condition.wait(remaining)
+            return self.sequences.get(index, 0), self.frames.get(index)
+
+    def connect(self):
+        with self.condition:
+            self.clients += 1
+            self.peakClients = max(self.peakClients, self.clients)
+
+    def disconnect(self):
+        with self.condition:
+            self.clients -= 1
+
+    def recordDropped(self, count):
+        with self.condition:
+            self.dropped += count
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def report(self):
+        return ["Frame server: %d clients now, %d at most, %d frames encoded at %.1f ms each, "
+            "%d frames skipped for slow clients" % (self.clients, self.peakClients, self.encoded,
+            1000 * self.encodeSeconds / self.encoded if self.encoded else 0.0, self.dropped)]
@@ -0,0 +1,243 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Append-only frame store for long timelapses. Raw frames of one camera are
+    appended to large chunk files, and an index records where each frame is.
+    Readers get zero-copy numpy.memmap views of any frame or time range.
+
+    Layout of a store directory:
+        chunk_00000.raw, chunk_00001.raw, ...   raw frame bytes
+        index.csv                               one line per frame
+
+    Export a store to individual images with:
+
+        python frameStore.py <store> <outputDir> [<encoder>]
+
+    author: Jacob Kosberg
+"""
+
+import bisect
+import os
+import sys
+import time
+
+import numpy
+
+CHUNK_BYTES = 1024 ** 3
+INDEX_FILENAME = "index.csv"
+INDEX_HEADER = "chunk,offset,timestamp,height,width,channels,dtype\n"
+
+
+def chunk_filename(path, chunk):
+    return os.path.join(path, "chunk_%05d.raw" % chunk)
+
+
+class IndexEntry(object):
+    """Location, time and shape of one stored frame."""
+    __slots__ = ("chunk", "offset", "timestamp", "shape", "dtype")
+
+    def __init__(self, chunk, offset, timestamp, shape, dtype):
+        self.chunk = chunk
+        self.offset = offset
+        self.timestamp = timestamp
+        self.shape = shape
+        self.dtype = numpy.dtype(dtype)
+
+    @property
+    def nbytes(self):
+        return int(numpy.prod(self.shape)) * self.dtype.itemsize
+
+    def to_line(self):
+        height, width = self.shape[:2]
+        channels = self.shape[2] if len(self.shape) > 2 else 0
+        return "%d,%d,%.6f,%d,%d,%d,%s\n" % (self.chunk, self.offset, self.timestamp,
+            height, width, channels, self.dtype.str)
+
+    @classmethod
+    def from_line(cls, line):
+        chunk, offset, timestamp, height, width, channels, dtype = line.strip().split(",")
+        shape = (int(height), int(width))
+        if int(channels):
+            shape += (int(channels),)
+        return cls(int(chunk), int(offset), float(timestamp), shape, dtype)
+
+
+def read_index(path, skip=0):
+    """Read index entries of a store, skipping the first ``skip`` of them."""
+    entries = []
+    indexPath = os.path.join(path, INDEX_FILENAME)
+    if not os.path.exists(indexPath):
+        return entries
+    with open(indexPath) as f:
+        f.readline()
+        for i, line in enumerate(f):
+            # A crash can leave a partial last line; ignore it.
+            if i >= skip and line.endswith("\n"):
+                entries.append(IndexEntry.from_line(line))
+    return entries
+
+
+def truncate_partial_line(filename):
+    """Cut off a last line left unfinished by a crash, so appends start on a fresh line."""
+    if not os.path.exists(filename):
+        return
+    with open(filename, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if not size:
+            return
+        f.seek(max(0, size - 4096))
+        tail = f.read()
+        if tail.endswith(b"\n"):
+            return
+        # Index lines are short, so the last newline is within the tail
+        # unless the file is only a partial header.
+        end = tail.rfind(b"\n")
+        f.truncate(size - len(tail) + end + 1 if end >= 0 else 0)
+
+
+class FrameStoreWriter(object):
+    """Appends frames of one camera to a store directory."""
+    def __init__(self, path, chunkBytes=CHUNK_BYTES):
+        self.path = path
+        self.chunkBytes = chunkBytes
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        indexPath = os.path.join(path, INDEX_FILENAME)
+        truncate_partial_line(indexPath)
+        entries = read_index(path)
+        if entries:
+            last = entries[-1]
+            self.chunk = last.chunk
+            self.offset = last.offset + last.nbytes
+        else:
+            self.chunk = 0
+            self.offset = 0
+        self.count = len(entries)
+
+        newIndex = not os.path.exists(indexPath) or not os.path.getsize(indexPath)
+        self.index = open(indexPath, "a")
+        if newIndex:
+            self.index.write(INDEX_HEADER)
+        self.data = None
+        self.openChunk()
+
+    def openChunk(self):
+        if self.data:
+            self.data.close()
+        self.data = open(chunk_filename(self.path, self.chunk), "ab")
+        # Drop bytes of a frame whose index line never made it to disk.
+        self.data.truncate(self.offset)
+        self.data.seek(self.offset)
+
+    def append(self, frame, timestamp=None):
+        """Append a frame and return its index in the store."""
+        frame = numpy.ascontiguousarray(frame)
+        if self.offset and self.offset + frame.nbytes > self.chunkBytes:
+            self.chunk += 1
+            self.offset = 0
+            self.openChunk()
+
+        entry = IndexEntry(self.chunk, self.offset,
+            time.time() if timestamp is None else timestamp, frame.shape, frame.dtype)
+        self.data.write(frame.data)
+        self.data.flush()
+        self.index.write(entry.to_line())
+        self.index.flush()
+
+        self.offset += frame.nbytes
+        self.count += 1
+        return self.count - 1
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+
+class FrameStore(object):
+    """Read-only, zero-copy access to the frames of a store directory."""
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        self.timestamps = []
+        self.chunks = {}
+        self.refresh()
+
+    def refresh(self):
+        """Pick up frames appended since the store was opened."""
+        new = read_index(self.path, skip=len(self.entries))
+        self.entries.extend(new)
+        self.timestamps.extend(entry.timestamp for entry in new)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, i):
+        return self.frame(i)
+
+    def __iter__(self):
+        for i in range(len(self.entries)):
+            yield self.frame(i)
+
+    def chunk(self, chunk, end):
+        """Memmap of a whole chunk file, remapped if it has grown past ``end``."""
+        mapped = self.chunks.get(chunk)
+        if mapped is None or len(mapped) < end:
+            mapped = numpy.memmap(chunk_filename(self.path, chunk), dtype=numpy.uint8, mode="r")
+            self.chunks[chunk] = mapped
+        return mapped
+
+    def frame(self, i):
+        """View of frame ``i``. No pixels are copied or read until used."""
+        entry = self.entries[i]
+        end = entry.offset + entry.nbytes
+        data = self.chunk(entry.chunk, end)[entry.offset:end]
+        return data.view(entry.dtype).reshape(entry.shape)
+
+    def time_range(self, start, end):
+        """Indices of frames with ``start <= timestamp < end`` (seconds since epoch)."""
+        first = bisect.bisect_left(self.timestamps, start)
+        last = bisect.bisect_left(self.timestamps, end)
+        return range(first, last)
+
+    def frames_between(self, start, end):
+        return [self.frame(i) for i in self.time_range(start, end)]
+
+    def export(self, outputDir, encoder=None, indices=None):
+        """Write frames out as individual images named like Worker captures."""
+        import burstCapture
+        import encoders
+        if encoder is None:
+            encoder = encoders.get_encoder(encoders.DEFAULT_PRESET)
+        if not os.path.exists(outputDir):
+            os.makedirs(outputDir)
+        if indices is None:
+            indices = range(len(self.entries))
+        namer = burstCapture.FileNamer()
+        filenames = []
+        for i in indices:
+            stamp = namer.name(outputDir, self.entries[i].timestamp)
+            filename = os.path.join(outputDir, "%s_%06d%s" % (stamp, i, encoder.extension))
+            filenames.append(encoder.write(filename, self.frame(i)))
+        return filenames
+
+
+def is_frame_store(path):
+    return os.path.isfile(os.path.join(path, INDEX_FILENAME))
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: python frameStore.py <store> <outputDir> [<encoder>]")
+        sys.exit(1)
+    import encoders
+    store = FrameStore(sys.argv[1])
+    encoder = encoders.get_encoder(sys.argv[3] if len(sys.argv) > 3 else encoders.DEFAULT_PRESET)
+    start = time.time()
+    filenames = store.export(sys.argv[2], encoder)
+    print("Exported %d frames in %.1f s" % (len(filenames), time.time() - start))
+
+if __name__ == "__main__":
+    main()
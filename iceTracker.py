@@ -1,87 +1,244 @@
 #!/usr/bin/python
 
 """
+Tracks a region selected on the first frame through a video, a frame
+store, a folder of timelapse captures or one camera's captures in a
+capture path's manifest:
+
+    python iceTracker.py <source> [<device> [<start> [<end>]]]
+
+Progress is checkpointed (ROI, time range, last bbox and last tracked
+frame) next to the source, and displacements are appended to a CSV.
+Running again resumes from the last tracked frame, so a growing timelapse
+is only tracked over its new frames. Image frames are found again by path,
+so captures added before them since don't shift the series. --restart
+starts over.
+
 author: Jacob Kosberg
 """
 
+import argparse
 import cv2
+import json
+import os
 import sys
 import numpy as np
+import captureManifest
+import encoders
+import frameStore
+import timelapseVideo
+
+CHECKPOINT_FRAMES = 50
 
 def getCenter(bbox):
     return (int(bbox[0] + bbox[2]/2), int(bbox[1] + bbox[3]/2))
 
-def main():
-    # Instead of MIL, you can also use
-    # BOOSTING, KCF, TLD, MEDIANFLOW or GOTURN
-     
-    tracker = cv2.TrackerKCF_create()
+def imagePaths(source, device=None, start=None, end=None):
+    """
+    Paths of the images to track, oldest first, for a capture path (the
+    captures of one camera between two times, looked up in its manifest) or
+    a folder of images. None for videos and frame stores.
+    """
+    if captureManifest.has_manifest(source):
+        return captureManifest.Manifest(source).paths(device, start=start, end=end)
+    if frameStore.is_frame_store(source):
+        return None
+    if os.path.isdir(source):
+        return timelapseVideo.list_images(source)
+    return None
+
+def findFrame(source, tracked, device=None, start=None, end=None):
+    """Position of the frame with key ``tracked`` (see readFrames), or None if it is gone."""
+    paths = imagePaths(source, device, start, end)
+    if paths is None:
+        return tracked
+    keys = [os.path.relpath(path, source) for path in paths]
+    return keys.index(tracked) if tracked in keys else None
 
-    # Read video
-    video = cv2.VideoCapture(sys.argv[1])
- 
+def readFrames(source, device=None, start=None, end=None, first=0):
+    """
+    Yield (key, frame) from a video file, a CameraWorkbench frame store, a
+    folder of images or a capture path, starting at frame ``first``. The key
+    is the image path relative to the source, or the frame number for
+    videos and frame stores. Images that can't be read come out as None so
+    frame numbers stay put.
+    """
+    paths = imagePaths(source, device, start, end)
+    if paths is not None:
+        for path in paths[first:]:
+            yield os.path.relpath(path, source), encoders.read_image(path)
+        return
+    if frameStore.is_frame_store(source):
+        store = frameStore.FrameStore(source)
+        for i in range(first, len(store)):
+            yield i, store[i]
+        return
+
+    video = cv2.VideoCapture(source)
     # Exit if video not opened.
     if not video.isOpened():
         print "Could not open video"
         sys.exit()
- 
-    # Read first frame.
-    ok, frame = video.read()
-    if not ok:
-        print 'Cannot read video file'
-        sys.exit()
-
-    
-    frames = []
+    if first:
+        video.set(cv2.CAP_PROP_POS_FRAMES, first)
+    index = first
     while True:
         ok, img = video.read()
         if not ok:
             break
-        img = cv2.Canny(img, 200, 300)
-        frames.append(cv2.cvtColor(img, cv2.COLOR_GRAY2RGB))
-    #frames = list(reversed(frames))
-    frame = frames[0]
-
-    # Define an initial bounding box
-    #bbox = (1160,396,98,16)
- 
-    # Uncomment the line below to select a different bounding box
-    bbox = cv2.selectROI(frame, False)
-    print bbox
-
-    # Initialize tracker with first frame and bounding box
-    ok = tracker.init(frame, bbox)
- 
-    center_i = np.array(getCenter(bbox), dtype=int)
-    displacements = []
-    for frame in frames:
+        yield index, img
+        index += 1
 
-        center_f = np.array(getCenter(bbox), dtype=int)
-        displacements.append(center_f - center_i)
+def preprocess(img):
+    img = cv2.Canny(img, 200, 300)
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+
+def checkpointPath(source, device=None):
+    base = source.rstrip("/\\")
+    if device is not None:
+        base += "_" + device
+    return base + ".track.json"
+
+def loadCheckpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def saveCheckpoint(path, state, rows):
+    """
+    Append the result rows tracked since the last checkpoint, then replace
+    the checkpoint, which remembers how long the results file was.
+    """
+    results = os.path.splitext(path)[0] + ".csv"
+    with open(results, "a") as f:
+        if f.tell() == 0:
+            f.write("frame,dx,dy,x,y,width,height\n")
+        for row in rows:
+            f.write(",".join(str(value) for value in row) + "\n")
+    state["resultsBytes"] = os.path.getsize(results)
+    temporary = path + ".part"
+    with open(temporary, "w") as f:
+        json.dump(state, f)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temporary, path)
+
+def truncateResults(path, state):
+    """Drop result rows written after the checkpoint by a run that died before its next one."""
+    results = os.path.splitext(path)[0] + ".csv"
+    if os.path.exists(results) and os.path.getsize(results) > state["resultsBytes"]:
+        with open(results, "r+") as f:
+            f.truncate(state["resultsBytes"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Track a region through a video, frame store or captures.")
+    parser.add_argument("source", help="Video, frame store, image folder or capture path with a manifest.")
+    parser.add_argument("device", nargs="?", help="Camera to track, for a capture path.")
+    parser.add_argument("start", nargs="?", type=captureManifest.parse_time)
+    parser.add_argument("end", nargs="?", type=captureManifest.parse_time)
+    parser.add_argument("--checkpoint", help="Checkpoint file (default <source>[_<device>].track.json).")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and select a new ROI.")
+    parser.add_argument("--no-display", dest="display", action="store_false", help="Don't show tracking.")
+    args = parser.parse_args()
+    path = args.checkpoint or checkpointPath(args.source, args.device)
+
+    # Instead of MIL, you can also use
+    # BOOSTING, KCF, TLD, MEDIANFLOW or GOTURN
+
+    tracker = cv2.TrackerKCF_create()
+
+    state = None if args.restart else loadCheckpoint(path)
+    if state:
+        if [state["start"], state["end"]] != [args.start, args.end]:
+            print "The checkpoint is for another time range; use --restart to track this one"
+            sys.exit()
+        # The tracker starts again from the last tracked frame and its bbox;
+        # unreadable frames after it are skipped again.
+        first = findFrame(args.source, state["tracked"], args.device, args.start, args.end)
+        if first is None:
+            print "Cannot find the last tracked frame %s" % state["tracked"]
+            sys.exit()
+        truncateResults(path, state)
+        state["frame"] = first + 1
+        frames = readFrames(args.source, args.device, args.start, args.end, first)
+        key, frame = next(frames, (None, None))
+        if frame is None:
+            print "Cannot read the last tracked frame"
+            sys.exit()
+        bbox = tuple(state["bbox"])
+        print "Resuming after frame %d" % state["frame"]
+    else:
+        if os.path.exists(path):
+            os.remove(path)
+        results = os.path.splitext(path)[0] + ".csv"
+        if os.path.exists(results):
+            os.remove(results)
+        frames = readFrames(args.source, args.device, args.start, args.end)
+        key, frame = next(frames, (None, None))
+        if frame is None:
+            print 'Cannot read video file'
+            sys.exit()
+
+        # Define an initial bounding box
+        #bbox = (1160,396,98,16)
+
+        # Uncomment the line below to select a different bounding box
+        bbox = cv2.selectROI(preprocess(frame), False)
+        print bbox
+        state = {"source": args.source, "device": args.device, "start": args.start, "end": args.end,
+            "roi": list(bbox), "bbox": list(bbox), "frame": 1, "tracked": key,
+            "initialCenter": list(getCenter(bbox))}
+        saveCheckpoint(path, state, [[0, 0, 0] + list(bbox)])
+
+    # Initialize tracker with the frame and bounding box
+    ok = tracker.init(preprocess(frame), bbox)
+
+    center_i = np.array(state["initialCenter"], dtype=int)
+    rows = []
+    for key, img in frames:
+        state["frame"] += 1
+        if img is None:
+            continue
+        frame = preprocess(img)
 
         # Update tracker
-        ok, bbox = tracker.update(frame)
- 
+        ok, newBbox = tracker.update(frame)
+
         # Draw bounding box
         if ok:
-            p1 = (int(bbox[0]), int(bbox[1]))
-            p2 = (int(bbox[0] + bbox[2]), int(bbox[1] + bbox[3]))
+            bbox = tuple(int(value) for value in newBbox)
+            p1 = (bbox[0], bbox[1])
+            p2 = (bbox[0] + bbox[2], bbox[1] + bbox[3])
             cv2.rectangle(frame, p1, p2, (0,0,255))
             cv2.circle(frame, getCenter(bbox), 4, (0,0,255), -1)
- 
+
+        center_f = np.array(getCenter(bbox), dtype=int)
+        displacement = [int(value) for value in center_f - center_i]
+        state["bbox"] = list(bbox)
+        state["tracked"] = key
+        rows.append([state["frame"] - 1] + displacement + list(bbox))
+        if len(rows) >= CHECKPOINT_FRAMES:
+            saveCheckpoint(path, state, rows)
+            rows = []
+
         # Display result
-        cv2.imshow("Tracking", frame)
- 
-        # Exit if ESC pressed
-        k = cv2.waitKey(1) & 0xff
-        if k == 27 : break
+        if args.display:
+            cv2.imshow("Tracking", frame)
+
+            # Exit if ESC pressed
+            k = cv2.waitKey(1) & 0xff
+            if k == 27 : break
+    saveCheckpoint(path, state, rows)
 
     #cv2.line(frame,center_i,center_f,(0,0,255),2)
     #cv2.imshow("Final", frame)
 
+    center_f = np.array(getCenter(bbox), dtype=int)
+    print "Tracked %d frames" % state["frame"]
     print "Initial center: " + str(center_i)
     print "Final center: " + str(center_f)
     print "Displacement: " + str(np.linalg.norm(center_f-center_i))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
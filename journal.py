@@ -0,0 +1,256 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Buffered, rotating JSON Lines journal of camera settings and captures.
+    Settings are recorded as diffs with a per-camera version number and every
+    capture records the settings version it was taken with, so the settings
+    behind any file can be looked up afterwards:
+
+        python journal.py <capture file>
+
+    Versions count from 1 in each session, so records also carry a session
+    id. Next to the journal, an SQLite index keeps every settings version as
+    a full snapshot and maps each capture file to its version. The index is
+    never rotated, so lookups work for any capture and don't read the
+    journal at all.
+
+    author: Jacob Kosberg
+"""
+
+import glob
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+JOURNAL_FILENAME = "journal.jsonl"
+MAX_BYTES = 16 * 1024 ** 2
+BACKUP_COUNT = 10
+FLUSH_RECORDS = 64
+FLUSH_SECONDS = 10.0
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    session TEXT NOT NULL,
+    device TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    time REAL NOT NULL,
+    settings TEXT NOT NULL,
+    PRIMARY KEY (session, device, version)
+);
+CREATE TABLE IF NOT EXISTS captures (
+    name TEXT NOT NULL,
+    file TEXT NOT NULL,
+    device TEXT NOT NULL,
+    session TEXT NOT NULL,
+    version INTEGER,
+    time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS captures_name ON captures (name);
+"""
+
+
+def plain(value):
+    """Qt strings and the like become str so they serialize and compare cleanly."""
+    if isinstance(value, (bool, int, float)) or value is None:
+        return value
+    return str(value)
+
+
+def index_path(path=JOURNAL_FILENAME):
+    """The settings index that goes with the journal at ``path``."""
+    return os.path.splitext(path)[0] + ".sqlite"
+
+
+def new_session():
+    now = time.time()
+    return time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime(now)) + "-%06d" % (now % 1 * 1e6)
+
+
+class Journal(object):
+    """
+    Appends records to ``path`` in batches. When the file passes
+    ``maxBytes`` it is rotated to ``path.1`` ... ``path.<backupCount>``, and
+    the new file starts with a full settings snapshot of every camera, so
+    each file can be read on its own. Each batch also goes into the settings
+    index, in the same flush.
+    """
+    def __init__(self, path=JOURNAL_FILENAME, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self.session = new_session()
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.bufferedSince = None
+        self.settingsRows = []
+        self.captureRows = []
+        self.db = None
+        self.settings = {}
+        self.versions = {}
+        # Settings as of the last record on disk, for snapshots on rotation.
+        self.written = {}
+
+    def record_settings(self, device, values):
+        """Record what changed in a camera's settings. Returns the settings version."""
+        values = dict((str(key), plain(value)) for key, value in values)
+        with self.lock:
+            # The first record of a camera in a session is a full snapshot.
+            full = device not in self.versions
+            current = self.settings.get(device, {})
+            changes = dict((key, value) for key, value in values.items() if current.get(key) != value)
+            if changes or full:
+                self.versions[device] = self.versions.get(device, 0) + 1
+                current.update(changes)
+                self.settings[device] = current
+                record = {"type": "settings", "device": device, "session": self.session,
+                    "version": self.versions[device], "changes": changes}
+                if full:
+                    record["full"] = True
+                self.append(record)
+                self.settingsRows.append((self.session, device, self.versions[device],
+                    record["time"], json.dumps(current, sort_keys=True)))
+            return self.versions[device]
+
+    def record_capture(self, device, filename, **extra):
+        record = {"type": "capture", "device": device, "file": filename,
+            "session": self.session, "settingsVersion": self.versions.get(device)}
+        record.update(extra)
+        with self.lock:
+            self.append(record)
+            if filename:
+                self.captureRows.append((os.path.basename(filename), filename, device,
+                    self.session, record["settingsVersion"], record["time"]))
+
+    def append(self, record):
+        record["time"] = time.time()
+        self.buffer.append(json.dumps(record, sort_keys=True))
+        if self.bufferedSince is None:
+            self.bufferedSince = record["time"]
+        if len(self.buffer) >= FLUSH_RECORDS:
+            self.write()
+
+    def flush_if_due(self):
+        """Write out buffered records that have waited long enough. Cheap to call often."""
+        if self.bufferedSince is not None and time.time() - self.bufferedSince > FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.write()
+
+    def write(self):
+        if not self.buffer:
+            return
+        if os.path.exists(self.path) and os.path.getsize(self.path) > self.maxBytes:
+            self.rotate()
+        with open(self.path, "a") as f:
+            f.write("\n".join(self.buffer) + "\n")
+        self.write_index()
+        self.buffer = []
+        self.bufferedSince = None
+        self.written = dict((device, (self.versions[device], dict(values)))
+            for device, values in self.settings.items())
+
+    def write_index(self):
+        if self.db is None:
+            # Flushes come from the Worker and the GUI thread, under the lock.
+            self.db = sqlite3.connect(index_path(self.path), check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(INDEX_SCHEMA)
+        self.db.executemany("INSERT OR REPLACE INTO settings VALUES (?, ?, ?, ?, ?)", self.settingsRows)
+        self.db.executemany("INSERT INTO captures VALUES (?, ?, ?, ?, ?, ?)", self.captureRows)
+        self.db.commit()
+        self.settingsRows = []
+        self.captureRows = []
+
+    def rotate(self):
+        for i in range(self.backupCount - 1, 0, -1):
+            older = "%s.%d" % (self.path, i)
+            if os.path.exists(older):
+                newer = "%s.%d" % (self.path, i + 1)
+                if os.path.exists(newer):
+                    os.remove(newer)
+                os.rename(older, newer)
+        if os.path.exists(self.path + ".1"):
+            os.remove(self.path + ".1")
+        os.rename(self.path, self.path + ".1")
+        now = time.time()
+        snapshots = [json.dumps({"type": "settings", "device": device, "version": version,
+            "changes": values, "full": True, "time": now}, sort_keys=True)
+            for device, (version, values) in self.written.items()]
+        self.buffer = snapshots + self.buffer
+
+
+def journal_files(path=JOURNAL_FILENAME):
+    """Journal files, newest first. Other files next to the journal are ignored."""
+    backups = [name for name in glob.glob(path + ".*") if name.rsplit(".", 1)[1].isdigit()]
+    backups.sort(key=lambda name: int(name.rsplit(".", 1)[1]))
+    return ([path] if os.path.exists(path) else []) + backups
+
+
+def settings_for_file(filename, path=JOURNAL_FILENAME):
+    """
+    The settings a capture was taken with, as a dict, or None if the file
+    is not in the journal. Looked up in the settings index; captures from
+    before the index existed are searched for in the journal files.
+    """
+    name = os.path.basename(filename)
+    if os.path.exists(index_path(path)):
+        db = sqlite3.connect(index_path(path))
+        try:
+            row = db.execute("SELECT settings.settings FROM captures LEFT JOIN settings "
+                "ON settings.session = captures.session AND settings.device = captures.device "
+                "AND settings.version = captures.version "
+                "WHERE captures.name = ? ORDER BY captures.time DESC LIMIT 1", (name,)).fetchone()
+        finally:
+            db.close()
+        if row:
+            return json.loads(row[0]) if row[0] else {}
+    return scan_journal(name, path)
+
+
+def scan_journal(name, path=JOURNAL_FILENAME):
+    """
+    Settings of the capture named ``name``, replayed from the journal files
+    that are still around. Each file is read line by line and the search
+    stops at the capture. Only lines mentioning the name or settings are
+    parsed.
+    """
+    for journalFile in journal_files(path):
+        # Settings per device as of the current line, starting from the
+        # latest full snapshot (session start or rotation).
+        settings = {}
+        with open(journalFile) as f:
+            for line in f:
+                if '"settings"' in line:
+                    record = json.loads(line)
+                    if record["type"] == "settings":
+                        if record.get("full"):
+                            settings[record["device"]] = {}
+                        settings.setdefault(record["device"], {}).update(record["changes"])
+                        continue
+                if name in line:
+                    record = json.loads(line)
+                    if record["type"] == "capture" and os.path.basename(record["file"] or "") == name:
+                        return settings.get(record["device"], {})
+    return None
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python journal.py <capture file> [<journal>]")
+        sys.exit(1)
+    settings = settings_for_file(sys.argv[1], *sys.argv[2:3])
+    if settings is None:
+        print("%s is not in the journal." % sys.argv[1])
+        sys.exit(1)
+    for key in sorted(settings):
+        print("[%s] %s" % (key, settings[key]))
+
+if __name__ == "__main__":
+    main()
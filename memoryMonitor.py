@@ -0,0 +1,201 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Memory accounting for long runs. Every interval it samples the process
+    RSS, the Python heap as seen by tracemalloc (Python 3.4+, skipped where
+    it isn't available) and what each camera holds: frame buffers, live SDK
+    handles and ctypes callbacks. When RSS grows past a threshold over the
+    first sample, it prints an alert with the allocation sites that grew most.
+    RSS comes from psutil where installed, else from the OS: /proc on Linux,
+    GetProcessMemoryInfo on Windows, and the peak RSS from getrusage on OSX.
+
+    Soak test against simulated Amscopes, many capture rounds in a row:
+
+        python memoryMonitor.py [<rounds>] [<cameras>]
+
+    author: Jacob Kosberg
+"""
+
+import os
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+SAMPLE_SECONDS = 60.0
+GROWTH_ALERT_MB = 50.0
+TOP_ALLOCATIONS = 10
+MB = 1024.0 ** 2
+
+
+def rss_bytes():
+    """
+    Resident set size of this process, or None if it can't be read here.
+    On OSX without psutil this is the peak RSS, which still shows growth.
+    """
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().rss
+    except ImportError:
+        pass
+    if sys.platform == "win32":
+        return windows_rss_bytes()
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on OSX, kilobytes elsewhere.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def windows_rss_bytes():
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+        return None
+    return counters.WorkingSetSize
+
+
+def camera_usage(cam):
+    """Bytes of frame buffers, SDK handles and callbacks a camera holds."""
+    usage = getattr(cam, "memory_usage", None)
+    return usage() if usage else {}
+
+
+class MemoryMonitor(object):
+    def __init__(self, interval=SAMPLE_SECONDS, growthAlertMB=GROWTH_ALERT_MB, topAllocations=TOP_ALLOCATIONS):
+        self.interval = interval
+        self.growthAlert = growthAlertMB * MB
+        self.topAllocations = topAllocations
+        self.samples = []
+        self.lastSample = 0.0
+        self.alertedAt = None
+        self.baseline = None
+        self.warned = False
+        if tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def poll(self, cameras):
+        """Take a sample if one is due. Cheap to call often."""
+        if time.time() - self.lastSample >= self.interval:
+            self.sample(cameras)
+
+    def sample(self, cameras):
+        """
+        Record RSS, traced heap and per-camera usage; ``cameras`` are
+        (name, camera) pairs. Returns the sample.
+        """
+        self.lastSample = time.time()
+        sample = {"time": self.lastSample, "rss": rss_bytes(),
+            "traced": tracemalloc.get_traced_memory()[0] if tracemalloc else None,
+            "cameras": dict((str(name), camera_usage(cam)) for name, cam in cameras)}
+        self.samples.append(sample)
+        if sample["rss"] is None and sample["traced"] is None and not self.warned:
+            print("Memory monitor: neither RSS nor tracemalloc is available here; "
+                "only per-camera usage is sampled and growth alerts are off.")
+            self.warned = True
+        if tracemalloc and self.baseline is None:
+            self.baseline = tracemalloc.take_snapshot()
+        self.checkGrowth(sample)
+        return sample
+
+    def growth(self, key="rss"):
+        """Growth of ``key`` from the first to the last sample, in bytes."""
+        values = [sample[key] for sample in self.samples if sample[key] is not None]
+        return values[-1] - values[0] if len(values) > 1 else 0
+
+    def checkGrowth(self, sample):
+        grown = self.growth()
+        # Alert once per threshold crossed, not on every sample after.
+        if grown < self.growthAlert or (self.alertedAt is not None and grown < self.alertedAt + self.growthAlert):
+            return
+        self.alertedAt = grown
+        print("Memory grew %.1f MB since monitoring started." % (grown / MB))
+        for name, usage in sorted(sample["cameras"].items()):
+            print("  Camera %s: %s" % (name, describe_usage(usage)))
+        for line in self.topGrowth():
+            print("  " + line)
+
+    def topGrowth(self):
+        """Allocation sites that grew most since the first sample."""
+        if not tracemalloc or self.baseline is None:
+            return []
+        stats = tracemalloc.take_snapshot().compare_to(self.baseline, "lineno")
+        return [str(stat) for stat in stats[:self.topAllocations] if stat.size_diff > 0]
+
+    def report(self):
+        if not self.samples:
+            return []
+        hours = (self.samples[-1]["time"] - self.samples[0]["time"]) / 3600.0
+        last = self.samples[-1]
+        lines = ["Memory: %d samples over %.1f h, RSS %s, traced heap %s" % (len(self.samples), hours,
+            "%+.1f MB" % (self.growth() / MB) if last["rss"] is not None else "not available",
+            "%+.1f MB" % (self.growth("traced") / MB) if last["traced"] is not None else "not available")]
+        for name, usage in sorted(self.samples[-1]["cameras"].items()):
+            lines.append("Memory of camera %s: %s" % (name, describe_usage(usage)))
+        return lines
+
+
+def describe_usage(usage):
+    return ", ".join("%s %s" % (key, "%.1f MB" % (value / MB) if key.endswith("bytes") else value)
+        for key, value in sorted(usage.items())) or "nothing tracked"
+
+
+def soak(rounds, cameras):
+    """Activate, capture and deactivate every simulated camera ``rounds`` times."""
+    os.environ.setdefault("TOUPCAM_SIMULATOR", str(cameras))
+    os.environ.setdefault("TOUPCAM_SIMULATOR_FPS", "100")
+    import camera
+
+    cams = [camera.AmscopeCamera(i) for i in range(cameras)]
+    monitor = MemoryMonitor(interval=0)
+    every = max(1, rounds // 20)
+    print("%8s %10s %12s" % ("round", "RSS MB", "traced MB"))
+    stdout = sys.stdout
+    for i in range(rounds):
+        # Cameras print their stream stats on every deactivation.
+        sys.stdout = open(os.devnull, "w")
+        try:
+            for cam in cams:
+                cam.activate()
+                cam.get_capture_frame(new=True)
+                cam.deactivate()
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        if i % every == 0 or i == rounds - 1:
+            sample = monitor.sample([(cam.device, cam) for cam in cams])
+            print("%8d %10s %12s" % (i, "%.1f" % (sample["rss"] / MB) if sample["rss"] else "-",
+                "%.1f" % (sample["traced"] / MB) if sample["traced"] is not None else "-"))
+    for line in monitor.report():
+        print(line)
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    cameras = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    soak(rounds, cameras)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Tiled live preview of every camera in one window. Frames are resized
+    straight into their tile of a preallocated canvas, and each tile is
+    labelled with its camera and how old its frame is; the border turns
+    yellow, then red, as the frame goes stale.
+    author: Jacob Kosberg
+"""
+
+import math
+import time
+
+import cv2
+import numpy
+
+TILE_WIDTH = 320
+TILE_HEIGHT = 240
+LABEL_HEIGHT = 18
+MAX_FPS = 5.0
+# Frame age (seconds) at which a tile's border turns yellow, then red.
+STALE_SECONDS = 2.0
+DEAD_SECONDS = 30.0
+
+FRESH_COLOR = (0, 200, 0)
+STALE_COLOR = (0, 200, 255)
+DEAD_COLOR = (0, 0, 255)
+
+
+class Mosaic(object):
+    """A grid of ``count`` tiles on one canvas, rendered at most ``maxFps`` times a second."""
+    def __init__(self, count, tileWidth=TILE_WIDTH, tileHeight=TILE_HEIGHT, maxFps=MAX_FPS):
+        self.columns = int(math.ceil(math.sqrt(count)))
+        rows = int(math.ceil(float(count) / self.columns))
+        self.tileWidth = tileWidth
+        self.tileHeight = tileHeight
+        self.interval = 1.0 / maxFps
+        self.canvas = numpy.zeros((rows * tileHeight, self.columns * tileWidth, 3), numpy.uint8)
+        self.updated = [None] * count
+        self.sizes = [None] * count
+        self.lastRender = 0.0
+
+    def due(self):
+        """True when enough time has passed since the last render."""
+        return time.time() - self.lastRender >= self.interval
+
+    def tile(self, i):
+        """The canvas slice of tile ``i``, above its label strip."""
+        x = (i % self.columns) * self.tileWidth
+        y = (i // self.columns) * self.tileHeight
+        return self.canvas[y:y + self.tileHeight - LABEL_HEIGHT, x:x + self.tileWidth]
+
+    def update(self, i, frame):
+        """Resize ``frame`` into tile ``i``, keeping its aspect ratio."""
+        tile = self.tile(i)
+        height, width = frame.shape[:2]
+        scale = min(float(tile.shape[1]) / width, float(tile.shape[0]) / height)
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        if size != self.sizes[i]:
+            tile[...] = 0
+            self.sizes[i] = size
+        x = (tile.shape[1] - size[0]) // 2
+        y = (tile.shape[0] - size[1]) // 2
+        target = tile[y:y + size[1], x:x + size[0]]
+        if frame.ndim == 2:
+            cv2.cvtColor(cv2.resize(frame, size, interpolation=cv2.INTER_AREA),
+                cv2.COLOR_GRAY2BGR, dst=target)
+        else:
+            cv2.resize(frame, size, dst=target, interpolation=cv2.INTER_AREA)
+        self.updated[i] = time.time()
+
+    def render(self, names):
+        """Redraw labels and borders, and return the canvas."""
+        now = time.time()
+        for i, name in enumerate(names):
+            age = now - self.updated[i] if self.updated[i] else None
+            if age is None or age > DEAD_SECONDS:
+                color = DEAD_COLOR
+            elif age > STALE_SECONDS:
+                color = STALE_COLOR
+            else:
+                color = FRESH_COLOR
+            x = (i % self.columns) * self.tileWidth
+            y = (i // self.columns) * self.tileHeight
+            label = self.canvas[y + self.tileHeight - LABEL_HEIGHT:y + self.tileHeight, x:x + self.tileWidth]
+            label[...] = 0
+            text = "%s  %s" % (name, "no frame" if age is None else "%.0f s ago" % age)
+            cv2.putText(label, text, (4, LABEL_HEIGHT - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
+            cv2.rectangle(self.canvas, (x, y), (x + self.tileWidth - 1, y + self.tileHeight - 1), color, 1)
+        self.lastRender = now
+        return self.canvas
@@ -3,12 +3,22 @@
 
 """
     This module is only available on Windows.
+    Reconstruct from the captures of every camera taken between two times,
+    looked up in the capture path's manifest. Captures not migrated to the
+    capture path yet are read from the staging folder, if given:
+
+        python reconstructor.py <capturePath> <start> <end> [<outputDir> [<stagingPath>]]
+
     author: Jacob Kosberg
 """
 
 import os
 import subprocess
+import sys
+import time
 import cv2
+import captureManifest
+import encoders
 
 def runCMPMVS(workingDir):
     cmpmvsDir = "C:\\cmpmvs"
@@ -20,8 +30,56 @@ def runCMPMVS(workingDir):
     sfm.communicate()
 
 def convertPngsToJpgs(inputPngs, outputDir):
+    """Convert images to JPEGs in ``outputDir``, skipping unreadable ones. Returns those converted."""
+    converted = []
     for imgpath in inputPngs:
-        img = cv2.imread(imgpath)
+        img = encoders.read_image(imgpath)
+        if img is None:
+            print("Skipping %s: missing or unreadable" % imgpath)
+            continue
         newfilename = os.path.splitext(os.path.basename(imgpath))[0] + ".jpg"
         outputPath = os.path.join(outputDir, newfilename)
-        cv2.imwrite(outputPath, img)
\ No newline at end of file
+        cv2.imwrite(outputPath, img)
+        converted.append(imgpath)
+    return converted
+
+def capturePaths(capturePath, start, end, stagingPath=None):
+    """
+    Files of the captures between ``start`` and ``end``: the archived copy,
+    or the staged one while it hasn't been migrated yet.
+    """
+    paths = []
+    for capture in captureManifest.Manifest(capturePath).query(start=start, end=end):
+        path = os.path.join(capturePath, capture.path)
+        if stagingPath and not os.path.exists(path):
+            path = os.path.join(stagingPath, capture.path)
+        paths.append(path)
+    return paths
+
+def reconstructRange(capturePath, start, end, outputDir=None, stagingPath=None):
+    """
+    Convert the captures of every camera between ``start`` and ``end`` and
+    run CMPMVS on them. Returns the captures used.
+    """
+    images = capturePaths(capturePath, start, end, stagingPath)
+    if outputDir is None:
+        outputDir = os.path.join(capturePath, "reconstruction",
+            time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime(start)))
+    if not os.path.exists(outputDir):
+        os.makedirs(outputDir)
+    images = convertPngsToJpgs(images, outputDir)
+    runCMPMVS(outputDir)
+    return images
+
+def main():
+    if len(sys.argv) < 4:
+        print("Usage: python reconstructor.py <capturePath> <start> <end> [<outputDir> [<stagingPath>]]")
+        sys.exit(1)
+    outputDir = sys.argv[4] if len(sys.argv) > 4 else None
+    stagingPath = sys.argv[5] if len(sys.argv) > 5 else None
+    images = reconstructRange(sys.argv[1], captureManifest.parse_time(sys.argv[2]),
+        captureManifest.parse_time(sys.argv[3]), outputDir, stagingPath)
+    print("Reconstructed from %d captures" % len(images))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Per-camera failure isolation. A camera that fails is marked degraded and
+    retried with exponential backoff while the other cameras keep capturing.
+    author: Jacob Kosberg
+"""
+
+from camera import CameraError
+
+import time
+
+# Exceptions that mean a single camera is gone or misbehaving, as opposed to
+# a bug in the workbench itself. A camera that gives no frame raises
+# CameraTimeoutError, so bugs such as AttributeError are not mistaken for it.
+CAMERA_FAILURES = (IOError, CameraError)
+
+INITIAL_RETRY_SECONDS = 2.0
+MAX_RETRY_SECONDS = 300.0
+
+
+class DegradedCamera(object):
+    """Bookkeeping for one camera that is out of the capture rotation."""
+    def __init__(self, reason):
+        self.reason = reason
+        self.since = time.time()
+        self.attempts = 0
+        self.nextRetry = self.since + INITIAL_RETRY_SECONDS
+
+
+class CameraRecovery(object):
+    """
+    Keeps track of degraded cameras and tries to reattach them in the
+    background of the Worker's idle loop. Cameras are matched by serial, so
+    a camera that comes back at a different device index still rejoins as
+    the same device.
+    """
+    def __init__(self, initialDelay=INITIAL_RETRY_SECONDS, maxDelay=MAX_RETRY_SECONDS):
+        self.initialDelay = initialDelay
+        self.maxDelay = maxDelay
+        self.degraded = {}
+        self.lostCaptures = {}
+        self.recoveryTimes = {}
+
+    def isDegraded(self, cameraSettings):
+        return cameraSettings in self.degraded
+
+    def markDegraded(self, cameraSettings, reason=None):
+        if self.isDegraded(cameraSettings):
+            return
+        print("Camera %s degraded: %s" % (cameraSettings.deviceNameStr, reason))
+        state = DegradedCamera(reason)
+        state.nextRetry = state.since + self.initialDelay
+        self.degraded[cameraSettings] = state
+        try:
+            cameraSettings.camera.deactivate()
+        except CAMERA_FAILURES:
+            pass
+        cameraSettings.change_detected.emit()
+
+    def recordLostCapture(self, cameraSettings):
+        name = cameraSettings.deviceNameStr
+        self.lostCaptures[name] = self.lostCaptures.get(name, 0) + 1
+
+    def poll(self):
+        """Retry every degraded camera whose backoff has elapsed."""
+        now = time.time()
+        for cameraSettings, state in list(self.degraded.items()):
+            if now >= state.nextRetry:
+                self.retry(cameraSettings, state)
+
+    def retry(self, cameraSettings, state):
+        state.attempts += 1
+        try:
+            found = cameraSettings.camera.reconnect(getattr(cameraSettings, "serial", None))
+        except CAMERA_FAILURES as e:
+            print(e)
+            found = False
+
+        if not found:
+            delay = min(self.initialDelay * 2 ** state.attempts, self.maxDelay)
+            state.nextRetry = time.time() + delay
+            return
+
+        elapsed = time.time() - state.since
+        name = cameraSettings.deviceNameStr
+        self.recoveryTimes.setdefault(name, []).append(elapsed)
+        del self.degraded[cameraSettings]
+        print("Camera %s recovered after %.1f s (%d attempts, %d captures lost)" %
+            (name, elapsed, state.attempts, self.lostCaptures.get(name, 0)))
+        cameraSettings.change_detected.emit()
+
+    def report(self):
+        """Summary lines of recovery times and lost captures per camera."""
+        lines = []
+        names = set(self.lostCaptures) | set(self.recoveryTimes)
+        for name in sorted(names, key=str):
+            times = self.recoveryTimes.get(name, [])
+            mean = sum(times) / len(times) if times else 0.0
+            lines.append("%s: %d captures lost, %d recoveries, mean recovery %.1f s" %
+                (name, self.lostCaptures.get(name, 0), len(times), mean))
+        for cameraSettings, state in self.degraded.items():
+            lines.append("%s: still degraded for %.1f s (%s)" %
+                (cameraSettings.deviceNameStr, time.time() - state.since, state.reason))
+        return lines
@@ -0,0 +1,227 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Two storage tiers for captures: files are written to a staging folder on
+    fast local disk, and a few background threads move them to the capture
+    path (the archive, often a network or USB drive), verifying every copy.
+    Slow archive storage then never holds up capture.
+
+    Staged copies are kept for a retention period after they are archived,
+    and pruned oldest first sooner when the staging disk runs low. When the
+    archive runs low, migration pauses and files wait in staging.
+    author: Jacob Kosberg
+"""
+
+import os
+import shutil
+import sys
+import threading
+import time
+import zlib
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+MIGRATE_THREADS = 2
+RETENTION_HOURS = 1.0
+MIN_FREE_GB = 5.0
+POLL_SECONDS = 10.0
+COPY_CHUNK_BYTES = 1024 ** 2
+PART_SUFFIX = ".part"
+GB = 1024.0 ** 3
+
+
+def free_bytes(path):
+    """Free space on the disk holding ``path``."""
+    try:
+        return shutil.disk_usage(path).free
+    except AttributeError:
+        pass
+    if sys.platform == 'win32':
+        import ctypes
+        free = ctypes.c_ulonglong()
+        ctypes.windll.kernel32.GetDiskFreeSpaceExW(ctypes.c_wchar_p(path), None, None, ctypes.byref(free))
+        return free.value
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+def checksum(path):
+    crc = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(COPY_CHUNK_BYTES)
+            if not chunk:
+                return crc
+            crc = zlib.crc32(chunk, crc)
+
+
+def copy_verified(source, target):
+    """
+    Copy ``source`` to ``target`` through a temporary file, then read the
+    copy back and compare checksums before putting it in place.
+    """
+    folder = os.path.dirname(target)
+    if not os.path.exists(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            # Another migrator thread made it first.
+            if not os.path.isdir(folder):
+                raise
+    part = target + PART_SUFFIX
+    crc = 0
+    with open(source, "rb") as src:
+        with open(part, "wb") as dst:
+            while True:
+                chunk = src.read(COPY_CHUNK_BYTES)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                dst.write(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+    if checksum(part) != crc:
+        os.remove(part)
+        raise IOError("Copy of %s to %s did not verify." % (source, target))
+    if os.path.exists(target):
+        os.remove(target)
+    os.rename(part, target)
+
+
+class StorageTiers(object):
+    """
+    Migrates captures from ``stagingPath`` to the archive path given with
+    each file, keeping the path below the tier root.
+    """
+    def __init__(self, stagingPath, threads=MIGRATE_THREADS, retentionHours=RETENTION_HOURS,
+            minFreeGB=MIN_FREE_GB):
+        self.stagingPath = stagingPath
+        self.retention = retentionHours * 3600
+        self.minFree = minFreeGB * GB
+        if not os.path.exists(stagingPath):
+            os.makedirs(stagingPath)
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        # Archived files still in staging, oldest first: (time archived, path).
+        self.archived = []
+        self.backlogBytes = 0
+        self.migrated = 0
+        self.migratedBytes = 0
+        self.migrateSeconds = 0.0
+        self.failures = 0
+        self.pruned = 0
+        self.paused = False
+        self.lastPoll = 0.0
+        self.running = True
+        self.threads = [threading.Thread(target=self.run, name="Storage migrator %d" % i)
+            for i in range(threads)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, filename, archivePath):
+        """Queue a file written under the staging path for migration to ``archivePath``."""
+        relative = os.path.relpath(filename, self.stagingPath)
+        size = os.path.getsize(filename)
+        with self.lock:
+            self.backlogBytes += size
+        self.queue.put((filename, os.path.join(archivePath, relative), size))
+
+    def resume(self, archivePath):
+        """Queue files left in staging by an earlier run that never reached the archive."""
+        count = 0
+        for folder, dirs, files in os.walk(self.stagingPath):
+            for name in sorted(files):
+                filename = os.path.join(folder, name)
+                target = os.path.join(archivePath, os.path.relpath(filename, self.stagingPath))
+                if os.path.exists(target) and os.path.getsize(target) == os.path.getsize(filename):
+                    with self.lock:
+                        self.archived.append((os.path.getmtime(filename), filename))
+                else:
+                    self.submit(filename, archivePath)
+                    count += 1
+        with self.lock:
+            self.archived.sort()
+        return count
+
+    def run(self):
+        while self.running:
+            item = self.queue.get()
+            if item is None:
+                break
+            filename, target, size = item
+            if free_bytes(self.existingParent(target)) < self.minFree:
+                if not self.paused:
+                    print("Archive is low on space; captures wait in staging.")
+                self.paused = True
+                self.queue.put(item)
+                time.sleep(POLL_SECONDS)
+                continue
+            self.paused = False
+            start = time.time()
+            try:
+                copy_verified(filename, target)
+            except (IOError, OSError) as e:
+                print("Migrating %s failed: %s" % (filename, e))
+                with self.lock:
+                    self.failures += 1
+                # Try again later rather than lose the file.
+                self.queue.put(item)
+                time.sleep(POLL_SECONDS)
+                continue
+            with self.lock:
+                self.migrated += 1
+                self.migratedBytes += size
+                self.backlogBytes -= size
+                self.migrateSeconds += time.time() - start
+                self.archived.append((time.time(), filename))
+
+    def existingParent(self, path):
+        # Absolute, so a relative path can't walk up to "" and loop forever.
+        path = os.path.abspath(path)
+        while not os.path.exists(path):
+            path = os.path.dirname(path)
+        return path
+
+    def poll(self):
+        """Prune staged copies past retention or while staging is low on space. Cheap to call often."""
+        if time.time() - self.lastPoll < POLL_SECONDS:
+            return
+        self.lastPoll = time.time()
+        lowSpace = free_bytes(self.stagingPath) < self.minFree
+        while True:
+            with self.lock:
+                if not self.archived:
+                    break
+                archivedAt, filename = self.archived[0]
+                if not lowSpace and time.time() - archivedAt < self.retention:
+                    break
+                self.archived.pop(0)
+            try:
+                os.remove(filename)
+                self.pruned += 1
+            except OSError:
+                pass
+            if lowSpace:
+                lowSpace = free_bytes(self.stagingPath) < self.minFree
+        if lowSpace:
+            print("Staging is low on space with %d files not archived yet!" % self.queue.qsize())
+
+    def stop(self):
+        """Stop the migrators; files still queued stay in staging for the next run."""
+        self.running = False
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join(POLL_SECONDS)
+
+    def report(self):
+        seconds = self.migrateSeconds / len(self.threads)
+        return ["Storage: %d files (%.1f MB) archived at %.1f MB/s, backlog %d files (%.1f MB), "
+            "%d failed copies retried, %d staged copies pruned" % (self.migrated, self.migratedBytes / 1024.0 ** 2,
+            self.migratedBytes / 1024.0 ** 2 / seconds if seconds else 0.0, self.queue.qsize(),
+            self.backlogBytes / 1024.0 ** 2, self.failures, self.pruned)]
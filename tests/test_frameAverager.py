@@ -0,0 +1,40 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+
+try:
+    import frameAverager
+except ImportError:
+    frameAverager = None
+
+
+@unittest.skipIf(frameAverager is None, "needs OpenCV")
+class SigmaClipTest(unittest.TestCase):
+    def average(self, values, sigma=2.0):
+        averager = frameAverager.FrameAverager((2, 2), sigma)
+        for value in values:
+            averager.add(numpy.full((2, 2), value, numpy.uint8))
+        return averager
+
+    def test_constant_warmup_still_averages(self):
+        # Equal warm-up samples leave no variance; later samples must still count.
+        averager = self.average([10, 10, 10, 11, 11, 11, 11, 11, 11, 11])
+        self.assertTrue((averager.n == 10).all())
+        self.assertAlmostEqual(float(averager.mean[0, 0]), 10.7, places=4)
+
+    def test_outlier_after_constant_warmup_is_clipped(self):
+        averager = self.average([10, 10, 10, 200])
+        self.assertTrue((averager.n == 3).all())
+        self.assertTrue((averager.result() == 10).all())
+
+    def test_fractional_sigma(self):
+        averager = self.average([10, 12, 10, 12, 30], sigma=2.5)
+        self.assertTrue((averager.n == 4).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
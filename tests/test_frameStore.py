@@ -0,0 +1,57 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+
+import frameStore
+
+
+class TornIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def frame(self, value):
+        return numpy.full((4, 6, 3), value, numpy.uint8)
+
+    def test_append_after_torn_last_line(self):
+        writer = frameStore.FrameStoreWriter(self.path)
+        writer.append(self.frame(1), 1.0)
+        writer.append(self.frame(2), 2.0)
+        writer.close()
+        # A crash mid-append: frame bytes and half an index line on disk.
+        with open(frameStore.chunk_filename(self.path, 0), "ab") as f:
+            f.write(self.frame(9).tobytes()[:30])
+        with open(os.path.join(self.path, frameStore.INDEX_FILENAME), "a") as f:
+            f.write("0,144,3.0")
+
+        writer = frameStore.FrameStoreWriter(self.path)
+        self.assertEqual(writer.append(self.frame(3), 3.0), 2)
+        writer.close()
+
+        store = frameStore.FrameStore(self.path)
+        self.assertEqual(len(store), 3)
+        for i, value in enumerate((1, 2, 3)):
+            self.assertTrue((store[i] == value).all())
+        self.assertEqual(store.entries[2].timestamp, 3.0)
+
+    def test_partial_header(self):
+        with open(os.path.join(self.path, frameStore.INDEX_FILENAME), "w") as f:
+            f.write("chunk,off")
+        writer = frameStore.FrameStoreWriter(self.path)
+        writer.append(self.frame(5), 5.0)
+        writer.close()
+        store = frameStore.FrameStore(self.path)
+        self.assertEqual(len(store), 1)
+        self.assertTrue((store[0] == 5).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
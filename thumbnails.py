@@ -0,0 +1,172 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Thumbnail pyramids for captured frames, so long timelapses can be
+    scrubbed without opening full-resolution images. Thumbnails live next to
+    the captures:
+
+        <capturePath>/<device>/thumbs/<width>/<capture name>.jpg
+
+    Backfill existing capture folders in parallel with:
+
+        python thumbnails.py <capturePath> [<width>,<width>,...]
+
+    author: Jacob Kosberg
+"""
+
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import cv2
+
+DEFAULT_WIDTHS = (320, 80)
+THUMBNAIL_FOLDER = "thumbs"
+JPEG_QUALITY = 85
+QUEUE_SIZE = 32
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".webp", ".npy")
+
+
+def thumbnail_path(deviceDir, name, width):
+    return os.path.join(deviceDir, THUMBNAIL_FOLDER, str(width), name + ".jpg")
+
+
+def write_pyramid(frame, deviceDir, name, widths=DEFAULT_WIDTHS):
+    """
+    Write one thumbnail per width, largest first. Each level is downscaled
+    from the previous one, so only the first resize touches the full frame.
+    Returns the paths written.
+    """
+    paths = []
+    level = frame
+    for width in sorted(widths, reverse=True):
+        height = max(1, int(round(level.shape[0] * float(width) / level.shape[1])))
+        if width < level.shape[1]:
+            level = cv2.resize(level, (width, height), interpolation=cv2.INTER_AREA)
+        path = thumbnail_path(deviceDir, name, width)
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                pass  # created by another backfill worker meanwhile
+        cv2.imwrite(path, level, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        paths.append(path)
+    return paths
+
+
+class ThumbnailWriter(threading.Thread):
+    """
+    Writes thumbnail pyramids in the background from frames already in
+    memory. When the queue is full frames are dropped rather than holding
+    up capture; the backfill can fill the gaps later. ``onWritten`` is
+    called with the path of every thumbnail written, from this thread.
+    """
+    def __init__(self, widths=DEFAULT_WIDTHS, onWritten=None):
+        threading.Thread.__init__(self, name="Thumbnails")
+        self.daemon = True
+        self.widths = widths
+        self.onWritten = onWritten
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.written = 0
+        self.dropped = 0
+        self.seconds = 0.0
+
+    def submit(self, frame, deviceDir, name):
+        # Frames that are views (e.g. into a shared-memory ring) can change
+        # under us once capture moves on, so keep a private copy.
+        if frame.base is not None:
+            frame = frame.copy()
+        try:
+            self.queue.put_nowait((frame, deviceDir, name))
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            start = time.time()
+            try:
+                paths = write_pyramid(item[0], item[1], item[2], self.widths)
+                self.written += 1
+                if self.onWritten:
+                    for path in paths:
+                        self.onWritten(path)
+            except (cv2.error, IOError, OSError) as e:
+                print("Thumbnail of %s failed: %s" % (item[2], e))
+            self.seconds += time.time() - start
+
+    def stop(self):
+        """Finish queued thumbnails and stop the thread."""
+        self.queue.put(None)
+        self.join()
+
+    def report(self):
+        mean = 1000 * self.seconds / self.written if self.written else 0.0
+        return "Thumbnails: %d written (%.1f ms each), %d dropped" % (self.written, mean, self.dropped)
+
+
+def _backfill_one(job):
+    import encoders
+    path, widths = job
+    deviceDir = os.path.dirname(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    frame = encoders.read_image(path)
+    if frame is None:
+        return 0
+    write_pyramid(frame, deviceDir, name, widths)
+    return 1
+
+
+def find_missing(capturePath, widths=DEFAULT_WIDTHS):
+    """Captured images under ``capturePath`` that lack a thumbnail of some width."""
+    missing = []
+    for root, dirs, files in os.walk(capturePath):
+        # Skip thumbnail folders, frame stores and reconstruction inputs.
+        dirs[:] = [d for d in dirs if d not in (THUMBNAIL_FOLDER, "frames", "reconstruction")]
+        for filename in files:
+            name, extension = os.path.splitext(filename)
+            if extension.lower() not in IMAGE_EXTENSIONS:
+                continue
+            if not all(os.path.exists(thumbnail_path(root, name, width)) for width in widths):
+                missing.append(os.path.join(root, filename))
+    return sorted(missing)
+
+
+def backfill(capturePath, widths=DEFAULT_WIDTHS, processes=None):
+    """Thumbnail every image that has none yet, spread over ``processes`` workers."""
+    paths = find_missing(capturePath, widths)
+    pool = multiprocessing.Pool(processes)
+    try:
+        done = sum(pool.imap_unordered(_backfill_one, [(path, widths) for path in paths], chunksize=16))
+    finally:
+        pool.close()
+        pool.join()
+    return done
+
+
+def parse_widths(text):
+    return tuple(int(width) for width in text.split(",") if width)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python thumbnails.py <capturePath> [<width>,<width>,...]")
+        sys.exit(1)
+    widths = parse_widths(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_WIDTHS
+    start = time.time()
+    done = backfill(sys.argv[1], widths)
+    print("Thumbnailed %d images in %.1f s" % (done, time.time() - start))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    Timelapse videos per camera. While capturing, every frame can also be
+    appended to a video in the background; videos roll over every N frames so
+    a crash only loses the part being written. Videos go to:
+
+        <capturePath>/<device>/video/<start time>_<part>.avi
+
+    Build videos offline from existing capture folders, one process per
+    camera folder, with:
+
+        python timelapseVideo.py <capturePath> [<fps>]
+
+    author: Jacob Kosberg
+"""
+
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import cv2
+
+VIDEO_FOLDER = "video"
+VIDEO_FPS = 10.0
+FRAMES_PER_PART = 1000
+QUEUE_SIZE = 32
+FOURCC = "MJPG"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".webp", ".npy")
+
+
+class RollingVideoWriter(object):
+    """
+    A cv2.VideoWriter that starts a new file every ``framesPerPart`` frames.
+    ``onClosed`` is called with the file name of every finished part.
+    """
+    def __init__(self, folder, fps=VIDEO_FPS, framesPerPart=FRAMES_PER_PART, onClosed=None):
+        self.folder = folder
+        self.fps = fps
+        self.framesPerPart = framesPerPart
+        self.onClosed = onClosed
+        self.filename = None
+        self.writer = None
+        self.size = None
+        self.frames = 0
+        self.part = 0
+        self.prefix = time.strftime("%Y-%m-%d_%H-%M-%S")
+
+    def open(self, size):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        filename = os.path.join(self.folder, "%s_%03d.avi" % (self.prefix, self.part))
+        self.writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*FOURCC), self.fps, size)
+        if not self.writer.isOpened():
+            self.writer = None
+            raise IOError("Could not open video " + filename)
+        self.filename = filename
+        self.size = size
+        self.frames = 0
+        self.part += 1
+
+    def write(self, frame):
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        size = (frame.shape[1], frame.shape[0])
+        # A new part also starts when the frame size changes, e.g. on rotation.
+        if self.writer is None or self.frames >= self.framesPerPart or size != self.size:
+            self.close()
+            self.open(size)
+        self.writer.write(frame)
+        self.frames += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
+            if self.onClosed:
+                self.onClosed(self.filename)
+
+
+class VideoRecorder(threading.Thread):
+    """
+    Appends captured frames to per-camera rolling videos in a background
+    thread. Frames are dropped rather than stalling capture when it falls
+    behind. ``onClosed`` is called with every finished part, from this thread.
+    """
+    def __init__(self, fps=VIDEO_FPS, framesPerPart=FRAMES_PER_PART, onClosed=None):
+        threading.Thread.__init__(self, name="Timelapse video")
+        self.daemon = True
+        self.fps = fps
+        self.framesPerPart = framesPerPart
+        self.onClosed = onClosed
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.writers = {}
+        self.written = 0
+        self.dropped = 0
+
+    def submit(self, frame, deviceDir):
+        if frame.base is not None:
+            frame = frame.copy()
+        try:
+            self.queue.put_nowait((frame, deviceDir))
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            frame, deviceDir = item
+            if deviceDir not in self.writers:
+                self.writers[deviceDir] = RollingVideoWriter(
+                    os.path.join(deviceDir, VIDEO_FOLDER), self.fps, self.framesPerPart, self.onClosed)
+            try:
+                self.writers[deviceDir].write(frame)
+                self.written += 1
+            except (cv2.error, IOError) as e:
+                print("Video frame for %s failed: %s" % (deviceDir, e))
+        for writer in self.writers.values():
+            writer.close()
+
+    def stop(self):
+        """Write out queued frames, close all videos and stop the thread."""
+        self.queue.put(None)
+        self.join()
+
+    def report(self):
+        return "Timelapse video: %d frames written, %d dropped" % (self.written, self.dropped)
+
+
+def list_images(folder):
+    return sorted(os.path.join(folder, f) for f in os.listdir(folder)
+        if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS)
+
+
+def assemble_folder(job):
+    """Build rolling videos from the images of one camera folder."""
+    import encoders
+    folder, fps, framesPerPart = job
+    writer = RollingVideoWriter(os.path.join(folder, VIDEO_FOLDER), fps, framesPerPart)
+    count = 0
+    try:
+        for path in list_images(folder):
+            frame = encoders.read_image(path)
+            if frame is not None:
+                writer.write(frame)
+                count += 1
+    finally:
+        writer.close()
+    return folder, count
+
+
+def assemble(capturePath, fps=VIDEO_FPS, framesPerPart=FRAMES_PER_PART, processes=None):
+    """Assemble videos for every camera folder under ``capturePath`` in parallel."""
+    folders = [os.path.join(capturePath, d) for d in sorted(os.listdir(capturePath))
+        if d != "reconstruction" and os.path.isdir(os.path.join(capturePath, d))]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(assemble_folder, [(folder, fps, framesPerPart) for folder in folders])
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python timelapseVideo.py <capturePath> [<fps>]")
+        sys.exit(1)
+    fps = float(sys.argv[2]) if len(sys.argv) > 2 else VIDEO_FPS
+    start = time.time()
+    for folder, count in assemble(sys.argv[1], fps):
+        print("%s: %d frames" % (folder, count))
+    print("Done in %.1f s" % (time.time() - start))
+
+if __name__ == "__main__":
+    main()